@@ -1,22 +1,69 @@
 ###############################################################################
 # This is all-in-one sample tht demonstates how to submit orders
+# Interactive: python3 fix-client.py fix-client.cfg
+# Bulk:        python3 fix-client.py fix-client.cfg --input orders.csv [-w WINDOW] [-r RATE]
 ###############################################################################
 
+import os
 import sys
+import csv
+import json
 import time
 import argparse
-import quickfix as fix
+import threading
 import configparser
 
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description='FIX Client')
+    parser.add_argument('config_file', type=str, help='Name of configuration file')
+    parser.add_argument("--input", type=str, default=None, help="Submit the orders of this file (- for stdin) instead of reading commands interactively")
+    parser.add_argument("-f", "--format", type=str, choices=["csv", "jsonl", "commands"], default=None, help="Input format, by default from the file extension (.csv, .jsonl, otherwise commands)")
+    parser.add_argument("-w", "--window", type=int, default=100, help="Maximum number of orders waiting for an execution report")
+    parser.add_argument("-r", "--rate", type=float, default=None, help="Maximum orders per second")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for the execution reports of the last orders")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print every order and execution report in bulk mode")
+    return parser
+
+
+if __name__=='__main__':
+    # arguments are parsed before QuickFIX is loaded, so --help and usage errors do not wait for it
+    args = get_argument_parser().parse_args()
+
+import quickfix as fix
+from fix_factories import create_initiator
+from fix_throttle import TokenBucket
+from fix_decoder import print_message
+from fix_decoder import SIDE_NAMES
+from fix_decoder import ORDER_TYPE_NAMES
+
+
 class Application(fix.Application):
     exec_id = 0
     sessionID = None
     sessionPwd = None
+    messageLog = None
     logged_out = False
+    verbose = True
+    tracker = None
+
+    def __init__(self):
+        super().__init__()
+        self.status_changed = threading.Event() # set on every logon and logout
+
+    def setVerbose(self, verbose):
+        # print every sent order and received message
+        self.verbose = verbose
+
+    def setOrderTracker(self, tracker):
+        self.tracker = tracker
 
     def setSessionPassword(self, password):
         self.sessionPwd = password
 
+    def setMessageLog(self, messageLog):
+        self.messageLog = messageLog
+
     def gen_exec_id(self):
         new_id = time.time_ns()
         self.exec_id = new_id if self.exec_id < new_id else self.exec_id + 1
@@ -29,12 +76,14 @@ class Application(fix.Application):
         print("Session %s successfully logged in" % sessionID)
         self.sessionID = sessionID
         self.logged_out = False
+        self.status_changed.set()
         return
 
     def onLogout(self, sessionID):
         print("Session %s logged out" % sessionID)
         self.sessionID = None
         self.logged_out = True
+        self.status_changed.set()
         return
 
     def toAdmin(self, message, sessionID):
@@ -42,17 +91,28 @@ class Application(fix.Application):
         message.getHeader().getField(msgType)
         if msgType.getValue() == fix.MsgType_Logon :
             message.getHeader().setField(fix.Password(self.sessionPwd))
+        if self.messageLog is not None:
+            self.messageLog.onOutgoing(sessionID, message)
         return
 
     def fromAdmin(self, message, sessionID):
+        if self.messageLog is not None:
+            self.messageLog.onIncoming(sessionID, message)
         return
 
     def toApp(self, message, sessionID):
+        if self.messageLog is not None:
+            self.messageLog.onOutgoing(sessionID, message)
         return
 
     def fromApp(self, message, sessionID):
-        print("Received message: ", end='')
-        print_message(message)
+        if self.messageLog is not None:
+            self.messageLog.onIncoming(sessionID, message)
+        if self.tracker is not None:
+            self.tracker.on_message(message)
+        if self.verbose:
+            print("Received message: ", end='')
+            print_message(message)
         return
 
     def submit_order(self, symbol, side, order_type, quantity, price, destination, exchange):
@@ -80,109 +140,190 @@ class Application(fix.Application):
 
         trade.setField(fix.TransactTime())
 
-        side = "BUY" if side == fix.Side_BUY else "SELL"
-        order_type = "LIMIT" if order_type == fix.OrdType_LIMIT else "MARKET"
-        print("Sending order: OrderID=%s, SessionID=%s, OrderType=%s, Symbol=%s, Side=%s, Quantity=%s, Price=%s, Destination=%s, Exchange=%s" %
-              (order_id, self.sessionID, order_type, symbol, side, quantity, price, destination, exchange))
-        fix.Session.sendToTarget(trade, self.sessionID)
+        if self.verbose:
+            side = SIDE_NAMES.get(side, side)
+            order_type = ORDER_TYPE_NAMES.get(order_type, order_type)
+            print("Sending order: OrderID=%s, SessionID=%s, OrderType=%s, Symbol=%s, Side=%s, Quantity=%s, Price=%s, Destination=%s, Exchange=%s" %
+                  (order_id, self.sessionID, order_type, symbol, side, quantity, price, destination, exchange))
+        if self.tracker is not None:
+            self.tracker.on_send(order_id)
+        try:
+            fix.Session.sendToTarget(trade, self.sessionID)
+        except:
+            if self.tracker is not None:
+                self.tracker.on_send_failed(order_id)
+            raise
+        return order_id
 
 # End of Application
 
-def print_message(msg):
-    msg_str = ''
-    msg_type = get_field_value(fix.MsgType(), msg.getHeader())
-    if msg_type == fix.MsgType_News:
-        msg_str = "MessageType=News, Sender="
-        msg_str += get_field_value(fix.SenderCompID(), msg.getHeader())
-        msg_str += ", HeadLine="
-        msg_str += get_field_value(fix.Headline(), msg)
-        msg_str += ", Text="
-        msg_str += get_field_value(fix.Text(), msg)
-    else:
-        msg_str = "OrderID="
-        msg_str += get_field_value(fix.ClOrdID(), msg)
-        msg_str += ", MessageType="
-        msg_str += get_message_type(msg)
-        msg_str += ", Sender="
-        msg_str += get_field_value(fix.SenderCompID(), msg.getHeader())
-        msg_str += ", Target="
-        msg_str += get_field_value(fix.TargetCompID(), msg.getHeader())
-        msg_str += ", OrderType=" #40 1-Market, 2-Limit
-        msg_str += get_order_type(msg)
-        msg_str += ", Side=" #54 1-Buy,2-Sell
-        msg_str += 'BUY' if get_field_value(fix.Side(), msg) == fix.Side_BUY else 'SELL'
-        msg_str += ", Quantity=" #38
-        msg_str += str(get_field_value(fix.OrderQty(), msg))
-        msg_str += ", Price="
-        msg_str += str(get_field_value(fix.Price(), msg))
-        msg_str += ", Symbol="
-        msg_str += get_field_value(fix.Symbol(), msg)
-        msg_str += ", ExecutionType=" #150
-        msg_str += get_exec_type(msg)
-        if msg.isSetField(fix.Text().getField()):
-            msg_str += ", Text="
-            msg_str += get_field_value(fix.Text(), msg)
-        msg_str += ", ExecutedQuantity=" #14
-        msg_str += str(get_field_value(fix.CumQty(), msg))
-        msg_str += ", OrderStatus=" #39
-        msg_str += get_order_status(msg)
-
-    print(msg_str)
-
-def get_field_value(fobj, msg):
-    if msg.isSetField(fobj.getField()):
-        msg.getField(fobj)
-        return fobj.getValue()
-    else:
-        return "None"
-
-def get_message_type(msg) :
-    msg_type = get_field_value(fix.MsgType(), msg.getHeader())
-    if msg_type == fix.MsgType_ExecutionReport:
-        return "ExecutionReport"
-    elif msg_type == fix.MsgType_News:
-        return "News"
-    elif msg_type == fix.MsgType_NewOrderSingle:
-        return "NewOrderSingle"
-    else:
-        return msg_type
-
-def get_order_type(msg):
-    ord_type = get_field_value(fix.OrdType(), msg)
-    if ord_type == fix.OrdType_LIMIT:
-        return "LIMIT"
-    elif ord_type == fix.OrdType_MARKET:
-        return "MARKET"
-    else:
-        return ord_type
-
-def get_exec_type(msg):
-    rpt = get_field_value(fix.ExecType(), msg)
-    if rpt == fix.ExecType_NEW:
-        return "NEW"
-    elif rpt == fix.ExecType_REJECTED:
-        return "REJECTED"
-    elif rpt == fix.ExecType_TRADE:
-        return "FILLED"
-    elif rpt == fix.ExecType_CANCELED:
-        return "CANCELED"
-    else:
-        return rpt
-
-def get_order_status(msg):
-    status = get_field_value(fix.OrdStatus(), msg)
-    if status == fix.OrdStatus_NEW:
-        return "NEW"
-    elif status == fix.OrdStatus_FILLED:
-        return "FILLED"
-    elif status == fix.OrdStatus_REJECTED:
-        return "REJECTED"
-    elif status == fix.OrdStatus_CANCELED:
-        return "CANCELED"
-    else:
-        return status
 
-def main(config_file):
+class OrderTracker(object):
+    # Bulk mode bookkeeping: keeps at most window orders waiting for their first execution report
+    # and measures the ack latency of every order
+
+    def __init__(self, window):
+        self.window = threading.BoundedSemaphore(window)
+        self.pending = {}         # ClOrdID -> time.perf_counter_ns() at send
+        self.ack_latencies = []   # nanoseconds
+        self.reject_count = 0
+        self.sent_count = 0
+        self.first_send_time = None
+        self.last_ack_time = None
+        self.lock = threading.Lock()
+        self.drained = threading.Condition(self.lock)
+
+    def acquire(self):
+        self.window.acquire()
+
+    def on_send(self, order_id):
+        # called before sendToTarget, the execution report may arrive before it returns
+        now = time.perf_counter_ns()
+        with self.lock:
+            self.pending[order_id] = now
+            self.sent_count += 1
+            if self.first_send_time is None:
+                self.first_send_time = now
+
+    def on_send_failed(self, order_id):
+        with self.lock:
+            self.pending.pop(order_id, None)
+            self.sent_count -= 1
+        self.window.release()
+
+    def on_message(self, message):
+        if message.getHeader().getField(35) != fix.MsgType_ExecutionReport or not message.isSetField(11):
+            return
+        exec_type = message.getField(150)
+        if exec_type == fix.ExecType_PENDING_NEW:
+            return
+        now = time.perf_counter_ns()
+        with self.lock:
+            send_time = self.pending.pop(message.getField(11), None)
+            if send_time is None:
+                return
+            self.ack_latencies.append(now - send_time)
+            self.last_ack_time = now
+            if exec_type == fix.ExecType_REJECTED:
+                self.reject_count += 1
+            if not self.pending:
+                self.drained.notify_all()
+        self.window.release()
+
+    def wait_drained(self, timeout):
+        # True once every sent order got an execution report
+        with self.lock:
+            return self.drained.wait_for(lambda: not self.pending, timeout)
+
+    def get_report(self):
+        with self.lock:
+            latencies = sorted(self.ack_latencies)
+            lines = ["Orders sent: %s, acknowledged: %s, rejected: %s, unanswered: %s" %
+                     (self.sent_count, len(latencies), self.reject_count, len(self.pending))]
+            if latencies:
+                elapsed = (self.last_ack_time - self.first_send_time) / 1e9
+                lines.append("Throughput: %.0f orders/s (%.3f s from first order to last ack)" % (len(latencies) / elapsed if elapsed > 0 else 0, elapsed))
+                lines.append("Ack latency ms: p50=%.3f, p90=%.3f, p99=%.3f, p99.9=%.3f, max=%.3f" %
+                             tuple(get_percentile(latencies, percentile) / 1e6 for percentile in (50, 90, 99, 99.9, 100)))
+        return "\n".join(lines)
+
+# End of OrderTracker
+
+
+def get_percentile(sorted_values, percentile):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))]
+
+
+def get_command_parser():
+    parser = argparse.ArgumentParser(description='CLI Command', prog="command", usage="help | exit | {buy,sell} -s SYMBOL -q QUANTITY [-t {LIMIT,MARKET}] [-p PRICE] [-d DESTINATION] [-e EXCHANGE] [-n ORDER_COUNT] [-i INTERVAL]")
+    parser.add_argument("command", type=str, choices=["buy", "sell"], help="Command")
+    parser.add_argument("-s", "--symbol", type=str, required=True, help="Order instrument symbol")
+    parser.add_argument("-q", "--quantity", type=float, required=True, help="Order quantity")
+    parser.add_argument("-t", "--order_type", type=str, choices=["LIMIT", "MARKET"], default="MARKET", help="Order type")
+    parser.add_argument("-p", "--price", type=float, default=None, help="Order limit price")
+    parser.add_argument("-d", "--destination", type=str, default="SIM", help="Destination ID")
+    parser.add_argument("-e", "--exchange", type=str, default=None, help="Exchange ID")
+    parser.add_argument("-n", "--order_count", type=int,  default=1, help="Number of orders to submit")
+    parser.add_argument("-i", "--interval", type=float, default=5, help="Number of seconds between orders, fractions are allowed (0 sends orders back to back)")
+    return parser
+
+
+def get_order(side, symbol, quantity, order_type="MARKET", price=None, destination="SIM", exchange=None):
+    # (symbol, side, order type, quantity, price, destination, exchange) arguments of Application.submit_order
+    side = side.strip().lower()
+    if side not in ("buy", "sell"):
+        raise Exception("Unknown side: %s" % side)
+    order_type = (order_type or "MARKET").strip().upper()
+    if order_type not in ("LIMIT", "MARKET"):
+        raise Exception("Unknown order type: %s" % order_type)
+    price = float(price) if price not in (None, "") else None
+    if order_type == "LIMIT" and price is None:
+        raise Exception("Please specify LIMIT order price")
+    return (symbol, fix.Side_BUY if side == "buy" else fix.Side_SELL, fix.OrdType_LIMIT if order_type == "LIMIT" else fix.OrdType_MARKET,
+            float(quantity), price, destination or None, exchange or None)
+
+
+def read_orders(stream, input_format):
+    # yields submit_order arguments of every order in stream:
+    #   csv      - header line, then side,symbol,quantity[,order_type,price,destination,exchange] per order
+    #   jsonl    - one object per line with the same keys
+    #   commands - buy/sell commands of the interactive mode, -n repeats the order and -i is ignored
+    if input_format == "csv":
+        for row in csv.DictReader(stream):
+            yield get_order(**dict((key.strip(), value.strip()) for key, value in row.items() if key and value))
+    elif input_format == "jsonl":
+        for line in stream:
+            if line.strip():
+                yield get_order(**json.loads(line))
+    else:
+        parser = get_command_parser()
+        for line_number, line in enumerate(stream, 1):
+            command_args = line.split()
+            if not command_args or command_args[0].startswith("#"):
+                continue
+            try:
+                args = parser.parse_args(command_args)
+            except SystemExit:
+                # argparse exits on invalid arguments after printing the usage, a bad line only stops sending
+                raise ValueError("Invalid command on line %s: %s" % (line_number, line.strip()))
+            order = get_order(args.command, args.symbol, args.quantity, args.order_type, args.price, args.destination, args.exchange)
+            for x in range(args.order_count):
+                yield order
+
+
+def get_input_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    return "csv" if extension == ".csv" else "jsonl" if extension in (".jsonl", ".json") else "commands"
+
+
+def run_bulk(application, input_path, input_format, window, rate, timeout):
+    # streams the orders of input_path ("-" for stdin) with up to window orders waiting for an ack.
+    # Returns the exit status: 0, 1 if sending stopped on an error, 2 if some orders got no execution report within timeout
+    tracker = OrderTracker(window)
+    application.setOrderTracker(tracker)
+    pacer = TokenBucket(rate) if rate else None
+    status = 0
+    stream = sys.stdin if input_path == "-" else open(input_path, newline="")
+    try:
+        for symbol, side, order_type, quantity, price, destination, exchange in read_orders(stream, input_format or get_input_format(input_path)):
+            tracker.acquire()
+            if pacer is not None:
+                pacer.acquire()
+            application.submit_order(symbol, side, order_type, quantity, price, destination, exchange)
+    except Exception as e:
+        # invalid input or lost session: stop sending, still report the orders sent so far
+        print("Stopped sending: %s" % e)
+        status = 1
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    if not tracker.wait_drained(timeout) and status == 0:
+        status = 2
+    print(tracker.get_report())
+    return status
+
+
+def main(config_file, input_path=None, input_format=None, window=100, rate=None, timeout=30.0, verbose=False):
     try:
         config = configparser.ConfigParser()
         config.read(config_file)
@@ -193,71 +334,71 @@ def main(config_file):
         settings = fix.SessionSettings(config_file)
         application = Application()
         application.setSessionPassword(sender_pwd)
-        store_factory = fix.FileStoreFactory(settings)
-        log_factory = fix.FileLogFactory(settings)
-        initiator = fix.SocketInitiator(application, store_factory, settings, log_factory)
-        initiator.start()
-
-        parser = argparse.ArgumentParser(description='CLI Command', prog="command", usage="help | exit | {buy,sell} -s SYMBOL -q QUANTITY [-t {LIMIT,MARKET}] [-p PRICE] [-d DESTINATION] [-e EXCHANGE] [-n ORDER_COUNT] [-i INTERVAL]")
-        parser.add_argument("command", type=str, choices=["buy", "sell"], help="Command")
-        parser.add_argument("-s", "--symbol", type=str, required=True, help="Order instrument symbol")
-        parser.add_argument("-q", "--quantity", type=float, required=True, help="Order quantity")
-        parser.add_argument("-t", "--order_type", type=str, choices=["LIMIT", "MARKET"], default="MARKET", help="Order type")
-        parser.add_argument("-p", "--price", type=float, default=None, help="Order limit price")
-        parser.add_argument("-d", "--destination", type=str, default="SIM", help="Destination ID")
-        parser.add_argument("-e", "--exchange", type=str, default=None, help="Exchange ID")
-        parser.add_argument("-n", "--order_count", type=int,  default=1, help="Number of orders to submit")
-        parser.add_argument("-i", "--interval", type=int, default=5, help="Number of seconds between orders")
-
-        # wait for the client to login
-        while not application.sessionID and not application.logged_out:
-            time.sleep(0.5)
-
-        if not application.sessionID:
-            print("Login failed")
-            exit(1)
-
-        while 1:
-            print("--> ", end='')
-            command = input().strip()
-            if not command:
-                continue
-
-            command_args = command.split(' ') if ' ' in command else [ command ]
-            command = command_args[0]
-
-            if command == "buy" or command == "sell":
-                try :
-                    args = parser.parse_args(command_args)
-
-                    side = fix.Side_BUY if command == "buy" else fix.Side_SELL
-                    order_type = fix.OrdType_LIMIT if args.order_type == "LIMIT" else fix.OrdType_MARKET
-
-                    if order_type == fix.OrdType_LIMIT and args.price is None:
-                        print("Please specify LIMIT order price")
-                        continue
-
-                    for x in range(args.order_count):
-                        if x > 0:
-                            time.sleep(args.interval)
-                        application.submit_order(args.symbol, side, order_type, args.quantity, args.price, args.destination, args.exchange)
-
-                    time.sleep(0.5) # wait a bit for response
-                except:
-                    print(sys.exc_info()[1])
-            elif command == "quit" or command == "exit":
-                sys.exit(0)
-            elif command == "help":
-                parser.print_usage()
-            else:
-                print("Unknown command: %s" % command)
-                parser.print_usage()
+        application.setVerbose(input_path is None or verbose)
+        initiator, store_factory, log_factory = create_initiator(application, settings, config)
+        try:
+            start_time = time.perf_counter()
+            initiator.start()
+
+            parser = get_command_parser()
+
+            # wait for the client to login
+            application.status_changed.wait()
+
+            if not application.sessionID:
+                print("Login failed")
+                exit(1)
+
+            print("Logged in after %.3f ms" % ((time.perf_counter() - start_time) * 1000))
+
+            if input_path is not None:
+                sys.exit(run_bulk(application, input_path, input_format, window, rate, timeout))
+
+            while 1:
+                print("--> ", end='')
+                command = input().strip()
+                if not command:
+                    continue
+
+                command_args = command.split(' ') if ' ' in command else [ command ]
+                command = command_args[0]
+
+                if command == "buy" or command == "sell":
+                    try :
+                        args = parser.parse_args(command_args)
+
+                        side = fix.Side_BUY if command == "buy" else fix.Side_SELL
+                        order_type = fix.OrdType_LIMIT if args.order_type == "LIMIT" else fix.OrdType_MARKET
+
+                        if order_type == fix.OrdType_LIMIT and args.price is None:
+                            print("Please specify LIMIT order price")
+                            continue
+
+                        # paced by a token bucket with sub-millisecond precision instead of sleeping a fixed time after each order
+                        pacer = TokenBucket(1.0 / args.interval) if args.interval > 0 else None
+                        for x in range(args.order_count):
+                            if pacer is not None:
+                                pacer.acquire()
+                            application.submit_order(args.symbol, side, order_type, args.quantity, args.price, args.destination, args.exchange)
+
+                        time.sleep(0.5) # wait a bit for response
+                    except:
+                        print(sys.exc_info()[1])
+                elif command == "quit" or command == "exit":
+                    sys.exit(0)
+                elif command == "help":
+                    parser.print_usage()
+                else:
+                    print("Unknown command: %s" % command)
+                    parser.print_usage()
+        finally:
+            # every exit path, sys.exit included, logs out and writes the tail of the async message log
+            initiator.stop()
+            if application.messageLog is not None:
+                application.messageLog.stop()
 
     except (fix.ConfigError, fix.RuntimeError) as e:
         print(e)
 
 if __name__=='__main__':
-    parser = argparse.ArgumentParser(description='FIX Client')
-    parser.add_argument('config_file', type=str, help='Name of configuration file')
-    args = parser.parse_args()
-    main(args.config_file)
+    main(args.config_file, args.input, args.format, args.window, args.rate, args.timeout, args.verbose)
@@ -0,0 +1,314 @@
+#####################################################################################
+# Execution analytics with NumPy: ExecutionReports from QuickFIX message logs (FileLogPath)
+# or from a live session are turned into structured arrays and aggregated per symbol or
+# destination: orders, rejects, fill rate, filled quantity and VWAP.
+# Logs are parsed in chunks, so multi-GB logs are processed in constant memory.
+# Usage: python3 fix_analytics.py LOG_FILE [LOG_FILE ...] [--by {symbol,destination}] [-p PROCESSES]
+#####################################################################################
+
+import os
+import re
+import argparse
+import multiprocessing
+import numpy as np
+import quickfix as fix
+
+EXECUTION_DTYPE = np.dtype([
+    ("timestamp", "M8[ns]"),  # log time of the message, TransactTime for live reports
+    ("cl_ord_id", "S32"),
+    ("symbol", "S16"),
+    ("destination", "S16"),
+    ("side", "S1"),
+    ("exec_type", "S1"),
+    ("order_status", "S1"),
+    ("quantity", "f8"),
+    ("price", "f8"),
+    ("last_qty", "f8"),
+    ("last_price", "f8"),
+    ("cum_qty", "f8"),
+])
+
+STRING_FIELDS = ("cl_ord_id", "symbol", "destination")  # minimum widths above, widened to the longest value seen
+SUMMARY_FIELDS = ("orders", "rejects", "ordered_qty", "filled_qty", "notional")
+
+MSG_TYPE = re.compile(b"\x0135=([^\x01\n]*)")
+ORDER_EXEC_TYPES = (fix.ExecType_NEW.encode(), fix.ExecType_REJECTED.encode()) # exactly one of them per order
+TAG_PATTERNS = {}
+
+
+def get_tag_pattern(tag):
+    pattern = TAG_PATTERNS.get(tag)
+    if pattern is None:
+        pattern = TAG_PATTERNS[tag] = re.compile(b"\x01" + tag + b"=([^\x01\n]*)")
+    return pattern
+
+
+def extract(buffer, line_count, tag):
+    # values of tag in each of the line_count newline separated lines of buffer, b"" where the tag is missing.
+    # One regular expression scan of the whole buffer, lines are only walked when some of them miss the tag
+    pattern = get_tag_pattern(tag)
+    values = pattern.findall(buffer)
+    if len(values) == line_count:
+        return values
+    if not values:
+        return [b""] * line_count
+    line_starts = np.flatnonzero(np.frombuffer(buffer, dtype="u1") == ord('\n')) + 1
+    result = [b""] * line_count
+    for match in pattern.finditer(buffer):
+        result[np.searchsorted(line_starts, match.start(), side="right")] = match.group(1)
+    return result
+
+
+def to_floats(values):
+    values = np.array(values, dtype="S32")
+    return np.where(values == b"", b"nan", values).astype("f8")
+
+
+def to_times(lines):
+    # YYYYMMDD-HH:MM:SS.fraction prefixes of FileLog and AsyncMessageLog lines to datetime64,
+    # rearranged into ISO format on a byte matrix without a Python loop
+    chars = np.array(lines, dtype="S30").view("u1").reshape(len(lines), 30).copy()
+    chars[np.cumsum(chars == ord(' '), axis=1) > 0] = 0 # cut at " : "
+    iso = np.zeros((len(lines), 32), dtype="u1")
+    iso[:, 0:4] = chars[:, 0:4]
+    iso[:, 4] = ord('-')
+    iso[:, 5:7] = chars[:, 4:6]
+    iso[:, 7] = ord('-')
+    iso[:, 8:10] = chars[:, 6:8]
+    iso[:, 10] = ord('T')
+    iso[:, 11:32] = chars[:, 9:30]
+    return iso.view("S32").ravel().astype("M8[ns]")
+
+
+def parse_log_time(value):
+    return to_times([value])[0]
+
+
+def widen(records, name, values):
+    # records with the string column name wide enough for values instead of truncating them, which would merge orders
+    width = max(map(len, values), default=0)
+    if width <= records.dtype[name].itemsize:
+        return records
+    return records.astype(get_dtype(records.dtype, {name: width}))
+
+
+def get_dtype(dtype, widths):
+    return np.dtype([(name, "S%d" % widths[name] if name in widths else dtype[name]) for name in dtype.names])
+
+
+def concatenate(arrays):
+    # arrays of executions with string columns of different widths
+    widths = dict((name, max(array.dtype[name].itemsize for array in arrays)) for name in STRING_FIELDS)
+    dtype = get_dtype(EXECUTION_DTYPE, widths)
+    return np.concatenate([array.astype(dtype) for array in arrays])
+
+
+def get_list_destinations(lines):
+    # (ClOrdID, ExecBroker) of every order of NewOrderList lines, each order of the list starts with its ClOrdID
+    pattern = get_tag_pattern(b"76")
+    for line in lines:
+        for entry in line.split(b"\x0111=")[1:]:
+            match = pattern.search(entry)
+            if match is not None and match.group(1):
+                yield entry.split(b"\x01", 1)[0], match.group(1)
+
+
+def get_chunks(path, chunk_size):
+    size = os.path.getsize(path)
+    return [(path, start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+
+def parse_chunk(chunk):
+    # (EXECUTION_DTYPE array, {ClOrdID: ExecBroker} of sent orders) of the lines starting in [start, end) of path
+    path, start, end = chunk
+    with open(path, "rb") as log:
+        if start > 0:
+            log.seek(start - 1)
+            log.readline() # the line crossing start belongs to the previous chunk
+        data = log.read(max(0, end - log.tell()))
+        if data and not data.endswith(b"\n"):
+            data += log.readline()
+    return parse_lines(data)
+
+
+def select_lines(data, msg_types):
+    # lists of the lines of data with each of msg_types
+    lines = data.split(b"\n")
+    if lines and not lines[-1]:
+        lines.pop()
+    types = MSG_TYPE.findall(data)
+    if len(types) == len(lines):
+        # one MsgType per line: lines are selected with NumPy masks instead of a Python loop
+        types = np.array(types)
+        lines = np.array(lines, dtype=object)
+        return [lines[types == msg_type.encode()].tolist() for msg_type in msg_types]
+    markers = [b"\x0135=" + msg_type.encode() + b"\x01" for msg_type in msg_types]
+    return [[line for line in lines if marker in line] for marker in markers]
+
+
+def parse_lines(data):
+    orders, order_lists, lines = select_lines(data, (fix.MsgType_NewOrderSingle, fix.MsgType_NewOrderList, fix.MsgType_ExecutionReport))
+    destinations = {}
+    if orders:
+        buffer = b"\n".join(orders)
+        destinations = dict((id, destination) for id, destination in
+                            zip(extract(buffer, len(orders), b"11"), extract(buffer, len(orders), b"76")) if destination)
+    if order_lists:
+        destinations.update(get_list_destinations(order_lists))
+
+    count = len(lines)
+    records = np.zeros(count, dtype=EXECUTION_DTYPE)
+    if count == 0:
+        return records, destinations
+    buffer = b"\n".join(lines)
+    records["timestamp"] = to_times(lines)
+    for name, tag in (("cl_ord_id", b"11"), ("symbol", b"55"), ("destination", b"76"), ("side", b"54"),
+                      ("exec_type", b"150"), ("order_status", b"39")):
+        values = extract(buffer, count, tag)
+        if name in STRING_FIELDS:
+            records = widen(records, name, values)
+        records[name] = values
+    for name, tag in (("quantity", b"38"), ("price", b"44"), ("last_qty", b"32"), ("last_price", b"31"), ("cum_qty", b"14")):
+        records[name] = to_floats(extract(buffer, count, tag))
+    return records, destinations
+
+
+def read_log(path, chunk_size=1 << 26, processes=1, destinations=None):
+    # yields EXECUTION_DTYPE arrays of the ExecutionReports in path, one per chunk_size bytes of log.
+    # With processes > 1 chunks are parsed in parallel and yielded in log order.
+    # Reports without ExecBroker get the destination of their NewOrderSingle or NewOrderList from the same log
+    destinations = {} if destinations is None else destinations # ClOrdID -> ExecBroker of sent orders
+    chunks = get_chunks(path, chunk_size)
+    if processes > 1 and len(chunks) > 1:
+        with multiprocessing.Pool(processes) as pool:
+            for records, chunk_destinations in pool.imap(parse_chunk, chunks):
+                yield resolve_destinations(records, chunk_destinations, destinations)
+    else:
+        for chunk in chunks:
+            records, chunk_destinations = parse_chunk(chunk)
+            yield resolve_destinations(records, chunk_destinations, destinations)
+
+
+def resolve_destinations(records, chunk_destinations, destinations):
+    destinations.update(chunk_destinations)
+    missing = np.flatnonzero(records["destination"] == b"")
+    if len(missing) and destinations:
+        values = [destinations.get(id, b"") for id in records["cl_ord_id"][missing].tolist()]
+        records = widen(records, "destination", values)
+        records["destination"][missing] = values
+    return records
+
+
+def load_log(path, chunk_size=1 << 26, processes=1):
+    chunks = list(read_log(path, chunk_size, processes))
+    return concatenate(chunks) if chunks else np.empty(0, dtype=EXECUTION_DTYPE)
+
+
+def summarize(executions, by="symbol"):
+    # {key: {orders, rejects, ordered_qty, filled_qty, notional}} sums of one array, see aggregate()
+    if len(executions) == 0:
+        return {}
+    keys, index = np.unique(executions[by], return_inverse=True)
+    exec_type = executions["exec_type"]
+    is_order = np.isin(exec_type, ORDER_EXEC_TYPES)
+    is_reject = exec_type == fix.ExecType_REJECTED.encode()
+    is_trade = exec_type == fix.ExecType_TRADE.encode()
+    last_qty = np.where(is_trade, np.nan_to_num(executions["last_qty"]), 0.0)
+    count = len(keys)
+    sums = (
+        np.bincount(index, weights=is_order, minlength=count),
+        np.bincount(index, weights=is_reject, minlength=count),
+        np.bincount(index, weights=np.where(is_order, np.nan_to_num(executions["quantity"]), 0.0), minlength=count),
+        np.bincount(index, weights=last_qty, minlength=count),
+        np.bincount(index, weights=last_qty * np.nan_to_num(executions["last_price"]), minlength=count),
+    )
+    return dict((key.decode(), dict(zip(SUMMARY_FIELDS, values))) for key, values in zip(keys, zip(*[s.tolist() for s in sums])))
+
+
+def merge(total, summary):
+    for key, values in summary.items():
+        target = total.get(key)
+        if target is None:
+            total[key] = dict(values)
+        else:
+            for field in SUMMARY_FIELDS:
+                target[field] += values[field]
+    return total
+
+
+def aggregate(summary):
+    # structured array with one row per key: orders, rejects, reject_ratio, ordered_qty, filled_qty, fill_rate, vwap
+    keys = sorted(summary)
+    result = np.zeros(len(keys), dtype=[("key", "U%d" % max([32] + [len(key) for key in keys])), ("orders", "i8"), ("rejects", "i8"), ("reject_ratio", "f8"),
+                                        ("ordered_qty", "f8"), ("filled_qty", "f8"), ("fill_rate", "f8"), ("vwap", "f8")])
+    if not keys:
+        return result
+    columns = dict((field, np.array([summary[key][field] for key in keys])) for field in SUMMARY_FIELDS)
+    result["key"] = keys
+    result["orders"] = columns["orders"]
+    result["rejects"] = columns["rejects"]
+    result["ordered_qty"] = columns["ordered_qty"]
+    result["filled_qty"] = columns["filled_qty"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result["reject_ratio"] = columns["rejects"] / columns["orders"]
+        result["fill_rate"] = columns["filled_qty"] / columns["ordered_qty"]
+        result["vwap"] = columns["notional"] / columns["filled_qty"]
+    return result
+
+
+def analyze_logs(paths, by="symbol", chunk_size=1 << 26, processes=1):
+    total = {}
+    for path in paths:
+        for executions in read_log(path, chunk_size, processes):
+            merge(total, summarize(executions, by))
+    return aggregate(total)
+
+
+class ExecutionCollector(object):
+    # Execution report listener (FixSession.application.setExecutionReportListener) collecting a live stream
+
+    def __init__(self):
+        self.rows = []
+
+    def __call__(self, event):
+        if event.msg_type != fix.MsgType_ExecutionReport:
+            return
+        self.rows.append((parse_log_time(event.transact_time.encode()) if event.transact_time else "NaT",
+                          event.cl_ord_id or "", event.symbol or "", event.destination or "", event.side or "", event.exec_type or "",
+                          event.order_status or "", nan_if_none(event.quantity), nan_if_none(event.price),
+                          nan_if_none(event.last_qty), nan_if_none(event.last_price), nan_if_none(event.cum_qty)))
+
+    def to_array(self, destinations=None):
+        # destinations is {ClOrdID: destination} for gateways that do not echo ExecBroker in execution reports
+        widths = dict((name, max([EXECUTION_DTYPE[name].itemsize] + [len(row[column].encode()) for row in self.rows]))
+                      for column, name in enumerate(STRING_FIELDS, 1))
+        executions = np.array(self.rows, dtype=get_dtype(EXECUTION_DTYPE, widths))
+        if destinations:
+            missing = executions["destination"] == b""
+            values = [destinations.get(id.decode(), "").encode() for id in executions["cl_ord_id"][missing]]
+            executions = widen(executions, "destination", values)
+            executions["destination"][missing] = values
+        return executions
+
+# End of ExecutionCollector
+
+
+def nan_if_none(value):
+    return np.nan if value is None else value
+
+
+def format_summary(result):
+    lines = ["%-16s %8s %8s %8s %14s %14s %8s %14s" % ("Key", "Orders", "Rejects", "Reject%", "OrderedQty", "FilledQty", "Fill%", "VWAP")]
+    for row in result:
+        lines.append("%-16s %8d %8d %8.2f %14.4f %14.4f %8.2f %14.6f" % (row["key"], row["orders"], row["rejects"], row["reject_ratio"] * 100,
+                                                                        row["ordered_qty"], row["filled_qty"], row["fill_rate"] * 100, row["vwap"]))
+    return "\n".join(lines)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Execution analytics over QuickFIX message logs')
+    parser.add_argument("logs", type=str, nargs="+", help="QuickFIX message log files (FileLogPath/*.messages.*log)")
+    parser.add_argument("--by", type=str, choices=["symbol", "destination"], default="symbol", help="Aggregation key")
+    parser.add_argument("-p", "--processes", type=int, default=1, help="Number of processes parsing log chunks in parallel")
+    args = parser.parse_args()
+    print(format_summary(analyze_logs(args.logs, args.by, processes=args.processes)))
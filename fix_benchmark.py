@@ -0,0 +1,789 @@
+###############################################################################
+# Micro-benchmarks for fix_session hot paths, no FIX Gateway connection needed
+# Usage: python3 fix_benchmark.py {templates,decoding,backends,roundtrip,analytics,books,gc,journal,risk,startup,shards,metrics} [-n COUNT]
+###############################################################################
+import os
+import sys
+import time
+import socket
+import argparse
+import gc
+import tempfile
+import threading
+import contextlib
+import subprocess
+import quickfix as fix
+from fix_session import OrderRequest
+from fix_session import OrderTemplate
+from fix_session import OrderState
+from fix_session import OrderStateEngine
+from fix_session import OrderRequestPool
+from fix_decoder import ExecutionReportEvent
+from fix_decoder import decode_execution_report
+from fix_decoder import format_execution_report
+from fix_decoder import format_message
+from fix_factories import AsyncMessageLog
+from fix_session import FixSession
+from fix_simulator import FixSimulator
+
+
+def measure(name, count, func):
+    start_time = time.perf_counter()
+    func(count)
+    elapsed = time.perf_counter() - start_time
+    print("%-40s %10d ops in %8.3f s, %12.0f ops/s, %8.3f us/op" % (name, count, elapsed, count / elapsed, elapsed * 1000000 / count))
+    return elapsed
+
+
+def new_order_request(id, price=40000.0):
+    request = OrderRequest()
+    request.set_id(id)
+    request.set_symbol("BTCUSD")
+    request.set_side("BUY")
+    request.set_quantity(1.0)
+    request.set_price(price)
+    request.set_order_type(fix.OrdType_LIMIT)
+    request.set_account("GOLD")
+    request.set_destination("SIM")
+    return request
+
+
+def bench_templates(count):
+    requests = [new_order_request(repr(i), 40000.0 + i % 100) for i in range(count)]
+
+    def build_messages(count):
+        for request in requests:
+            request.get_fix_message()
+
+    def build_from_templates(count):
+        templates = {}
+        for request in requests:
+            key = request.get_template_key()
+            template = templates.get(key)
+            if template is None:
+                template = templates[key] = OrderTemplate(request)
+            template.get_fix_message(request)
+
+    baseline = measure("OrderRequest.get_fix_message", count, build_messages)
+    elapsed = measure("OrderTemplate.get_fix_message", count, build_from_templates)
+    print("Speedup: %.2fx" % (baseline / elapsed))
+
+
+def new_execution_report(id):
+    report = fix.Message()
+    report.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+    report.getHeader().setField(fix.MsgType(fix.MsgType_ExecutionReport))
+    report.getHeader().setField(fix.SenderCompID("DELTIX"))
+    report.getHeader().setField(fix.TargetCompID("TCLIENT1"))
+    report.setField(fix.ClOrdID(id))
+    report.setField(fix.OrderID(id))
+    report.setField(fix.ExecID(id))
+    report.setField(fix.ExecType(fix.ExecType_TRADE))
+    report.setField(fix.OrdStatus(fix.OrdStatus_FILLED))
+    report.setField(fix.Symbol("BTCUSD"))
+    report.setField(fix.Side(fix.Side_BUY))
+    report.setField(fix.OrdType(fix.OrdType_LIMIT))
+    report.setField(fix.OrderQty(1.0))
+    report.setField(fix.Price(40000.0))
+    report.setField(fix.LastQty(1.0))
+    report.setField(fix.LastPx(40000.0))
+    report.setField(fix.CumQty(1.0))
+    report.setField(fix.LeavesQty(0.0))
+    report.setField(fix.AvgPx(40000.0))
+    report.setField(fix.TransactTime())
+    return report
+
+
+def get_field_value_legacy(fobj, msg):
+    if msg.isSetField(fobj.getField()):
+        msg.getField(fobj)
+        return fobj.getValue()
+    else:
+        return "None"
+
+
+def get_message_type_legacy(msg):
+    msg_type = get_field_value_legacy(fix.MsgType(), msg.getHeader())
+    if msg_type == fix.MsgType_ExecutionReport:
+        return "ExecutionReport"
+    elif msg_type == fix.MsgType_News:
+        return "News"
+    elif msg_type == fix.MsgType_NewOrderSingle:
+        return "NewOrderSingle"
+    else:
+        return msg_type
+
+
+def get_order_type_legacy(msg):
+    ord_type = get_field_value_legacy(fix.OrdType(), msg)
+    if ord_type == fix.OrdType_LIMIT:
+        return "LIMIT"
+    elif ord_type == fix.OrdType_MARKET:
+        return "MARKET"
+    else:
+        return ord_type
+
+
+def get_exec_type_legacy(msg):
+    rpt = get_field_value_legacy(fix.ExecType(), msg)
+    if rpt == fix.ExecType_NEW:
+        return "NEW"
+    elif rpt == fix.ExecType_REJECTED:
+        return "REJECTED"
+    elif rpt == fix.ExecType_TRADE:
+        return "FILLED"
+    elif rpt == fix.ExecType_CANCELED:
+        return "CANCELED"
+    else:
+        return rpt
+
+
+def get_order_status_legacy(msg):
+    status = get_field_value_legacy(fix.OrdStatus(), msg)
+    if status == fix.OrdStatus_NEW:
+        return "NEW"
+    elif status == fix.OrdStatus_FILLED:
+        return "FILLED"
+    elif status == fix.OrdStatus_REJECTED:
+        return "REJECTED"
+    elif status == fix.OrdStatus_CANCELED:
+        return "CANCELED"
+    else:
+        return status
+
+
+def format_message_legacy(msg):
+    # print_message formatting of fix-client.py and fix_session.py before the fix_decoder tables were introduced
+    get_field_value = get_field_value_legacy
+    msg_type = get_field_value(fix.MsgType(), msg.getHeader())
+    if msg_type == fix.MsgType_News:
+        msg_str = "MessageType=News, Sender="
+        msg_str += get_field_value(fix.SenderCompID(), msg.getHeader())
+        msg_str += ", HeadLine="
+        msg_str += get_field_value(fix.Headline(), msg)
+        msg_str += ", Text="
+        msg_str += get_field_value(fix.Text(), msg)
+        return msg_str
+    elif msg_type == fix.MsgType_MarketDataSnapshotFullRefresh:
+        return "SNAPSHOT\n%s\n%s" % (get_field_value(fix.Symbol(), msg), msg)
+    msg_str = "OrderID="
+    msg_str += get_field_value(fix.ClOrdID(), msg)
+    msg_str += ", MessageType="
+    msg_str += get_message_type_legacy(msg)
+    msg_str += ", OrderStatus="
+    msg_str += get_order_status_legacy(msg)
+    msg_str += ", Sender="
+    msg_str += get_field_value(fix.SenderCompID(), msg.getHeader())
+    msg_str += ", Target="
+    msg_str += get_field_value(fix.TargetCompID(), msg.getHeader())
+    msg_str += ", OrderType="
+    msg_str += get_order_type_legacy(msg)
+    msg_str += ", Side="
+    msg_str += 'BUY' if get_field_value(fix.Side(), msg) == fix.Side_BUY else 'SELL'
+    msg_str += ", Quantity="
+    msg_str += str(get_field_value(fix.OrderQty(), msg))
+    msg_str += ", Price="
+    msg_str += str(get_field_value(fix.Price(), msg))
+    msg_str += ", Symbol="
+    msg_str += get_field_value(fix.Symbol(), msg)
+    msg_str += ", ExecutionType="
+    msg_str += get_exec_type_legacy(msg)
+    if msg.isSetField(fix.Text().getField()):
+        msg_str += ", Text="
+        msg_str += get_field_value(fix.Text(), msg)
+    msg_str += ", ExecutedQuantity="
+    msg_str += str(get_field_value(fix.CumQty(), msg))
+    return msg_str
+
+
+def bench_decoding(count):
+    reports = [new_execution_report(repr(i)) for i in range(1000)]
+    assert format_message_legacy(reports[0]) == format_execution_report(decode_execution_report(reports[0]))
+
+    def format_legacy(count):
+        for i in range(count):
+            format_message_legacy(reports[i % 1000])
+
+    def decode_only(count):
+        for i in range(count):
+            decode_execution_report(reports[i % 1000])
+
+    def decode_and_format(count):
+        for i in range(count):
+            format_execution_report(decode_execution_report(reports[i % 1000]))
+
+    baseline = measure("print_message formatting (legacy)", count, format_legacy)
+    measure("decode_execution_report", count, decode_only)
+    elapsed = measure("decode + format_execution_report", count, decode_and_format)
+    print("Speedup: %.2fx" % (baseline / elapsed))
+
+
+def bench_backends(count):
+    work_dir = tempfile.mkdtemp(prefix="fix_benchmark_")
+    config_file = os.path.join(work_dir, "benchmark.cfg")
+    with open(config_file, "w") as config:
+        config.write("[DEFAULT]\nConnectionType=initiator\nFileLogPath=%s\nFileStorePath=%s\n" % (os.path.join(work_dir, "logs"), os.path.join(work_dir, "sessions")))
+        config.write("[SESSION]\nBeginString=FIX.4.4\nSenderCompID=TCLIENT1\nTargetCompID=DELTIX\nStartTime=00:00:00\nEndTime=00:00:00\nHeartBtInt=30\nSocketConnectPort=9001\nSocketConnectHost=127.0.0.1\n")
+    print("Working directory: %s" % work_dir)
+
+    settings = fix.SessionSettings(config_file)
+    session_id = settings.getSessions()[0]
+    report = new_execution_report("1")
+    text = report.toString()
+
+    def bench_log(name, log):
+        def write(count):
+            for i in range(count):
+                log.onIncoming(text)
+        measure(name, count, write)
+
+    bench_log("LogType=file", fix.FileLogFactory(settings).create(session_id))
+    bench_log("LogType=null", fix.NullLog())
+
+    message_log = AsyncMessageLog(settings)
+    def write_async(count):
+        for i in range(count):
+            message_log.onIncoming(session_id, report)
+    measure("LogType=async (callback thread)", count, write_async)
+    measure("LogType=async (background drain)", count, lambda count: message_log.stop())
+
+    def bench_store(name, factory):
+        store = factory.create(fix.UtcTimeStamp(), session_id)
+        def write(count):
+            for i in range(count):
+                store.set(i + 1, text)
+                store.incrNextSenderMsgSeqNum()
+        measure(name, count, write)
+
+    bench_store("StoreType=file", fix.FileStoreFactory(settings))
+    bench_store("StoreType=memory", fix.MemoryStoreFactory())
+    bench_store("StoreType=null", fix.NullStoreFactory())
+
+
+def write_loopback_configs(work_dir, session_count=1):
+    # client and simulator configs for a simulator on a free local port, returns (client config, simulator config)
+    with contextlib.closing(socket.socket()) as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    client_config = os.path.join(work_dir, "client.cfg")
+    simulator_config = os.path.join(work_dir, "simulator.cfg")
+    with open(client_config, "w") as client, open(simulator_config, "w") as simulator:
+        client.write("[DEFAULT]\nConnectionType=initiator\nReconnectInterval=1\nResetOnLogon=Y\nStartTime=00:00:00\nEndTime=00:00:00\nHeartBtInt=30\n")
+        client.write("SocketConnectHost=127.0.0.1\nSocketConnectPort=%s\nUseDataDictionary=Y\nSocketNodelay=Y\nStoreType=memory\nLogType=null\nTraderID=\n" % port)
+        client.write("FileLogPath=%s\nFileStorePath=%s\n" % (os.path.join(work_dir, "logs"), os.path.join(work_dir, "sessions")))
+        simulator.write("[DEFAULT]\nConnectionType=acceptor\nSocketAcceptPort=%s\nStartTime=00:00:00\nEndTime=00:00:00\nHeartBtInt=30\nUseDataDictionary=Y\nValidateUserDefinedFields=N\nAllowUnknownMsgFields=Y\nSocketNodelay=Y\n" % port)
+        for i in range(session_count):
+            client.write("\n[SESSION]\nBeginString=FIX.4.4\nSenderCompID=TCLIENT%s\nTargetCompID=DELTIX\nSenderPassword=password%s\n" % (i + 1, i + 1))
+            simulator.write("\n[SESSION]\nBeginString=FIX.4.4\nSenderCompID=DELTIX\nTargetCompID=TCLIENT%s\nClientPassword=password%s\n" % (i + 1, i + 1))
+    return client_config, simulator_config
+
+
+def get_percentile(sorted_values, percentile):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))]
+
+
+def bench_roundtrip(count, window=100):
+    # orders/sec and submit-to-fill latency against the local simulator with up to window orders in flight
+    work_dir = tempfile.mkdtemp(prefix="fix_benchmark_")
+    client_config, simulator_config = write_loopback_configs(work_dir)
+    simulator = FixSimulator(simulator_config, market_data_rate=0)
+    simulator.start()
+    session = FixSession(client_config)
+    session.set_verbose(False)
+    session.start(timeout=10)
+    latency = session.start_latency_tracking()
+
+    latencies = []
+    in_flight = threading.Semaphore(window)
+    done = threading.Event()
+
+    def on_completed(start_time):
+        def callback(future):
+            latencies.append(time.perf_counter() - start_time)
+            in_flight.release()
+            if len(latencies) == count:
+                done.set()
+        return callback
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start_time = time.perf_counter()
+        for i in range(count):
+            in_flight.acquire()
+            order_start_time = time.perf_counter()
+            order = session.submit_buy_order("SIM", "BTCUSD", 1.0, 40000.0, "GOLD", {8076: "FILL"})
+            order.result().completed.add_done_callback(on_completed(order_start_time))
+        done.wait()
+        elapsed = time.perf_counter() - start_time
+        session.stop()
+        simulator.stop()
+
+    latencies.sort()
+    print("Round trip: %s orders in %.3f s, %.0f orders/s, window %s" % (count, elapsed, count / elapsed, window))
+    print("Submit to fill latency: p50=%.1fus p99=%.1fus p99.9=%.1fus max=%.1fus" %
+          tuple(value * 1000000 for value in (get_percentile(latencies, 50), get_percentile(latencies, 99), get_percentile(latencies, 99.9), latencies[-1])))
+    print("Latency from submit by stage:\n%s" % latency)
+
+
+class CyclicOrderState(OrderState):
+    # order state keeping its futures after completion, as before they were dropped: the future result and the
+    # order reference each other, so completed orders are only freed by the garbage collector
+    __slots__ = ()
+
+    def set_completed(self):
+        with self.future_lock:
+            self.is_completed = True
+            future = self.completed_future
+        if future is not None:
+            future.set_result(self)
+
+
+def bench_gc(count, window=100):
+    # order burst through the submit_order build path and the order state engine without a connection:
+    # request, NewOrderSingle from a template, OrderState, then a fill completes the order window orders later.
+    # Compares completed orders that keep their futures (a reference cycle) with the ones that drop them,
+    # and the OrderRequest pool, which only saves the request allocation
+    fill = ExecutionReportEvent({"35": fix.MsgType_ExecutionReport, "150": fix.ExecType_TRADE, "39": fix.OrdStatus_FILLED,
+                                 "55": "BTCUSD", "14": "1", "151": "0", "32": "1", "31": "40000"})
+    template = OrderTemplate(new_order_request("0"))
+
+    def run_burst(pool, order_class):
+        orders = OrderStateEngine()
+        orders.order_class = order_class
+        in_flight = []
+        for i in range(count):
+            request = pool.acquire() if pool is not None else OrderRequest()
+            request.set_id(repr(i))
+            request.set_symbol("BTCUSD")
+            request.set_side("BUY")
+            request.set_quantity(1.0)
+            request.set_price(40000.0)
+            request.set_order_type(fix.OrdType_LIMIT)
+            request.set_account("GOLD")
+            request.set_destination("SIM")
+            template.get_fix_message(request)
+            order = orders.add(request)
+            order.acked
+            order.completed
+            in_flight.append(request.id)
+            if len(in_flight) > window:
+                fill.cl_ord_id = in_flight.pop(0)
+                orders.on_execution_report(fill)
+
+    for name, pool, order_class in (("futures kept (reference cycle)", None, CyclicOrderState),
+                                    ("futures dropped on completion", None, OrderState),
+                                    ("dropped + OrderRequestPool", OrderRequestPool(), OrderState)):
+        gc.collect()
+        collections = [stats["collections"] for stats in gc.get_stats()]
+        measure(name, count, lambda count: run_burst(pool, order_class))
+        collections = [stats["collections"] - before for stats, before in zip(gc.get_stats(), collections)]
+        print("  GC collections: gen0=%s, gen1=%s, gen2=%s%s" % (collections[0], collections[1], collections[2],
+                                                               ", %s" % pool if pool is not None else ""))
+
+
+def bench_books(count, symbol_count=5000):
+    # book lookup and update per decoded market data entry over symbol_count instruments,
+    # symbols are new string objects like the ones QuickFIX returns for every message
+    from fix_order_book import OrderBook
+    from fix_order_book import OrderBookManager
+    from fix_instruments import instruments
+
+    names = ["SYM%05d" % (i % symbol_count) for i in range(count)]
+    entries = [("".join(list(name)), 100.0 + i % 10) for i, name in enumerate(names)]
+
+    def update_dict_books(count):
+        books = {}
+        for symbol, price in entries:
+            book = books.get(symbol)
+            if book is None:
+                book = books[symbol] = OrderBook(symbol)
+            book.update(fix.MDEntryType_BID, price, 1.0)
+
+    def update_instrument_books(count):
+        get_book = OrderBookManager().get_book
+        for symbol, price in entries:
+            get_book(symbol).update(fix.MDEntryType_BID, price, 1.0)
+
+    id_entries = [(instruments.get_id(symbol), price) for symbol, price in entries] # ids decoded with the message
+
+    def update_books_by_id(count):
+        get_book_by_id = OrderBookManager().get_book_by_id
+        for instrument_id, price in id_entries:
+            get_book_by_id(instrument_id).update(fix.MDEntryType_BID, price, 1.0)
+
+    measure("books in dict by symbol", count, update_dict_books)
+    measure("books by symbol through the registry", count, update_instrument_books)
+    measure("books by known instrument id", count, update_books_by_id)
+
+
+def bench_analytics(count):
+    # parses a message log of count orders: NewOrderSingle, then ExecutionReports for ack and fill (every 10th order is rejected)
+    from fix_analytics import analyze_logs
+    from fix_analytics import format_summary
+
+    work_dir = tempfile.mkdtemp(prefix="fix_benchmark_")
+    log_path = os.path.join(work_dir, "FIX.4.4-TCLIENT1-DELTIX.messages.current.log")
+    symbols = ["BTCUSD", "ETHUSD", "LTCUSD", "XRPUSD"]
+    with open(log_path, "w") as log:
+        for i in range(count):
+            request = new_order_request(repr(i), 40000.0 + i % 100)
+            request.set_symbol(symbols[i % len(symbols)])
+            request.set_destination("SIM" if i % 2 else "ALGO")
+            log.write("20261018-12:00:00.000000000 : %s\n" % request.get_fix_message().toString())
+            report = new_execution_report(repr(i))
+            report.setField(fix.Symbol(request.symbol))
+            fill = report.toString()
+            report.setField(fix.ExecType(fix.ExecType_REJECTED if i % 10 == 0 else fix.ExecType_NEW))
+            report.setField(fix.OrdStatus(fix.OrdStatus_REJECTED if i % 10 == 0 else fix.OrdStatus_NEW))
+            report.setField(fix.LastQty(0.0))
+            report.setField(fix.CumQty(0.0))
+            log.write("20261018-12:00:00.000000000 : %s\n" % report.toString())
+            if i % 10 != 0:
+                log.write("20261018-12:00:00.000000000 : %s\n" % fill)
+    size = os.path.getsize(log_path)
+    elapsed = measure("analyze_logs by destination", count, lambda count: analyze_logs([log_path], "destination"))
+    print("Log size %.1f MB, %.1f MB/s" % (size / 1e6, size / 1e6 / elapsed))
+    print(format_summary(analyze_logs([log_path], "symbol")))
+
+
+def bench_journal(count, open_count=1000):
+    # order state engine with and without the order journal: ack and fill of count orders, then the time to reload
+    # a journal with open_count open orders left after count completed orders
+    from fix_journal import OrderJournal
+
+    ack = ExecutionReportEvent({"35": fix.MsgType_ExecutionReport, "150": fix.ExecType_NEW, "39": fix.OrdStatus_NEW,
+                                "55": "BTCUSD", "14": "0", "151": "1"})
+    fill = ExecutionReportEvent({"35": fix.MsgType_ExecutionReport, "150": fix.ExecType_TRADE, "39": fix.OrdStatus_FILLED,
+                                 "55": "BTCUSD", "14": "1", "151": "0", "32": "1", "31": "40000"})
+    work_dir = tempfile.mkdtemp(prefix="fix_benchmark_")
+
+    def run_orders(orders, count, offset=0):
+        for i in range(offset, offset + count):
+            request = new_order_request(repr(i))
+            orders.add(request)
+            ack.cl_ord_id = fill.cl_ord_id = request.id
+            orders.on_execution_report(ack)
+            orders.on_execution_report(fill)
+
+    measure("orders without journal", count, lambda count: run_orders(OrderStateEngine(), count))
+    orders = OrderStateEngine()
+    journal = OrderJournal(os.path.join(work_dir, "orders.journal"))
+    orders.set_journal(journal)
+    measure("orders with journal", count, lambda count: run_orders(orders, count))
+
+    for i in range(open_count):
+        request = new_order_request("open%s" % i)
+        orders.add(request)
+        ack.cl_ord_id = request.id
+        orders.on_execution_report(ack)
+    journal.close()
+    journal = OrderJournal(journal.path)
+    print("%s, file size %.1f KB after %s completed orders" % (journal, os.path.getsize(journal.path) / 1e3, count))
+    journal.close()
+
+
+def bench_risk(count, symbol_count=100):
+    # pre-trade check and release of count orders over symbol_count symbols with every limit enabled and market data
+    # for the price band, then the same through OrderStateEngine.add with and without the check
+    from fix_risk import RiskEngine
+    from fix_risk import RiskLimits
+    from fix_order_book import OrderBookManager
+
+    books = OrderBookManager()
+    requests = []
+    for i in range(symbol_count):
+        symbol = "RISK%03d" % i
+        book = books.get_book(symbol)
+        book.update(fix.MDEntryType_BID, 99.0, 10.0)
+        book.update(fix.MDEntryType_OFFER, 101.0, 10.0)
+        request = new_order_request(None, 100.0 + i % 3)
+        request.set_symbol(symbol)
+        request.set_account("ACCOUNT%s" % (i % 10))
+        request.set_side(fix.Side_BUY if i % 2 else fix.Side_SELL)
+        requests.append(request)
+    limits = RiskLimits(max_order_qty=100, max_order_notional=1e6, max_position=1e9, max_open_orders=1000, price_band=0.05,
+                        account_max_position=1e9, account_max_open_orders=10000)
+    limits.set_symbol_limits("RISK000", max_order_qty=10)
+
+    def run_checks(count):
+        risk = RiskEngine(limits, books)
+        check = risk.check
+        release = risk.release
+        for i in range(count):
+            request = requests[i % symbol_count]
+            request.id = repr(i)
+            check(request)
+            release(request.id)
+
+    def run_orders(risk, count):
+        orders = OrderStateEngine()
+        if risk is not None:
+            orders.set_risk_engine(risk)
+        for i in range(count):
+            request = requests[i % symbol_count]
+            request.id = repr(i)
+            if risk is not None:
+                risk.check(request)
+            orders.add(request)
+            orders.remove(request.id)
+
+    measure("risk check and release", count, run_checks)
+    measure("order add/remove without risk checks", count, lambda count: run_orders(None, count))
+    risk = RiskEngine(limits, books)
+    measure("order add/remove with risk checks", count, lambda count: run_orders(risk, count))
+    print(risk)
+
+
+def new_news(headline):
+    news = fix.Message()
+    news.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+    news.getHeader().setField(fix.MsgType(fix.MsgType_News))
+    news.getHeader().setField(fix.SenderCompID("GATEWAY"))
+    news.setField(fix.Headline(headline))
+    news.setField(fix.Text("Trading halted"))
+    return news
+
+
+def new_market_data_snapshot(depth=5):
+    snapshot = fix.Message()
+    snapshot.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+    snapshot.getHeader().setField(fix.MsgType(fix.MsgType_MarketDataSnapshotFullRefresh))
+    snapshot.setField(fix.MDReqID("1"))
+    snapshot.setField(fix.Symbol("BTCUSD"))
+    snapshot.setField(fix.NoMDEntries(depth * 2))
+    for level in range(depth):
+        for entry_type, price in ((fix.MDEntryType_BID, 40000.0 - level), (fix.MDEntryType_OFFER, 40001.0 + level)):
+            snapshot.setField(fix.MDEntryType(entry_type))
+            snapshot.setField(fix.MDEntryPx(price))
+            snapshot.setField(fix.MDEntrySize(1.0 + level))
+    return snapshot
+
+
+def get_startup_time(args, runs):
+    # best wall time of a fresh interpreter running args, the first run warms the file cache
+    times = []
+    for i in range(runs + 1):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append(time.perf_counter() - start_time)
+    return min(times[1:])
+
+
+def bench_startup(count, runs=10):
+    # interpreter start until exit of the CLI and of the imports of a session, quickfix + quickfix44 is what
+    # every start paid before the imports became lazy
+    for name, args in (("python (no imports)", ["-c", "pass"]),
+                       ("import quickfix, quickfix44", ["-c", "import quickfix, quickfix44"]),
+                       ("import fix_session", ["-c", "import fix_session"]),
+                       ("import fix_decoder", ["-c", "import fix_decoder"]),
+                       ("fix-client.py --help", ["fix-client.py", "--help"])):
+        print("%-40s %8.1f ms" % (name, get_startup_time(args, runs) * 1000))
+
+    for name, messages in (("ExecutionReport", [new_execution_report(repr(i)) for i in range(1000)]),
+                           ("News", [new_news("Headline %s" % i) for i in range(1000)]),
+                           ("MarketDataSnapshotFullRefresh", [new_market_data_snapshot() for i in range(1000)])):
+        def format_legacy(count):
+            for i in range(count):
+                format_message_legacy(messages[i % 1000])
+
+        def format_tables(count):
+            for i in range(count):
+                format_message(messages[i % 1000])
+
+        baseline = measure("%s (legacy)" % name, count, format_legacy)
+        elapsed = measure("%s (format_message)" % name, count, format_tables)
+        print("Speedup: %.2fx" % (baseline / elapsed))
+
+
+def simulate_strategy(work):
+    # stand-in for the strategy logic run per execution report
+    total = 0
+    for i in range(work):
+        total += i
+    return total
+
+
+def run_shard_orders(worker, count, window, work):
+    # strategy of the worker processes of the shards benchmark: count orders with up to window in flight
+    sent = 0
+    done = 0
+    while done < count:
+        while sent - done < window and sent < count:
+            worker.submit_buy_order("SIM", "BTCUSD", 1.0, 40000.0, "GOLD", {8076: "FILL"})
+            sent += 1
+        for event in worker.poll(1.0):
+            simulate_strategy(work)
+            if event.is_done():
+                done += 1
+
+
+def bench_shards(count, window=100, work=2000, worker_counts=(1, 2, 4)):
+    # orders/s against the local simulator with work iterations of strategy logic per execution report, run in the
+    # session process versus in worker processes of a ShardedGateway. Every worker sends count / workers orders
+    from fix_shards import ShardedGateway, RecordRing, ORDER
+    ring = RecordRing(ORDER.size, 4096)
+    values = (b"N", 1, b"1", b"BTCUSD", b"GOLD", b"SIM", b"8076=FILL", 1.0, 40000.0)
+
+    def ring_round_trip(count):
+        for i in range(count):
+            ring.put(ORDER, *values)
+            ORDER.unpack_from(ring.buffer, ring.read(1)[0])
+            ring.release(1)
+
+    measure("RecordRing put + read of an order", count, ring_round_trip)
+    ring.close()
+
+    work_dir = tempfile.mkdtemp(prefix="fix_benchmark_")
+    client_config, simulator_config = write_loopback_configs(work_dir)
+    simulator = FixSimulator(simulator_config, market_data_rate=0)
+    simulator.start()
+    session = FixSession(client_config)
+    session.set_verbose(False)
+    session.start(timeout=10)
+    start_time = time.perf_counter()
+    for i in range(1000):
+        simulate_strategy(work)
+    print("CPUs: %s, strategy logic: %.1f us per execution report" % (os.cpu_count(), (time.perf_counter() - start_time) * 1000))
+
+    in_flight = threading.Semaphore(window)
+    done = threading.Event()
+    completed = [0]
+
+    def on_report(event):
+        simulate_strategy(work)
+        if event.order_status in OrderState.TERMINAL_STATUSES:
+            in_flight.release()
+            completed[0] += 1
+            if completed[0] == count:
+                done.set()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        session.application.setExecutionReportListener(on_report)
+        start_time = time.perf_counter()
+        for i in range(count):
+            in_flight.acquire()
+            session.submit_buy_order("SIM", "BTCUSD", 1.0, 40000.0, "GOLD", {8076: "FILL"})
+        done.wait()
+        elapsed = time.perf_counter() - start_time
+        session.application.setExecutionReportListener(None)
+    print("%-40s %10d orders in %8.3f s, %8.0f orders/s" % ("in process", count, elapsed, count / elapsed))
+    baseline = elapsed
+
+    for worker_count in worker_counts:
+        gateway = ShardedGateway(session, run_shard_orders, worker_count, (count // worker_count, window, work))
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            gateway.start()
+            start_time = time.perf_counter()
+            exit_codes = gateway.join()
+            elapsed = time.perf_counter() - start_time
+            gateway.stop()
+        if any(exit_codes):
+            raise Exception("Workers failed: %s" % exit_codes)
+        orders = count // worker_count * worker_count
+        print("%-40s %10d orders in %8.3f s, %8.0f orders/s, %.2fx" %
+              ("%s worker processes" % worker_count, orders, elapsed, orders / elapsed, baseline / elapsed * orders / count))
+        print(gateway)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        session.stop()
+        simulator.stop()
+
+
+def bench_metrics(count, runs=8):
+    # counter increments and scrapes, the metrics hooks of Application.process_message, and process_message of execution
+    # reports and news with and without metrics (count // 10 messages per run, best of runs interleaved runs). End-to-end
+    # runs vary by more than the overhead on a busy host, so the overhead is the hook time relative to process_message
+    from fix_metrics import Counter
+
+    counter = Counter("fix_benchmark_total", "Benchmark counter", ("msg_type",))
+
+    def increment(count):
+        inc = counter.inc
+        for i in range(count):
+            inc(fix.MsgType_ExecutionReport)
+
+    measure("Counter.inc", count, increment)
+    threads = [threading.Thread(target=increment, args=(count // 4,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.get_value(fix.MsgType_ExecutionReport) == count + count // 4 * 4
+
+    work_dir = tempfile.mkdtemp(prefix="fix_benchmark_")
+    client_config, simulator_config = write_loopback_configs(work_dir)
+    session = FixSession(client_config)
+    session.set_verbose(False)
+    session.start_latency_tracking()
+    application = session.application
+    metrics = session.start_metrics()
+    messages = []
+    events = []
+    for i in range(1000):
+        report = new_execution_report(repr(i))
+        messages.append(report)
+        events.append(decode_execution_report(report))
+        messages.append(new_news("Halt %s" % i))
+        events.append(None)
+
+    def run_hooks(count, hooks=True):
+        # what process_message adds per message with metrics, without hooks only the cost of the loop itself
+        for i in range(count):
+            index = i % len(messages)
+            event = events[index]
+            if not hooks:
+                continue
+            if event is not None:
+                metrics.on_order_event(event, messages[index])
+            else:
+                metrics.on_app_received(fix.MsgType_News, messages[index])
+
+    def process(count):
+        process_message = application.process_message
+        start_time = time.perf_counter()
+        for i in range(count):
+            process_message(messages[i % len(messages)])
+        return time.perf_counter() - start_time
+
+    message_count = max(1, count // 10)
+    times = {False: [], True: []}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for run in range(runs):
+            for enabled in ((False, True) if run % 2 else (True, False)):
+                application.setMetrics(metrics if enabled else None)
+                times[enabled].append(process(message_count))
+    for enabled in (False, True):
+        elapsed = min(times[enabled])
+        print("%-40s %10d ops in %8.3f s, %12.0f ops/s, %8.3f us/op" %
+              ("process_message with%s metrics" % ("" if enabled else "out"), message_count, elapsed, message_count / elapsed,
+               elapsed * 1000000 / message_count))
+    loop = min(measure("loop without metrics hooks", count, lambda count: run_hooks(count, False)) for run in range(3))
+    hooks = (min(measure("metrics hooks of process_message", count, run_hooks) for run in range(3)) - loop) / count
+    print("Metrics overhead: %.2f%% of process_message (end-to-end best of %s runs: %+.2f%%)" %
+          (hooks / (min(times[False]) / message_count) * 100, runs, (min(times[True]) / min(times[False]) - 1) * 100))
+    measure("scrape", max(1, count // 100), lambda count: [metrics.render() for i in range(count)])
+    print(metrics.render())
+
+
+BENCHMARKS = {
+    "templates": bench_templates,
+    "decoding": bench_decoding,
+    "backends": bench_backends,
+    "roundtrip": bench_roundtrip,
+    "analytics": bench_analytics,
+    "books": bench_books,
+    "gc": bench_gc,
+    "journal": bench_journal,
+    "risk": bench_risk,
+    "startup": bench_startup,
+    "shards": bench_shards,
+    "metrics": bench_metrics,
+}
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='FIX session micro-benchmarks')
+    parser.add_argument("benchmark", type=str, choices=sorted(BENCHMARKS), help="Benchmark to run")
+    parser.add_argument("-n", "--count", type=int, default=100000, help="Number of operations")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.count)
@@ -0,0 +1,331 @@
+#####################################################################################
+# Capture of market data entries into append-only columnar files and their replay.
+# A capture directory holds one fixed-width memory-mapped file per column (native byte order):
+#   timestamp.i8  receive time of the message, nanoseconds since epoch (unique per message)
+#   symbol_id.u4  line number of the symbol in symbols.txt
+#   side.u1       MDEntryType character code ('0' bid, '1' offer, '2' trade), 0 for the one record of an empty snapshot
+#   action.u1     MDUpdateAction character code ('0' new, '1' change, '2' delete), 'S' for snapshot entries
+#   price.f8, size.f8
+# count.u8 holds the number of committed records, so NumPy can map the columns zero-copy while capturing.
+# Usage: python3 fix_capture.py capture fix-client.cfg DIRECTORY -s SYMBOL [SYMBOL ...]
+#        python3 fix_capture.py replay DIRECTORY [--speed SPEED]
+#####################################################################################
+
+import os
+import sys
+import mmap
+import time
+import argparse
+import threading
+import quickfix as fix
+from fix_decoder import SOH
+from fix_throttle import sleep_precise
+
+
+def get_numpy():
+    # NumPy is only needed to read captures, so it is not loaded with the sessions writing them
+    try:
+        import numpy
+    except ImportError:
+        raise Exception("NumPy is required to read market data captures")
+    return numpy
+
+
+COLUMNS = (  # name, memoryview type code, NumPy dtype
+    ("timestamp", "q", "i8"),
+    ("symbol_id", "I", "u4"),
+    ("side", "B", "u1"),
+    ("action", "B", "u1"),
+    ("price", "d", "f8"),
+    ("size", "d", "f8"),
+)
+
+ACTION_SNAPSHOT = ord('S')
+SIDE_NONE = 0  # record of a snapshot without entries, which clears the book
+
+
+def get_column_path(directory, name, dtype):
+    return os.path.join(directory, "%s.%s" % (name, dtype))
+
+
+class CaptureColumn(object):
+    # One memory-mapped column file grown in steps of capacity records
+
+    __slots__ = ("path", "type_code", "item_size", "file", "map", "view", "capacity")
+
+    def __init__(self, path, type_code, item_size, count, capacity):
+        self.path = path
+        self.type_code = type_code
+        self.item_size = item_size
+        self.file = open(path, "a+b")
+        self.map = None
+        self.view = None
+        self.capacity = 0
+        self.grow(count + capacity)
+
+    def grow(self, capacity):
+        self.release()
+        self.file.truncate(capacity * self.item_size)
+        self.map = mmap.mmap(self.file.fileno(), capacity * self.item_size)
+        self.view = memoryview(self.map).cast(self.type_code)
+        self.capacity = capacity
+
+    def release(self):
+        if self.view is not None:
+            self.view.release()
+            self.map.close()
+            self.view = self.map = None
+
+    def close(self, count):
+        # truncates the preallocated tail
+        self.release()
+        self.file.truncate(count * self.item_size)
+        self.file.close()
+
+# End of CaptureColumn
+
+
+class MarketDataCapture(object):
+    # Market data handler writing every entry of W and X messages to a capture directory, existing captures are appended to.
+    # handler (e.g. OrderBookManager) gets every message after it is captured
+
+    def __init__(self, directory, handler=None, capacity=1 << 20):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.handler = handler
+        self.capacity = capacity
+
+        self.count_file = open(os.path.join(directory, "count.u8"), "a+b")
+        if os.path.getsize(self.count_file.name) < 8:
+            self.count_file.truncate(8)
+        self.count_map = mmap.mmap(self.count_file.fileno(), 8)
+        self.count_view = memoryview(self.count_map).cast('Q')
+        self.count = self.count_view[0]
+
+        self.symbols_file = open(os.path.join(directory, "symbols.txt"), "a+")
+        self.symbols_file.seek(0)
+        self.symbol_ids = dict((symbol, i) for i, symbol in enumerate(self.symbols_file.read().splitlines()))
+
+        self.columns = [CaptureColumn(get_column_path(directory, name, dtype), type_code, int(dtype[1:]), self.count, capacity)
+                        for name, type_code, dtype in COLUMNS]
+        self.last_timestamp = 0
+        self.closed = False
+        self.lock = threading.Lock() # messages may be handled by several dispatcher workers
+
+    def get_symbol_id(self, symbol):
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.symbol_ids[symbol] = len(self.symbol_ids)
+            self.symbols_file.write(symbol + "\n")
+            self.symbols_file.flush()
+        return symbol_id
+
+    def on_message(self, msg):
+        msg_str = msg.toString()
+        if "\x0135=W\x01" in msg_str:
+            with self.lock:
+                if not self.closed:
+                    self.capture(msg_str, True)
+        elif "\x0135=X\x01" in msg_str:
+            with self.lock:
+                if not self.closed:
+                    self.capture(msg_str, False)
+        if self.handler is not None:
+            self.handler.on_message(msg)
+
+    def capture(self, msg_str, is_snapshot):
+        # entries start with MDEntryType (269) in snapshots and with MDUpdateAction (279) in incremental refreshes,
+        # entries of incremental refreshes without Symbol inherit it from the previous entry
+        timestamp = time.time_ns()
+        if timestamp <= self.last_timestamp:
+            timestamp = self.last_timestamp + 1 # keeps timestamps unique per message, replay groups entries by timestamp
+        self.last_timestamp = timestamp
+
+        entries = []
+        entry = None
+        symbol = None
+        start_tag = "269" if is_snapshot else "279"
+        for field in msg_str.split(SOH):
+            tag, _, value = field.partition('=')
+            if tag == start_tag:
+                entry = [symbol, None, ACTION_SNAPSHOT if is_snapshot else ord(value), None, 0.0]
+                entries.append(entry)
+                if is_snapshot:
+                    entry[1] = ord(value)
+            elif tag == "55":
+                symbol = value
+                if entry is not None:
+                    entry[0] = value
+            elif entry is None:
+                continue
+            elif tag == "269":
+                entry[1] = ord(value)
+            elif tag == "270":
+                entry[3] = float(value)
+            elif tag == "271":
+                entry[4] = float(value)
+
+        entries = [entry for entry in entries if entry[0] is not None and entry[1] is not None and entry[3] is not None]
+        if is_snapshot and not entries and symbol is not None:
+            entries.append([symbol, SIDE_NONE, ACTION_SNAPSHOT, 0.0, 0.0])
+        count = self.count
+        if count + len(entries) > self.columns[0].capacity:
+            for column in self.columns:
+                column.grow(count + len(entries) + self.capacity)
+        timestamps, symbol_ids, sides, actions, prices, sizes = [column.view for column in self.columns]
+        for symbol, side, action, price, size in entries:
+            timestamps[count] = timestamp
+            symbol_ids[count] = self.get_symbol_id(symbol)
+            sides[count] = side
+            actions[count] = action
+            prices[count] = price
+            sizes[count] = size
+            count += 1
+        self.count = self.count_view[0] = count
+
+    def close(self):
+        # messages still handled after close are only passed on to the handler
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.close_files()
+
+    def close_files(self):
+        for column in self.columns:
+            column.close(self.count)
+        self.count_view.release()
+        self.count_map.close()
+        self.count_file.close()
+        self.symbols_file.close()
+
+# End of MarketDataCapture
+
+
+def open_capture(directory):
+    # {column name: read-only NumPy array mapped on the column file}, symbols list
+    np = get_numpy()
+    count = int(np.fromfile(os.path.join(directory, "count.u8"), dtype="u8", count=1)[0])
+    columns = {}
+    for name, type_code, dtype in COLUMNS:
+        path = get_column_path(directory, name, dtype)
+        columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(count,)) if count else np.empty(0, dtype=dtype)
+    with open(os.path.join(directory, "symbols.txt")) as symbols_file:
+        symbols = symbols_file.read().splitlines()
+    return columns, symbols
+
+
+class MarketDataReplay(object):
+    # Feeds a capture back to a market data handler (on_message) as W and X messages, one per captured message
+
+    def __init__(self, directory):
+        self.columns, self.symbols = open_capture(directory)
+        np = get_numpy()
+        timestamps = self.columns["timestamp"]
+        # index of the first entry of every captured message
+        self.starts = np.flatnonzero(np.diff(timestamps)) + 1 if len(timestamps) else np.empty(0, dtype="i8")
+        self.starts = np.concatenate(([0], self.starts)) if len(timestamps) else self.starts
+
+    def get_message_count(self):
+        return len(self.starts)
+
+    def replay(self, handler, speed=1.0):
+        # speed 1.0 replays at the recorded pace, 10.0 ten times faster, 0 as fast as possible
+        columns = self.columns
+        timestamps = columns["timestamp"]
+        ends = get_numpy().append(self.starts[1:], len(timestamps))
+        start_time = time.perf_counter()
+        first_timestamp = int(timestamps[0]) if len(timestamps) else 0
+        for start, end in zip(self.starts.tolist(), ends.tolist()):
+            if speed > 0:
+                delay = (int(timestamps[start]) - first_timestamp) / 1e9 / speed - (time.perf_counter() - start_time)
+                if delay > 0:
+                    sleep_precise(delay)
+            handler.on_message(self.get_message(start, end))
+
+    def get_message(self, start, end):
+        import quickfix44 as fixnn # only replay builds messages with groups
+        columns = self.columns
+        symbol_ids = columns["symbol_id"][start:end].tolist()
+        sides = columns["side"][start:end].tolist()
+        actions = columns["action"][start:end].tolist()
+        prices = columns["price"][start:end].tolist()
+        sizes = columns["size"][start:end].tolist()
+
+        message = fix.Message()
+        message.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+        if actions[0] == ACTION_SNAPSHOT:
+            message.getHeader().setField(fix.MsgType(fix.MsgType_MarketDataSnapshotFullRefresh))
+            message.setField(fix.Symbol(self.symbols[symbol_ids[0]]))
+            for i in range(end - start):
+                if sides[i] == SIDE_NONE:
+                    continue  # empty snapshot
+                group = fixnn.MarketDataSnapshotFullRefresh.NoMDEntries()
+                group.setField(fix.MDEntryType(chr(sides[i])))
+                group.setField(fix.MDEntryPx(prices[i]))
+                group.setField(fix.MDEntrySize(sizes[i]))
+                message.addGroup(group)
+        else:
+            message.getHeader().setField(fix.MsgType(fix.MsgType_MarketDataIncrementalRefresh))
+            for i in range(end - start):
+                group = fixnn.MarketDataIncrementalRefresh.NoMDEntries()
+                group.setField(fix.MDUpdateAction(chr(actions[i])))
+                group.setField(fix.MDEntryType(chr(sides[i])))
+                group.setField(fix.Symbol(self.symbols[symbol_ids[i]]))
+                group.setField(fix.MDEntryPx(prices[i]))
+                group.setField(fix.MDEntrySize(sizes[i]))
+                message.addGroup(group)
+        return message
+
+# End of MarketDataReplay
+
+
+def capture_market_data(config_file, directory, symbols):
+    from fix_session import FixSession
+    from fix_session import MarketDataRequest
+
+    session = FixSession(config_file)
+    capture = session.start_capture(directory)
+    session.start()
+    request = MarketDataRequest()
+    request.set_symbols(symbols)
+    request.set_update_type(fix.MDUpdateType_INCREMENTAL_REFRESH)
+    session.submit(request)
+    print("Capturing to %s, press Enter to stop" % directory)
+    input()
+    session.stop()
+    print("Captured %s entries" % capture.count)
+
+
+def replay_market_data(directory, speed):
+    from fix_order_book import OrderBookManager
+
+    books = OrderBookManager()
+    replay = MarketDataReplay(directory)
+    start_time = time.perf_counter()
+    replay.replay(books, speed)
+    elapsed = time.perf_counter() - start_time
+    print("Replayed %s messages (%s entries) in %.3f s" % (replay.get_message_count(), len(replay.columns["timestamp"]), elapsed))
+    for book in sorted(books.get_books(), key=lambda book: book.symbol):
+        print(book)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Market data capture and replay')
+    commands = parser.add_subparsers(dest="command", required=True)
+    capture_parser = commands.add_parser("capture", help="Subscribe and capture market data until Enter is pressed")
+    capture_parser.add_argument("config_file", type=str, help="Name of configuration file")
+    capture_parser.add_argument("directory", type=str, help="Capture directory")
+    capture_parser.add_argument("-s", "--symbols", type=str, nargs="+", required=True, help="Symbols to subscribe")
+    replay_parser = commands.add_parser("replay", help="Replay a capture into order books")
+    replay_parser.add_argument("directory", type=str, help="Capture directory")
+    replay_parser.add_argument("--speed", type=float, default=0, help="1 replays at the recorded pace, 10 ten times faster, 0 (default) as fast as possible")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "capture":
+            capture_market_data(args.config_file, args.directory, args.symbols)
+        else:
+            replay_market_data(args.directory, args.speed)
+    except (fix.ConfigError, fix.RuntimeError) as e:
+        print(e)
+        sys.exit(1)
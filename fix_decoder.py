@@ -0,0 +1,221 @@
+#####################################################################################
+# Fast decoding of application messages: the message is serialized once and split
+# into tag/value pairs instead of creating a QuickFIX field object per tag.
+# Tag and enum names are plain lookup tables of FIX 4.4 values built at import, so this
+# module does not load QuickFIX and formatting a message is a few dict lookups.
+#####################################################################################
+
+from fix_instruments import instruments
+
+SOH = '\x01'
+
+MSG_TYPE_NEWS = 'B'
+MSG_TYPE_EXECUTION_REPORT = '8'
+MSG_TYPE_ORDER_CANCEL_REJECT = '9'
+SIDE_BUY = '1'
+
+MSG_TYPE_NAMES = {
+    '0': "Heartbeat",
+    '1': "TestRequest",
+    '2': "ResendRequest",
+    '3': "Reject",
+    '4': "SequenceReset",
+    '5': "Logout",
+    'A': "Logon",
+    MSG_TYPE_EXECUTION_REPORT: "ExecutionReport",
+    MSG_TYPE_NEWS: "News",
+    'D': "NewOrderSingle",
+    MSG_TYPE_ORDER_CANCEL_REJECT: "OrderCancelReject",
+    'E': "NewOrderList",
+    'F': "OrderCancelRequest",
+    'G': "OrderCancelReplaceRequest",
+    'H': "OrderStatusRequest",
+    'AF': "OrderMassStatusRequest",
+    'V': "MarketDataRequest",
+    'W': "MarketDataSnapshotFullRefresh",
+    'X': "MarketDataIncrementalRefresh",
+    'Y': "MarketDataRequestReject",
+    'j': "BusinessMessageReject",
+}
+
+ORDER_TYPE_NAMES = {
+    '1': "MARKET",
+    '2': "LIMIT",
+}
+
+EXEC_TYPE_NAMES = {
+    '0': "NEW",
+    '8': "REJECTED",
+    'F': "FILLED",
+    '4': "CANCELED",
+    '5': "REPLACED",
+    '6': "PENDING_CANCEL",
+    'E': "PENDING_REPLACE",
+    'A': "PENDING_NEW",
+    'I': "ORDER_STATUS",
+}
+
+ORDER_STATUS_NAMES = {
+    '0': "NEW",
+    '1': "PARTIALLY_FILLED",
+    '2': "FILLED",
+    '8': "REJECTED",
+    '4': "CANCELED",
+    '5': "REPLACED",
+    '6': "PENDING_CANCEL",
+    'A': "PENDING_NEW",
+    'E': "PENDING_REPLACE",
+}
+
+SIDE_NAMES = {
+    SIDE_BUY: "BUY",
+    '2': "SELL",
+}
+
+MD_ENTRY_TYPE_NAMES = {
+    '0': "BID",
+    '1': "OFFER",
+    '2': "TRADE",
+}
+
+MD_UPDATE_ACTION_NAMES = {
+    '0': "NEW",
+    '1': "CHANGE",
+    '2': "DELETE",
+}
+
+# names of the tags this client sends or receives, other tags are shown by number
+TAG_NAMES = {
+    '1': "Account", '6': "AvgPx", '11': "ClOrdID", '14': "CumQty", '17': "ExecID", '31': "LastPx", '32': "LastQty",
+    '33': "NoLinesOfText", '34': "MsgSeqNum", '35': "MsgType", '37': "OrderID", '38': "OrderQty", '39': "OrdStatus",
+    '40': "OrdType", '41': "OrigClOrdID", '44': "Price", '45': "RefSeqNum", '49': "SenderCompID", '52': "SendingTime",
+    '54': "Side", '55': "Symbol", '56': "TargetCompID", '58': "Text", '59': "TimeInForce", '60': "TransactTime",
+    '76': "ExecBroker", '100': "ExDestination", '102': "CxlRejReason", '103': "OrdRejReason", '146': "NoRelatedSym",
+    '148': "Headline", '150': "ExecType", '151': "LeavesQty", '262': "MDReqID", '263': "SubscriptionRequestType",
+    '264': "MarketDepth", '265': "MDUpdateType", '267': "NoMDEntryTypes", '268': "NoMDEntries", '269': "MDEntryType",
+    '270': "MDEntryPx", '271': "MDEntrySize", '278': "MDEntryID", '279': "MDUpdateAction", '281': "MDReqRejReason",
+    '371': "RefTagID", '372': "RefMsgType", '373': "SessionRejectReason", '379': "BusinessRejectRefID",
+    '380': "BusinessRejectReason", '434': "CxlRejResponseTo", '584': "MassStatusReqID", '912': "LastRptRequested",
+}
+
+# tag -> names of its values
+ENUM_NAMES = {
+    '35': MSG_TYPE_NAMES,
+    '39': ORDER_STATUS_NAMES,
+    '40': ORDER_TYPE_NAMES,
+    '54': SIDE_NAMES,
+    '150': EXEC_TYPE_NAMES,
+    '269': MD_ENTRY_TYPE_NAMES,
+    '279': MD_UPDATE_ACTION_NAMES,
+}
+
+# session level and framing tags left out of formatted messages
+SKIPPED_TAGS = frozenset(('8', '9', '10', '34', '52'))
+
+# FIX 4.4 StandardHeader tags, serialized before the body
+HEADER_TAGS = frozenset(('8', '9', '35', '49', '56', '115', '128', '90', '91', '34', '50', '142', '57', '143', '116', '144',
+                         '129', '145', '43', '97', '52', '122', '212', '213', '347', '369', '627', '628', '629', '630'))
+
+
+class ExecutionReportEvent(object):
+    # Tags of an ExecutionReport (or any other order event) extracted in one pass, missing tags are None
+    __slots__ = ("msg_type", "sender", "target", "cl_ord_id", "orig_cl_ord_id", "order_id", "exec_id",
+                 "exec_type", "order_status", "symbol", "instrument_id", "side", "order_type", "quantity", "price",
+                 "last_qty", "last_price", "cum_qty", "leaves_qty", "avg_price", "account", "destination", "text", "transact_time",
+                 "mass_status_req_id", "last_rpt_requested")
+
+    def __init__(self, fields):
+        get = fields.get
+        self.msg_type = get('35')
+        self.sender = get('49')
+        self.target = get('56')
+        self.cl_ord_id = get('11')
+        self.orig_cl_ord_id = get('41')
+        self.order_id = get('37')
+        self.exec_id = get('17')
+        self.exec_type = get('150')
+        self.order_status = get('39')
+        symbol = get('55')
+        # one shared string per traded or subscribed symbol instead of a new one per message. Symbols are only
+        # registered by orders and subscriptions, other symbols of the feed would grow the registry without limit
+        self.instrument_id = instruments.find_id(symbol) if symbol is not None else None
+        self.symbol = instruments.symbols[self.instrument_id] if self.instrument_id is not None else symbol
+        self.side = get('54')
+        self.order_type = get('40')
+        self.quantity = to_float(get('38'))
+        self.price = to_float(get('44'))
+        self.last_qty = to_float(get('32'))
+        self.last_price = to_float(get('31'))
+        self.cum_qty = to_float(get('14'))
+        self.leaves_qty = to_float(get('151'))
+        self.avg_price = to_float(get('6'))
+        self.account = get('1')
+        self.destination = get('76')
+        self.text = get('58')
+        self.transact_time = get('60')
+        self.mass_status_req_id = get('584')
+        self.last_rpt_requested = get('912')
+
+    def __str__(self):
+        return format_execution_report(self)
+
+# End of ExecutionReportEvent
+
+
+def parse_fields(msg_str):
+    # {tag: value} of a serialized message, for repeating groups the last occurrence of a tag wins.
+    # Header tags keep their header value, e.g. a SenderCompID echoed in the body does not replace it
+    pairs = [field.split('=', 1) for field in msg_str.split(SOH) if field]
+    fields = dict(pairs)
+    for tag, value in pairs:
+        if tag not in HEADER_TAGS:
+            break
+        fields[tag] = value
+    return fields
+
+
+def decode_execution_report(msg):
+    return ExecutionReportEvent(parse_fields(msg.toString()))
+
+
+def to_float(value):
+    return float(value) if value is not None else None
+
+
+def format_execution_report(event):
+    # same layout as the print_message output for order events
+    text = ", Text=%s" % event.text if event.text is not None else ""
+    return "OrderID=%s, MessageType=%s, OrderStatus=%s, Sender=%s, Target=%s, OrderType=%s, Side=%s, Quantity=%s, Price=%s, Symbol=%s, ExecutionType=%s%s, ExecutedQuantity=%s" % \
+           (event.cl_ord_id, MSG_TYPE_NAMES.get(event.msg_type, event.msg_type), ORDER_STATUS_NAMES.get(event.order_status, event.order_status),
+            event.sender, event.target, ORDER_TYPE_NAMES.get(event.order_type, event.order_type),
+            SIDE_NAMES.get(event.side, event.side), event.quantity, event.price, event.symbol,
+            EXEC_TYPE_NAMES.get(event.exec_type, event.exec_type), text, event.cum_qty)
+
+
+def format_fields(msg_str):
+    # Name=value of every field of a serialized message in message order, repeating groups included
+    items = []
+    for field in msg_str.split(SOH):
+        if field:
+            tag, value = field.split('=', 1)
+            if tag not in SKIPPED_TAGS:
+                names = ENUM_NAMES.get(tag)
+                items.append("%s=%s" % (TAG_NAMES.get(tag, tag), names.get(value, value) if names is not None else value))
+    return ", ".join(items)
+
+
+def format_message(msg):
+    # one line description of a received message: order events in the format_execution_report layout,
+    # news with their headline and every other message field by field
+    msg_str = msg.toString()
+    fields = parse_fields(msg_str)
+    msg_type = fields.get('35')
+    if msg_type == MSG_TYPE_NEWS:
+        return "MessageType=News, Sender=%s, HeadLine=%s, Text=%s" % (fields.get('49'), fields.get('148'), fields.get('58'))
+    if msg_type in (MSG_TYPE_EXECUTION_REPORT, MSG_TYPE_ORDER_CANCEL_REJECT):
+        return format_execution_report(ExecutionReportEvent(fields))
+    return format_fields(msg_str)
+
+
+def print_message(msg):
+    print(format_message(msg))
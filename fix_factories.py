@@ -0,0 +1,191 @@
+#####################################################################################
+# Message store and log backends selected in the config file DEFAULT section:
+#   StoreType=file|memory|null           (file by default)
+#   LogType=file|screen|async|null       (file by default)
+#   AsyncLogFlushInterval=100            (milliseconds between async log flushes)
+# Sessions with UseDataDictionary=Y and an empty DataDictionary use the dictionary shipped with quickfix.
+#####################################################################################
+
+import os
+import sys
+import time
+import threading
+from collections import deque
+import quickfix as fix
+
+STORE_TYPES = ("file", "memory", "null")
+LOG_TYPES = ("file", "screen", "async", "null")
+
+
+def get_default_data_dictionary(begin_string):
+    # data dictionary installed with the quickfix package, e.g. <prefix>/share/quickfix/FIX44.xml
+    return os.path.join(sys.prefix, "share", "quickfix", begin_string.replace(".", "") + ".xml")
+
+
+def load_settings(config_file):
+    settings = fix.SessionSettings(config_file)
+    sessions = [session_id.toString() for session_id in settings.getSessions() if needs_data_dictionary(settings.get(session_id))]
+    if not sessions:
+        return settings
+
+    # parsed sessions cannot be updated in place, so copy them into new settings
+    result = fix.SessionSettings()
+    result.set(settings.get())
+    for session_id in settings.getSessions():
+        dictionary = settings.get(session_id)
+        if session_id.toString() in sessions:
+            dictionary.setString("DataDictionary", get_default_data_dictionary(session_id.getBeginString().getValue()))
+        result.set(session_id, dictionary)
+    return result
+
+
+def needs_data_dictionary(dictionary):
+    return dictionary.has("UseDataDictionary") and dictionary.getBool("UseDataDictionary") and \
+        not (dictionary.has("DataDictionary") and dictionary.getString("DataDictionary"))
+
+
+def create_store_factory(settings, config):
+    store_type = config["DEFAULT"].get("StoreType", "file").lower()
+    if store_type == "file":
+        return fix.FileStoreFactory(settings)
+    elif store_type == "memory":
+        return fix.MemoryStoreFactory()
+    elif store_type == "null":
+        return fix.NullStoreFactory()
+    raise Exception("Unknown StoreType: %s, expected one of %s" % (store_type, ", ".join(STORE_TYPES)))
+
+
+def get_log_type(config):
+    log_type = config["DEFAULT"].get("LogType", "file").lower()
+    if log_type not in LOG_TYPES:
+        raise Exception("Unknown LogType: %s, expected one of %s" % (log_type, ", ".join(LOG_TYPES)))
+    return log_type
+
+
+def create_log_factory(settings, config):
+    # returns None for the null and async logs, the initiator is then created without a log factory
+    log_type = get_log_type(config)
+    if log_type == "file":
+        return fix.FileLogFactory(settings)
+    elif log_type == "screen":
+        return fix.ScreenLogFactory(settings)
+    return None
+
+
+def create_message_log(settings, config):
+    # returns AsyncMessageLog for the async log, None otherwise
+    if get_log_type(config) != "async":
+        return None
+    return AsyncMessageLog(settings, int(config["DEFAULT"].get("AsyncLogFlushInterval", "100")) / 1000)
+
+
+def create_initiator(application, settings, config):
+    # returns (initiator, store factory, log factory), factories must outlive the initiator.
+    # application must provide setMessageLog() which is given the AsyncMessageLog in async log mode
+    store_factory = create_store_factory(settings, config)
+    log_factory = create_log_factory(settings, config)
+    application.setMessageLog(create_message_log(settings, config))
+    if log_factory is None:
+        initiator = fix.SocketInitiator(application, store_factory, settings)
+    else:
+        initiator = fix.SocketInitiator(application, store_factory, settings, log_factory)
+    return initiator, store_factory, log_factory
+
+
+class AsyncLogWriter(object):
+    # Collects log lines from QuickFIX threads and writes them in batches on a background thread
+
+    def __init__(self, flush_interval=0.1):
+        self.flush_interval = flush_interval
+        self.lines = deque()
+        self.files = {}
+        self.written_count = 0
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.start()
+
+    def start(self):
+        # starts the writer thread again after stop(), e.g. when a stopped session is started again
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="AsyncLogWriter", daemon=True)
+        self.thread.start()
+
+    def write(self, path, text):
+        # deque.append is atomic, so the hot path takes no lock
+        self.lines.append((path, time.time(), text))
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+        for log_file in self.files.values():
+            log_file.close()
+        self.files = {}
+
+    def flush(self):
+        with self.flush_lock:
+            self.write_lines()
+
+    def write_lines(self):
+        lines = self.lines
+        touched = set()
+        while lines:
+            path, timestamp, text = lines.popleft()
+            log_file = self.files.get(path)
+            if log_file is None:
+                log_file = self.files[path] = open(path, "a")
+            log_file.write("%s.%03d : %s\n" % (time.strftime("%Y%m%d-%H:%M:%S", time.gmtime(timestamp)), int(timestamp * 1000) % 1000, text))
+            touched.add(log_file)
+            self.written_count += 1
+        for log_file in touched:
+            log_file.flush()
+
+    def stop(self):
+        # writes the lines still queued, closes the files and waits for the writer thread
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+# End of AsyncLogWriter
+
+
+class AsyncMessageLog(object):
+    # Message and event log written by the Application callbacks into the same files as FileLogFactory.
+    # Python fix.Log subclasses cannot be called safely from QuickFIX socket threads, so in async mode
+    # QuickFIX runs without a log factory and the Application forwards messages here instead.
+
+    def __init__(self, settings, flush_interval=0.1):
+        self.path = settings.get().getString("FileLogPath")
+        os.makedirs(self.path, exist_ok=True)
+        self.writer = AsyncLogWriter(flush_interval)
+        self.prefixes = {}
+
+    def get_prefix(self, session_id):
+        key = session_id.toString()
+        prefix = self.prefixes.get(key)
+        if prefix is None:
+            prefix = self.prefixes[key] = os.path.join(self.path, key.replace("->", "-").replace(":", "-"))
+        return prefix
+
+    def onIncoming(self, session_id, message):
+        self.writer.write(self.get_prefix(session_id) + ".messages.current.log", message.toString())
+
+    def onOutgoing(self, session_id, message):
+        self.writer.write(self.get_prefix(session_id) + ".messages.current.log", message.toString())
+
+    def onEvent(self, session_id, text):
+        self.writer.write(self.get_prefix(session_id) + ".event.current.log", text)
+
+    def flush(self):
+        self.writer.flush()
+
+    def start(self):
+        self.writer.start()
+
+    def stop(self):
+        self.writer.stop()
+
+# End of AsyncMessageLog
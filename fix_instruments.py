@@ -0,0 +1,96 @@
+#####################################################################################
+# Instrument registry: every symbol seen by the session layer gets a dense integer id,
+# so per-instrument state can live in lists and arrays indexed by id instead of dicts
+# keyed by symbol, and every component shares one string object per symbol.
+#####################################################################################
+
+import threading
+from array import array
+
+
+class InstrumentRegistry(object):
+    # Symbols are registered on first use and never removed, ids are 0, 1, 2, ... in registration order.
+    # Lookups of known symbols take no lock, only registration of a new symbol does.
+
+    def __init__(self):
+        self.ids = {}      # symbol -> id
+        self.symbols = []  # id -> symbol
+        self.lock = threading.Lock()
+
+    def get_id(self, symbol):
+        # id of the symbol, registers unknown symbols
+        instrument_id = self.ids.get(symbol)
+        if instrument_id is None:
+            with self.lock:
+                instrument_id = self.ids.get(symbol)
+                if instrument_id is None:
+                    # the symbol list is appended before the id is published, so readers never see an id without a symbol
+                    instrument_id = len(self.symbols)
+                    self.symbols.append(symbol)
+                    self.ids[symbol] = instrument_id
+        return instrument_id
+
+    def find_id(self, symbol):
+        # id of the symbol, None if the symbol is not registered
+        return self.ids.get(symbol)
+
+    def get_symbol(self, instrument_id):
+        return self.symbols[instrument_id]
+
+    def intern(self, symbol):
+        # the registered string object equal to symbol, so decoded messages do not keep their own copies
+        if symbol is None:
+            return None
+        return self.symbols[self.get_id(symbol)]
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.ids
+
+    def __str__(self):
+        return "InstrumentRegistry: Instruments=%s" % len(self.symbols)
+
+# End of InstrumentRegistry
+
+
+class InstrumentTable(object):
+    # Per-instrument objects in a list indexed by instrument id, created on first access by factory(instrument_id)
+
+    __slots__ = ("factory", "items")
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.items = []
+
+    def get(self, instrument_id):
+        # None if there is no object for the instrument yet
+        items = self.items
+        return items[instrument_id] if instrument_id < len(items) else None
+
+    def get_or_create(self, instrument_id):
+        items = self.items
+        if instrument_id >= len(items):
+            items.extend([None] * (instrument_id + 1 - len(items)))
+        item = items[instrument_id]
+        if item is None:
+            item = items[instrument_id] = self.factory(instrument_id)
+        return item
+
+    def values(self):
+        return [item for item in self.items if item is not None]
+
+    def __len__(self):
+        return len(self.items)
+
+# End of InstrumentTable
+
+
+def grow_array(values, instrument_id, default=0):
+    # makes an array('d') or array('q') of per-instrument statistics long enough for instrument_id
+    if instrument_id >= len(values):
+        values.extend(array(values.typecode, [default]) * (instrument_id + 1 - len(values)))
+
+
+instruments = InstrumentRegistry() # registry shared by the session layer
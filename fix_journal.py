@@ -0,0 +1,261 @@
+#####################################################################################
+# Persistent order state: every open order of a FixSession has a fixed-size slot in a
+# memory-mapped journal file that is rewritten in place on every execution report and
+# freed once the order is completed. The file only grows with the peak number of open
+# orders, so reloading it after a restart takes time proportional to the open orders and
+# not to the messages of the day. Reloaded orders are reconciled with the gateway through
+# OrderStatusRequest (35=H) or OrderMassStatusRequest (35=AF), see FixSession.start_journal.
+#####################################################################################
+
+import os
+import mmap
+import time
+import struct
+import threading
+import quickfix as fix
+from concurrent.futures import Future
+
+JOURNAL_MAGIC = b"FIXJRNL1"
+HEADER = struct.Struct("<8sI")  # magic, record size
+# fields written once when the order is added: side, order type, time in force, ClOrdID, session, symbol, account, destination, exchange
+STATIC = struct.Struct("<1s1s1s32s64s32s32s32s32s")
+# fields rewritten on every execution report: order status, ClOrdID of the last accepted replace, quantity, price, cum qty, leaves qty, avg price
+MUTABLE = struct.Struct("<1s32sddddd")
+RECORD_SIZE = 1 + STATIC.size + MUTABLE.size  # state byte first, 0 for a free slot
+
+SLOT_FREE = 0
+SLOT_OPEN = 1
+NAN = float("nan")
+
+
+def to_bytes(value):
+    return value.encode() if value is not None else b""
+
+
+def to_field(value, size, name):
+    # value encoded for a fixed-width field of the record, longer values are rejected instead of cut
+    value = to_bytes(value)
+    if len(value) > size:
+        raise Exception("%s %s is too long for the order journal (%s bytes)" % (name, value.decode(errors="replace"), size))
+    return value
+
+
+def to_str(value):
+    value = value.rstrip(b"\0")
+    return value.decode() if value else None
+
+
+def to_float(value):
+    return value if value == value else None  # NaN is None
+
+
+class JournalRecord(object):
+    # open order read back from the journal
+    __slots__ = ("slot", "side", "order_type", "time_in_force", "id", "session", "symbol", "account", "destination", "exchange",
+                 "status", "cl_ord_id", "quantity", "price", "cum_qty", "leaves_qty", "avg_price")
+
+    def __init__(self, slot, values):
+        self.slot = slot
+        (side, order_type, time_in_force, id, session, symbol, account, destination, exchange,
+         status, cl_ord_id, quantity, price, cum_qty, leaves_qty, avg_price) = values
+        self.side = to_str(side)
+        self.order_type = to_str(order_type)
+        self.time_in_force = to_str(time_in_force)
+        self.id = to_str(id)
+        self.session = to_str(session)
+        self.symbol = to_str(symbol)
+        self.account = to_str(account)
+        self.destination = to_str(destination)
+        self.exchange = to_str(exchange)
+        self.status = to_str(status)
+        self.cl_ord_id = to_str(cl_ord_id)
+        self.quantity = to_float(quantity)
+        self.price = to_float(price)
+        self.cum_qty = to_float(cum_qty)
+        self.leaves_qty = to_float(leaves_qty)
+        self.avg_price = to_float(avg_price)
+
+    def __str__(self):
+        return "JournalRecord: ID=%s, ClOrdID=%s, Symbol=%s, Status=%s, Quantity=%s, Price=%s, CumQty=%s" % \
+               (self.id, self.cl_ord_id, self.symbol, self.status, self.quantity, self.price, self.cum_qty)
+
+# End of JournalRecord
+
+
+class OrderJournal(object):
+    # Slot table of open orders in a memory-mapped file, grown in steps of capacity slots.
+    # Writes go to the page cache and survive a crash of the process, flush() also makes them survive a crash of the host
+
+    def __init__(self, path, capacity=4096):
+        self.path = path
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.file = open(path, "a+b")
+        self.map = None
+        self.slot_count = 0
+        self.free_slots = []  # stack of free slot numbers
+        self.load_time = None
+        size = os.path.getsize(path)
+        if size == 0:
+            self.file.write(HEADER.pack(JOURNAL_MAGIC, RECORD_SIZE))
+            self.file.flush()
+        else:
+            self.file.seek(0)
+            magic, record_size = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != JOURNAL_MAGIC or record_size != RECORD_SIZE:
+                raise Exception("%s is not an order journal of this version" % path)
+        self.grow(max(capacity, (size - HEADER.size) // RECORD_SIZE) if size > HEADER.size else capacity)
+        self.records = self.load() # open orders of the previous run, OrderState.journal_slot of orders rebuilt from them is record.slot
+
+    def grow(self, slot_count):
+        if self.map is not None:
+            self.map.close()
+        self.file.truncate(HEADER.size + slot_count * RECORD_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), HEADER.size + slot_count * RECORD_SIZE)
+        self.free_slots[:0] = range(slot_count - 1, self.slot_count - 1, -1)
+        self.slot_count = slot_count
+
+    def get_offset(self, slot):
+        return HEADER.size + slot * RECORD_SIZE
+
+    def load(self):
+        # JournalRecords of the open orders, slots of the other records are free
+        start_time = time.perf_counter()
+        records = []
+        free_slots = []
+        view = memoryview(self.map)[HEADER.size:HEADER.size + self.slot_count * RECORD_SIZE]
+        try:
+            states = view[::RECORD_SIZE].tobytes() # state byte of every slot, only open records are unpacked
+            for slot in range(self.slot_count - 1, -1, -1):
+                if states[slot] == SLOT_OPEN:
+                    offset = slot * RECORD_SIZE
+                    records.append(JournalRecord(slot, STATIC.unpack_from(view, offset + 1) + MUTABLE.unpack_from(view, offset + 1 + STATIC.size)))
+                else:
+                    free_slots.append(slot)
+        finally:
+            view.release()
+        with self.lock:
+            self.free_slots = free_slots
+        records.reverse()
+        self.load_time = time.perf_counter() - start_time
+        return records
+
+    def add(self, order):
+        # order is an OrderState, its slot is kept in order.journal_slot
+        request = order.request
+        static = STATIC.pack(to_field(request.side, 1, "Side"), to_field(request.order_type, 1, "OrdType"),
+                             to_field(request.time_in_force, 1, "TimeInForce"), to_field(order.id, 32, "ClOrdID"),
+                             to_field(order.session, 64, "Session"), to_field(request.symbol, 32, "Symbol"),
+                             to_field(request.account, 32, "Account"), to_field(request.destination, 32, "Destination"),
+                             to_field(request.exchange, 32, "Exchange"))
+        mutable = self.get_mutable(order, request)
+        with self.lock:
+            if not self.free_slots:
+                self.grow(self.slot_count + self.capacity)
+            slot = self.free_slots.pop()
+            offset = self.get_offset(slot)
+            self.map[offset + 1:offset + 1 + STATIC.size] = static
+            MUTABLE.pack_into(self.map, offset + 1 + STATIC.size, *mutable)
+            self.map[offset] = SLOT_OPEN  # last, so a slot is never open with a partial record
+        order.journal_slot = slot
+
+    def update(self, order):
+        request = order.request
+        slot = order.journal_slot
+        if slot is None or request is None:
+            return
+        mutable = self.get_mutable(order, request)
+        with self.lock:
+            MUTABLE.pack_into(self.map, self.get_offset(slot) + 1 + STATIC.size, *mutable)
+
+    def get_mutable(self, order, request):
+        return (to_field(order.status, 1, "OrdStatus"), to_field(order.cl_ord_id, 32, "ClOrdID"),
+                nan_if_none(request.quantity), nan_if_none(request.price), order.cum_qty,
+                nan_if_none(order.leaves_qty), nan_if_none(order.avg_price))
+
+    def remove(self, order):
+        slot = order.journal_slot
+        if slot is None:
+            return
+        order.journal_slot = None
+        with self.lock:
+            self.map[self.get_offset(slot)] = SLOT_FREE
+            self.free_slots.append(slot)
+
+    def get_open_count(self):
+        return self.slot_count - len(self.free_slots)
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        with self.lock:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+
+    def __str__(self):
+        load_time = ", LoadTime=%.6fs" % self.load_time if self.load_time is not None else ""
+        return "OrderJournal: Path=%s, OpenOrders=%s, Slots=%s%s" % (self.path, self.get_open_count(), self.slot_count, load_time)
+
+# End of OrderJournal
+
+
+def nan_if_none(value):
+    return NAN if value is None else value
+
+
+class OrderReconciliation(object):
+    # Status requests of reloaded orders in flight, future is resolved with this OrderReconciliation once every order
+    # got an ExecutionReport with ExecType ORDER_STATUS or, for mass status requests, once the last report arrived.
+    # Orders the gateway did not report stay open and are listed in missing
+
+    def __init__(self, orders, mass_status=False):
+        self.orders = dict((order.id, order) for order in orders)
+        self.mass_status = mass_status
+        self.pending = dict(self.orders)
+        self.confirmed = []      # OrderState with a status report
+        self.missing = []        # OrderState without a status report
+        self.unknown_count = 0   # status reports of orders not in the journal
+        self.request_ids = set() # MassStatusReqID of sent mass status requests
+        self.start_time = time.perf_counter()
+        self.time = None
+        self.lock = threading.Lock()
+        self.future = Future()
+
+    def on_status(self, order, event):
+        # called by OrderStateEngine with the updated OrderState (None for unknown orders) of every status report
+        with self.lock:
+            if self.future.done():
+                return
+            if order is not None and self.pending.pop(order.id, None) is not None:
+                self.confirmed.append(order)
+            elif order is None and event.cl_ord_id is not None:
+                self.unknown_count += 1
+            if self.mass_status:
+                if event.last_rpt_requested == "Y" and event.mass_status_req_id in self.request_ids:
+                    self.request_ids.discard(event.mass_status_req_id)
+                    if self.request_ids:
+                        return
+                elif self.pending:
+                    return
+            elif self.pending:
+                return
+        self.complete()
+
+    def complete(self):
+        # resolves the future, orders still pending are missing
+        with self.lock:
+            if self.future.done():
+                return
+            self.missing = list(self.pending.values())
+            self.time = time.perf_counter() - self.start_time
+            self.future.set_result(self)
+
+    def __str__(self):
+        time_text = "%.6fs" % self.time if self.time is not None else "pending"
+        return "OrderReconciliation: Orders=%s, Confirmed=%s, Missing=%s, Unknown=%s, Time=%s" % \
+               (len(self.orders), len(self.confirmed), len(self.missing) if self.time is not None else len(self.pending),
+                self.unknown_count, time_text)
+
+# End of OrderReconciliation
@@ -0,0 +1,211 @@
+#####################################################################################
+# Order latency instrumentation: every order is timed from the start of FixSession.submit
+# through message build, sendToTarget return, the toApp hook, first ack and first fill.
+# Latencies go into log-linear histograms per stage and destination, and optionally per symbol.
+#####################################################################################
+
+import json
+import time
+import threading
+
+STAGE_BUILD = "build"      # request converted to a FIX message
+STAGE_SEND = "send"        # sendToTarget returned
+STAGE_TO_APP = "to_app"    # Application.toApp called by QuickFIX, right before the message is written to the socket
+STAGE_ACK = "ack"          # first ExecutionReport of the order received
+STAGE_FILL = "fill"        # first fill of the order received
+STAGES = (STAGE_BUILD, STAGE_SEND, STAGE_TO_APP, STAGE_ACK, STAGE_FILL)
+
+PERCENTILES = (50.0, 99.0, 99.9)
+
+
+class LatencyHistogram(object):
+    # Log-linear histogram in the style of HdrHistogram. Values (nanoseconds) below sub_bucket_count
+    # are counted exactly, larger values are bucketed by power of two and every power of two is split
+    # into sub_bucket_count / 2 linear sub-buckets, so the relative error stays below 2 / sub_bucket_count.
+
+    def __init__(self, sub_bucket_bits=6, max_value_bits=40):
+        # defaults: 3% precision, values up to 2^40 ns (~18 minutes), larger values are clamped
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_half = 1 << (sub_bucket_bits - 1)
+        self.max_value = (1 << max_value_bits) - 1
+        self.counts = [0] * self.get_index(self.max_value) + [0]
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def get_index(self, value):
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        return shift * self.sub_bucket_half + (value >> shift)
+
+    def get_highest_equivalent_value(self, index):
+        if index < 2 * self.sub_bucket_half:
+            return index
+        shift = index // self.sub_bucket_half - 1
+        sub_bucket = index - shift * self.sub_bucket_half
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value):
+        value = min(max(int(value), 0), self.max_value)
+        self.counts[self.get_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def add(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def get_percentile(self, percentile):
+        # highest value equivalent to the value at the given percentile, None if nothing was recorded
+        if self.count == 0:
+            return None
+        rank = max(1, int(self.count * percentile / 100.0 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.get_highest_equivalent_value(index), self.max)
+        return self.max
+
+    def get_mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        # summary in microseconds
+        result = {"count": self.count}
+        if self.count:
+            result["min"] = self.min / 1000.0
+            result["mean"] = self.get_mean() / 1000.0
+            for percentile in PERCENTILES:
+                result["p%g" % percentile] = self.get_percentile(percentile) / 1000.0
+            result["max"] = self.max / 1000.0
+        return result
+
+    def __str__(self):
+        if self.count == 0:
+            return "Count=0"
+        return "Count=%s, p50=%.1fus, p99=%.1fus, p99.9=%.1fus, Max=%.1fus" % \
+               (self.count, self.get_percentile(50.0) / 1000.0, self.get_percentile(99.0) / 1000.0,
+                self.get_percentile(99.9) / 1000.0, self.max / 1000.0)
+
+# End of LatencyHistogram
+
+
+class LatencyRecorder(object):
+    # Histograms of every stage per destination and, with symbols, per symbol, recorded from the submitting
+    # thread and from the QuickFIX thread that receives execution reports. A histogram takes about 10 KB,
+    # so only the first max_symbols symbols get their own
+
+    def __init__(self, symbols=False, max_symbols=100):
+        self.symbols = symbols
+        self.max_symbols = max_symbols
+        self.histograms = {}  # (stage, "destination" or "symbol", key) -> LatencyHistogram
+        self.symbol_keys = set()
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.export_thread = None
+        self.export_stopped = threading.Event()
+
+    def record(self, stage, destination, symbol, latency):
+        # latency in nanoseconds
+        with self.lock:
+            self.get_or_create((stage, "destination", destination)).record(latency)
+            if self.symbols:
+                if symbol not in self.symbol_keys and len(self.symbol_keys) < self.max_symbols:
+                    self.symbol_keys.add(symbol)
+                if symbol in self.symbol_keys:
+                    self.get_or_create((stage, "symbol", symbol)).record(latency)
+
+    def get_or_create(self, key):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        return histogram
+
+    def get_histogram(self, stage, destination=None, symbol=None):
+        # histogram of one destination or one symbol, or of all orders of the stage if neither is given
+        with self.lock:
+            if destination is not None:
+                return self.histograms.get((stage, "destination", destination))
+            if symbol is not None:
+                return self.histograms.get((stage, "symbol", symbol))
+            return get_total(self.histograms, stage)
+
+    def snapshot(self, reset=False):
+        # {"timestamp", "interval", "stages": {stage: {"all", "destination": {...}, "symbol": {...}}}}, values in microseconds.
+        # With reset the histograms are swapped under the lock, so every sample lands in exactly one snapshot
+        with self.lock:
+            now = time.time()
+            histograms = self.histograms
+            started = self.started
+            if reset:
+                self.histograms = {}
+                self.symbol_keys = set()
+                self.started = now
+            else:
+                result = get_snapshot(histograms, now, started)
+        if reset:
+            result = get_snapshot(histograms, now, started)  # no longer recorded into
+        return result
+
+    def write_snapshot(self, path, reset=False):
+        # appends the snapshot to path as one JSON line
+        with open(path, "a") as output:
+            output.write(json.dumps(self.snapshot(reset), sort_keys=True))
+            output.write("\n")
+
+    def start_export(self, path, interval=60.0):
+        # writes a snapshot of the last interval to path every interval seconds
+        if self.export_thread is not None:
+            raise Exception("Latency export is already started")
+        self.export_stopped.clear()
+        self.export_thread = threading.Thread(target=self.run_export, args=(path, interval), name="LatencyExport", daemon=True)
+        self.export_thread.start()
+
+    def run_export(self, path, interval):
+        while not self.export_stopped.wait(interval):
+            self.write_snapshot(path, reset=True)
+        self.write_snapshot(path, reset=True)
+
+    def stop_export(self):
+        if self.export_thread is not None:
+            self.export_stopped.set()
+            self.export_thread.join()
+            self.export_thread = None
+
+    def __str__(self):
+        return "\n".join("%-7s %s" % (stage, self.get_histogram(stage)) for stage in STAGES)
+
+# End of LatencyRecorder
+
+
+def get_total(histograms, stage):
+    # histogram of all orders of the stage, every order is recorded in exactly one destination histogram
+    total = LatencyHistogram()
+    for (histogram_stage, kind, key), histogram in histograms.items():
+        if histogram_stage == stage and kind == "destination":
+            total.add(histogram)
+    return total
+
+
+def get_snapshot(histograms, now, started):
+    result = {"timestamp": now, "interval": now - started, "unit": "us", "stages": {}}
+    for stage in STAGES:
+        stage_result = {"all": get_total(histograms, stage).to_dict(), "destination": {}, "symbol": {}}
+        for (histogram_stage, kind, key), histogram in histograms.items():
+            if histogram_stage == stage:
+                stage_result[kind][str(key)] = histogram.to_dict()
+        result["stages"][stage] = stage_result
+    return result
@@ -0,0 +1,349 @@
+#####################################################################################
+# Operational metrics of a FixSession in the Prometheus text exposition format: messages
+# in and out by MsgType, rejects by reason, logons and reconnects, heartbeat gaps, queue
+# depths and latency summaries. Counters are incremented in a dict of the calling thread
+# without locking and summed over all threads on scrape, gauges and summaries are read
+# from the session on scrape, so the message path only pays for a few dict updates.
+#####################################################################################
+
+import time
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from fix_decoder import MSG_TYPE_NAMES
+from fix_latency import LatencyHistogram
+from fix_latency import STAGES
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUANTILES = (0.5, 0.99, 0.999)
+
+MSG_TYPE_HEARTBEAT = '0'
+MSG_TYPE_REJECT = '3'
+MSG_TYPE_ORDER_CANCEL_REJECT = '9'
+EXEC_TYPE_REJECTED = '8'
+# MsgType of reject messages -> (reject type label, tag of the reject reason)
+REJECT_REASON_TAGS = {
+    MSG_TYPE_REJECT: ("session", 373),       # SessionRejectReason
+    'j': ("business", 380),                  # BusinessRejectReason
+    'Y': ("market_data", 281),               # MDReqRejReason
+}
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(label_names, labels, extra=()):
+    # labels is the value of the only label or the tuple of label values
+    values = labels if isinstance(labels, tuple) else (labels,)
+    pairs = list(zip(label_names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join("%s=\"%s\"" % (name, escape(value)) for name, value in pairs)
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    # Monotonic counter with labels. inc() only touches a dict of the calling thread, get_values() sums the dicts of all threads
+
+    def __init__(self, name, help, label_names=(), value_names=None):
+        # value_names maps label values to the names shown on scrape, e.g. MsgType values to message names
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.value_names = value_names
+        self.local = threading.local()
+        self.thread_counts = [] # dict of every thread that incremented the counter, kept after the thread ends
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), value=1):
+        # labels is the value of the only label or the tuple of label values, () without labels
+        try:
+            counts = self.local.counts
+        except AttributeError:
+            counts = self.add_thread()
+        counts[labels] = counts.get(labels, 0) + value
+
+    def add_thread(self):
+        counts = self.local.counts = {}
+        with self.lock:
+            self.thread_counts.append(counts)
+        return counts
+
+    def get_values(self):
+        # {labels: value} summed over all threads
+        with self.lock:
+            thread_counts = list(self.thread_counts)
+        totals = {}
+        for counts in thread_counts:
+            for labels, value in list(counts.items()):  # copied in one step while the thread keeps counting
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def get_value(self, labels=()):
+        return self.get_values().get(labels, 0)
+
+    def render(self, lines):
+        lines.append("# HELP %s %s" % (self.name, self.help))
+        lines.append("# TYPE %s counter" % self.name)
+        values = self.get_values()
+        if self.value_names is not None:
+            values = dict((self.value_names.get(labels, labels), value) for labels, value in values.items())
+        for labels, value in sorted(values.items()):
+            lines.append("%s%s %s" % (self.name, format_labels(self.label_names, labels), format_value(value)))
+
+# End of Counter
+
+
+class Gauge(object):
+    # Value read on scrape: callback() returns a number, {labels: number} for a gauge with labels, or None to leave it out.
+    # metric_type "counter" exposes counters kept elsewhere, e.g. the reject counts of the risk engine
+
+    def __init__(self, name, help, callback, label_names=(), metric_type="gauge"):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.label_names = label_names
+        self.metric_type = metric_type
+
+    def render(self, lines):
+        values = self.callback()
+        if values is None:
+            return
+        lines.append("# HELP %s %s" % (self.name, self.help))
+        lines.append("# TYPE %s %s" % (self.name, self.metric_type))
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            if value is not None:
+                lines.append("%s%s %s" % (self.name, format_labels(self.label_names, labels), format_value(value)))
+
+# End of Gauge
+
+
+class Summary(object):
+    # Quantiles, sum and count in seconds of LatencyHistograms (nanoseconds) read on scrape,
+    # callback() returns {labels: LatencyHistogram} or None
+
+    def __init__(self, name, help, callback, label_names=()):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.label_names = label_names
+
+    def render(self, lines):
+        histograms = self.callback()
+        if histograms is None:
+            return
+        lines.append("# HELP %s %s" % (self.name, self.help))
+        lines.append("# TYPE %s summary" % self.name)
+        for labels, histogram in sorted(histograms.items()):
+            if histogram is None or histogram.count == 0:
+                continue
+            for quantile in QUANTILES:
+                lines.append("%s%s %s" % (self.name, format_labels(self.label_names, labels, (("quantile", quantile),)),
+                                          repr(histogram.get_percentile(quantile * 100) / 1e9)))
+            lines.append("%s_sum%s %s" % (self.name, format_labels(self.label_names, labels), repr(histogram.total / 1e9)))
+            lines.append("%s_count%s %s" % (self.name, format_labels(self.label_names, labels), histogram.count))
+
+# End of Summary
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, label_names=(), value_names=None):
+        return self.add(Counter(name, help, label_names, value_names))
+
+    def gauge(self, name, help, callback, label_names=(), metric_type="gauge"):
+        return self.add(Gauge(name, help, callback, label_names, metric_type))
+
+    def summary(self, name, help, callback, label_names=()):
+        return self.add(Summary(name, help, callback, label_names))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # all metrics in the Prometheus text exposition format
+        lines = []
+        for metric in self.metrics:
+            try:
+                metric.render(lines)
+            except Exception as e:
+                lines.append("# %s failed: %s" % (metric.name, escape(e)))
+        lines.append("")
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.render()
+
+# End of MetricsRegistry
+
+
+class SessionMetrics(MetricsRegistry):
+    # Metrics of a FixSession, see FixSession.start_metrics. The counters are updated by Application callbacks
+    # and the FixSession send paths, everything else is read from the session on scrape
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        self.lock = threading.Lock()
+        self.heartbeat_gaps = {}      # session id string -> LatencyHistogram of the time between received heartbeats
+        self.last_heartbeats = {}     # session id string -> time.time() of the last received heartbeat
+        self.logged_on_sessions = set()
+
+        self.messages_received = self.counter("fix_messages_received_total", "Messages received by MsgType", ("msg_type",), MSG_TYPE_NAMES)
+        self.messages_sent = self.counter("fix_messages_sent_total", "Messages sent by MsgType", ("msg_type",), MSG_TYPE_NAMES)
+        self.rejects = self.counter("fix_rejects_total", "Rejects received by type (order, cancel, session, business, market_data) and reason tag value",
+                                    ("type", "reason"))
+        self.logons = self.counter("fix_logons_total", "Logons by session", ("session",))
+        self.logouts = self.counter("fix_logouts_total", "Logouts and disconnects by session", ("session",))
+        self.reconnects = self.counter("fix_reconnects_total", "Logons after the first one by session", ("session",))
+        self.gauge("fix_session_logged_in", "1 if the session is logged in", self.get_logged_in, ("session",))
+        self.gauge("fix_logon_latency_seconds", "Time from sending Logon to receiving the Logon response of the last logon",
+                   lambda: session.application.logon_latency)
+        self.summary("fix_heartbeat_gap_seconds", "Time between received heartbeats by session", self.get_heartbeat_gaps, ("session",))
+        self.gauge("fix_heartbeat_age_seconds", "Time since the last received heartbeat by session", self.get_heartbeat_ages, ("session",))
+        self.gauge("fix_open_orders", "Orders tracked by the order state engine", session.orders.get_total_open_count)
+        self.gauge("fix_dispatcher_queue_depth", "Messages waiting in the dispatcher queues",
+                   lambda: self.get_dispatcher_value(lambda dispatcher: dispatcher.get_queue_depth()))
+        self.gauge("fix_dispatcher_dropped_total", "Messages dropped by the dispatcher",
+                   lambda: self.get_dispatcher_value(lambda dispatcher: dispatcher.dropped_count), metric_type="counter")
+        self.gauge("fix_dispatcher_handoff_latency_avg_seconds", "Average time from fromApp to a dispatcher worker",
+                   lambda: self.get_dispatcher_value(lambda dispatcher: dispatcher.get_average_handoff_latency()))
+        self.gauge("fix_dispatcher_handoff_latency_max_seconds", "Longest time from fromApp to a dispatcher worker",
+                   lambda: self.get_dispatcher_value(lambda dispatcher: dispatcher.get_max_handoff_latency()))
+        self.gauge("fix_throttle_queue_depth", "Orders waiting in the throttle",
+                   lambda: session.throttle.get_queue_depth() if session.throttle is not None else None)
+        self.gauge("fix_journal_open_orders", "Open orders in the order journal",
+                   lambda: session.journal.get_open_count() if session.journal is not None else None)
+        self.gauge("fix_risk_rejects_total", "Orders rejected by the pre-trade risk checks by reason",
+                   lambda: dict(session.risk.reject_counts) if session.risk is not None else None, ("reason",), "counter")
+        self.summary("fix_order_latency_seconds", "Order latency from submit by stage, see fix_latency", self.get_order_latencies, ("stage",))
+
+    def on_logon(self, session_id):
+        name = session_id.toString()
+        self.logons.inc(name)
+        with self.lock:
+            if name in self.logged_on_sessions:
+                self.reconnects.inc(name)
+            self.logged_on_sessions.add(name)
+
+    def on_logout(self, session_id):
+        name = session_id.toString()
+        self.logouts.inc(name)
+        with self.lock:
+            self.last_heartbeats.pop(name, None)  # the next heartbeat gap starts with the next logon
+
+    def on_admin_received(self, message, session_id):
+        msg_type = message.getHeader().getField(35)
+        self.messages_received.inc(msg_type)
+        if msg_type == MSG_TYPE_HEARTBEAT:
+            now = time.time()
+            name = session_id.toString()
+            with self.lock:
+                last_heartbeat = self.last_heartbeats.get(name)
+                self.last_heartbeats[name] = now
+                if last_heartbeat is not None:
+                    histogram = self.heartbeat_gaps.get(name)
+                    if histogram is None:
+                        histogram = self.heartbeat_gaps[name] = LatencyHistogram()
+                    histogram.record((now - last_heartbeat) * 1e9)
+        elif msg_type == MSG_TYPE_REJECT:
+            self.on_reject(msg_type, message)
+
+    def on_app_received(self, msg_type, message):
+        self.messages_received.inc(msg_type)
+        if msg_type in REJECT_REASON_TAGS:
+            self.on_reject(msg_type, message)
+
+    def on_order_event(self, event, message):
+        # ExecutionReport or OrderCancelReject already decoded by the Application
+        self.messages_received.inc(event.msg_type)
+        if event.msg_type == MSG_TYPE_ORDER_CANCEL_REJECT:
+            self.rejects.inc(("cancel", get_reason(message, 102)))  # CxlRejReason
+        elif event.exec_type == EXEC_TYPE_REJECTED:
+            self.rejects.inc(("order", get_reason(message, 103)))   # OrdRejReason
+
+    def on_reject(self, msg_type, message):
+        reject_type, reason_tag = REJECT_REASON_TAGS[msg_type]
+        self.rejects.inc((reject_type, get_reason(message, reason_tag)))
+
+    def get_logged_in(self):
+        sessions = self.session.application.sessions
+        return dict((session_id.toString(), 1 if session_id.toString() in sessions else 0) for session_id in self.session.settings.getSessions())
+
+    def get_heartbeat_gaps(self):
+        with self.lock:
+            return dict(self.heartbeat_gaps)
+
+    def get_heartbeat_ages(self):
+        now = time.time()
+        with self.lock:
+            return dict((name, now - last_heartbeat) for name, last_heartbeat in self.last_heartbeats.items())
+
+    def get_dispatcher_value(self, getter):
+        dispatcher = self.session.application.dispatcher
+        return getter(dispatcher) if dispatcher is not None else None
+
+    def get_order_latencies(self):
+        latency = self.session.latency
+        if latency is None:
+            return None
+        return dict((stage, latency.get_histogram(stage)) for stage in STAGES)
+
+# End of SessionMetrics
+
+
+def get_reason(message, tag):
+    return message.getField(tag) if message.isSetField(tag) else "none"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return  # no line per scrape on the console
+
+# End of MetricsRequestHandler
+
+
+class MetricsServer(object):
+    # Serves registry.render() at http://host:port/metrics from a daemon thread, port 0 picks a free port
+
+    def __init__(self, registry, port=9464, host="127.0.0.1"):
+        self.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.registry = registry
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def get_url(self):
+        return "http://%s:%s/metrics" % (self.server.server_address[0], self.port)
+
+# End of MetricsServer
@@ -0,0 +1,336 @@
+#####################################################################################
+# In-memory L2 order books built from MarketDataSnapshotFullRefresh (35=W)
+# and MarketDataIncrementalRefresh (35=X) messages
+#####################################################################################
+
+import time
+import bisect
+import threading
+from array import array
+import quickfix as fix
+from fix_instruments import instruments
+from fix_instruments import InstrumentTable
+
+
+class PriceLadder(object):
+    # Price levels of one book side kept in two parallel sorted arrays.
+    # Keys are stored ascending with the best level last (bids as price, asks as -price),
+    # so the top of book is always at index -1 and most updates touch the end of the arrays.
+
+    __slots__ = ("sign", "keys", "sizes")
+
+    def __init__(self, is_bid):
+        self.sign = 1.0 if is_bid else -1.0
+        self.keys = array('d')
+        self.sizes = array('d')
+
+    def update(self, price, size):
+        key = price * self.sign
+        keys = self.keys
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            if size > 0:
+                self.sizes[i] = size
+            else:
+                del keys[i]
+                del self.sizes[i]
+        elif size > 0:
+            keys.insert(i, key)
+            self.sizes.insert(i, size)
+
+    def delete(self, price):
+        self.update(price, 0)
+
+    def clear(self):
+        del self.keys[:]
+        del self.sizes[:]
+
+    def get_best_price(self):
+        return self.keys[-1] * self.sign if self.keys else None
+
+    def get_best_size(self):
+        return self.sizes[-1] if self.sizes else None
+
+    def get_levels(self, depth=0):
+        # [(price, size), ...] from the best level outwards, depth 0 means all levels
+        count = len(self.keys)
+        end = count - depth - 1 if 0 < depth < count else -1
+        return [(self.keys[i] * self.sign, self.sizes[i]) for i in range(count - 1, end, -1)]
+
+    def __len__(self):
+        return len(self.keys)
+
+# End of PriceLadder
+
+
+class OrderBook(object):
+    __slots__ = ("symbol", "instrument_id", "bids", "asks", "last_trade_price", "last_trade_size", "update_time")
+
+    def __init__(self, symbol, instrument_id=None):
+        self.symbol = symbol
+        self.instrument_id = instrument_id
+        self.bids = PriceLadder(True)
+        self.asks = PriceLadder(False)
+        self.last_trade_price = None
+        self.last_trade_size = None
+        self.update_time = None
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+
+    def update(self, entry_type, price, size):
+        if entry_type == fix.MDEntryType_BID:
+            self.bids.update(price, size)
+        elif entry_type == fix.MDEntryType_OFFER:
+            self.asks.update(price, size)
+        elif entry_type == fix.MDEntryType_TRADE:
+            self.last_trade_price = price
+            self.last_trade_size = size
+
+    def delete(self, entry_type, price):
+        if entry_type == fix.MDEntryType_BID:
+            self.bids.delete(price)
+        elif entry_type == fix.MDEntryType_OFFER:
+            self.asks.delete(price)
+
+    def get_top_of_book(self):
+        # (bid price, bid size, ask price, ask size)
+        return self.bids.get_best_price(), self.bids.get_best_size(), self.asks.get_best_price(), self.asks.get_best_size()
+
+    def __str__(self):
+        bid, bid_size, ask, ask_size = self.get_top_of_book()
+        return "OrderBook: Symbol=%s, Bid=%s, BidSize=%s, Ask=%s, AskSize=%s, BidLevels=%s, AskLevels=%s, LastTrade=%s@%s" % \
+               (self.symbol, bid, bid_size, ask, ask_size, len(self.bids), len(self.asks), self.last_trade_size, self.last_trade_price)
+
+# End of OrderBook
+
+
+class BookSnapshot(object):
+    # Immutable copy of an OrderBook: top of book, up to depth levels per side (0 for all) and the last trade
+
+    __slots__ = ("symbol", "instrument_id", "bid", "bid_size", "ask", "ask_size", "bids", "asks",
+                 "last_trade_price", "last_trade_size", "update_time")
+
+    def __init__(self, book, depth=1):
+        self.symbol = book.symbol
+        self.instrument_id = book.instrument_id
+        self.bid, self.bid_size, self.ask, self.ask_size = book.get_top_of_book()
+        self.bids = book.bids.get_levels(depth) # [(price, size)] from the best level outwards
+        self.asks = book.asks.get_levels(depth)
+        self.last_trade_price = book.last_trade_price
+        self.last_trade_size = book.last_trade_size
+        self.update_time = book.update_time
+
+    def __str__(self):
+        return "BookSnapshot: Symbol=%s, Bid=%s, BidSize=%s, Ask=%s, AskSize=%s, BidLevels=%s, AskLevels=%s, LastTrade=%s@%s" % \
+               (self.symbol, self.bid, self.bid_size, self.ask, self.ask_size, len(self.bids), len(self.asks),
+                self.last_trade_size, self.last_trade_price)
+
+# End of BookSnapshot
+
+
+class OrderBookManager(object):
+    # Maintains one OrderBook per symbol in a list indexed by instrument id,
+    # listener is called with the updated book after every message while the books are locked
+
+    def __init__(self, listener=None, registry=instruments):
+        self.registry = registry
+        self.books = InstrumentTable(self.create_book)
+        self.listener = listener
+        self.lock = threading.RLock() # held while messages are applied, take it to read books from other threads
+        self.snapshot_group = None    # group objects reused for every message, see create_groups
+        self.incremental_group = None
+
+    def create_groups(self):
+        # quickfix44 is loaded with the first market data message instead of the import of fix_session
+        import quickfix44 as fixnn
+        self.snapshot_group = fixnn.MarketDataSnapshotFullRefresh.NoMDEntries()
+        self.incremental_group = fixnn.MarketDataIncrementalRefresh.NoMDEntries()
+
+    def create_book(self, instrument_id):
+        return OrderBook(self.registry.get_symbol(instrument_id), instrument_id)
+
+    def get_book(self, symbol):
+        # fast path for symbols that already have a book: one dict lookup and one list index
+        instrument_id = self.registry.ids.get(symbol)
+        if instrument_id is not None:
+            book = self.books.get(instrument_id)
+            if book is not None:
+                return book
+        return self.books.get_or_create(self.registry.get_id(symbol))
+
+    def get_book_by_id(self, instrument_id):
+        return self.books.get_or_create(instrument_id)
+
+    def get_books(self):
+        # books of all symbols with market data, in instrument id order
+        return self.books.values()
+
+    def get_top_of_book(self, symbol):
+        instrument_id = self.registry.find_id(symbol)
+        book = self.books.get(instrument_id) if instrument_id is not None else None
+        return book.get_top_of_book() if book is not None else None
+
+    def on_message(self, msg):
+        msg_type = fix.MsgType()
+        msg.getHeader().getField(msg_type)
+        msg_type = msg_type.getValue()
+        if msg_type == fix.MsgType_MarketDataSnapshotFullRefresh:
+            with self.lock:
+                self.on_snapshot(msg)
+        elif msg_type == fix.MsgType_MarketDataIncrementalRefresh:
+            with self.lock:
+                self.on_incremental_refresh(msg)
+
+    def get_snapshot(self, symbol, depth=1):
+        # BookSnapshot of the symbol, None if there is no book
+        instrument_id = self.registry.find_id(symbol)
+        with self.lock:
+            book = self.books.get(instrument_id) if instrument_id is not None else None
+            return BookSnapshot(book, depth) if book is not None else None
+
+    def clear_book(self, symbol):
+        instrument_id = self.registry.find_id(symbol)
+        with self.lock:
+            book = self.books.get(instrument_id) if instrument_id is not None else None
+            if book is not None:
+                book.clear()
+                book.last_trade_price = book.last_trade_size = None
+
+    def on_snapshot(self, msg):
+        symbol = fix.Symbol()
+        msg.getField(symbol)
+        book = self.get_book(symbol.getValue())
+        book.clear()
+
+        if self.snapshot_group is None:
+            self.create_groups()
+        group = self.snapshot_group
+        entry_type = fix.MDEntryType()
+        price = fix.MDEntryPx()
+        size = fix.MDEntrySize()
+        for i in range(1, get_entry_count(msg) + 1):
+            msg.getGroup(i, group)
+            if not group.isSetField(price.getField()):
+                continue
+            group.getField(entry_type)
+            group.getField(price)
+            book.update(entry_type.getValue(), price.getValue(), get_size(group, size))
+
+        self.on_book_updated(book)
+
+    def on_incremental_refresh(self, msg):
+        # entries without Symbol inherit it from the previous entry
+        if self.incremental_group is None:
+            self.create_groups()
+        group = self.incremental_group
+        action = fix.MDUpdateAction()
+        entry_type = fix.MDEntryType()
+        symbol = fix.Symbol()
+        price = fix.MDEntryPx()
+        size = fix.MDEntrySize()
+
+        book = None
+        updated = []
+        for i in range(1, get_entry_count(msg) + 1):
+            msg.getGroup(i, group)
+            if group.isSetField(symbol.getField()):
+                group.getField(symbol)
+                book = self.get_book(symbol.getValue())
+                if book not in updated:
+                    updated.append(book)
+            if book is None or not group.isSetField(price.getField()):
+                continue
+
+            group.getField(action)
+            group.getField(entry_type)
+            group.getField(price)
+            if action.getValue() == fix.MDUpdateAction_DELETE:
+                book.delete(entry_type.getValue(), price.getValue())
+            else:
+                book.update(entry_type.getValue(), price.getValue(), get_size(group, size))
+
+        for book in updated:
+            self.on_book_updated(book)
+
+    def on_book_updated(self, book):
+        book.update_time = time.time()
+        if self.listener is not None:
+            self.listener(book)
+
+# End of OrderBookManager
+
+
+class BookConflator(object):
+    # Delivers only the latest state of every updated book every interval seconds: the books listener just marks
+    # the book as updated, so a slow listener costs one BookSnapshot per symbol and interval however fast updates arrive.
+    # listener(snapshots) is called on the conflator thread with the BookSnapshot of every book updated since the last call
+
+    def __init__(self, books, listener, interval=0.1, depth=1, depths=None):
+        # depths is {symbol: depth} for symbols with another depth than depth
+        self.books = books
+        self.listener = listener
+        self.interval = interval
+        self.depth = depth
+        self.depths = depths if depths is not None else {}
+        self.updated = {}  # instrument id -> OrderBook updated since the last delivery, guarded by books.lock
+        self.update_count = 0
+        self.delivered_count = 0
+        self.book_listener = books.listener  # still gets every update
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="BookConflator", daemon=True)
+
+    def start(self):
+        self.books.listener = self.on_book_updated
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.books.listener = self.book_listener
+
+    def on_book_updated(self, book):
+        self.updated[book.instrument_id] = book
+        self.update_count += 1
+        if self.book_listener is not None:
+            self.book_listener(book)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.deliver()
+
+    def deliver(self):
+        with self.books.lock:
+            updated = self.updated
+            if not updated:
+                return
+            self.updated = {}
+            depth = self.depth
+            depths = self.depths
+            snapshots = [BookSnapshot(book, depths.get(book.symbol, depth)) for book in updated.values()]
+        self.delivered_count += len(snapshots)
+        try:
+            self.listener(snapshots)
+        except Exception as e:
+            print("Error delivering conflated market data: %s" % e)
+
+    def __str__(self):
+        return "BookConflator: Interval=%ss, Updates=%s, Delivered=%s" % (self.interval, self.update_count, self.delivered_count)
+
+# End of BookConflator
+
+
+def get_entry_count(msg):
+    count = fix.NoMDEntries()
+    if not msg.isSetField(count.getField()):
+        return 0
+    msg.getField(count)
+    return count.getValue()
+
+
+def get_size(group, size):
+    if not group.isSetField(size.getField()):
+        return 0
+    group.getField(size)
+    return size.getValue()
@@ -0,0 +1,346 @@
+#####################################################################################
+# Pre-trade risk checks on the submit path: order size and notional, per symbol and per
+# account position and open order limits, and a fat-finger price band around the last
+# market data. Limits and exposures live in arrays indexed by instrument id and in dicts
+# keyed by account, so a check is a handful of O(1) lookups; fills and completed orders
+# update the exposures incrementally through the order state engine.
+#####################################################################################
+
+import threading
+from array import array
+import quickfix as fix
+from fix_instruments import instruments
+from fix_instruments import grow_array
+
+UNLIMITED = float("inf")
+
+
+class RiskLimitExceeded(Exception):
+    pass
+
+
+class RiskLimits(object):
+    # Limits of every symbol and account unless overridden, None is unlimited.
+    # Positions are net quantities (buys minus sells) checked with all open orders of one side filled.
+    # price_band is the allowed relative distance of a limit price from the reference price, e.g. 0.05 for 5%
+
+    def __init__(self, max_order_qty=None, max_order_notional=None, max_position=None, max_open_orders=None,
+                 price_band=None, account_max_position=None, account_max_open_orders=None, require_market_data=False):
+        # account limits apply per account: account_max_position to its position in each symbol,
+        # account_max_open_orders to its open orders in all symbols. With require_market_data orders of
+        # symbols without a reference price are rejected instead of skipping the price band and market order notional checks
+        self.max_order_qty = max_order_qty
+        self.max_order_notional = max_order_notional
+        self.max_position = max_position
+        self.max_open_orders = max_open_orders
+        self.price_band = price_band
+        self.account_max_position = account_max_position
+        self.account_max_open_orders = account_max_open_orders
+        self.require_market_data = require_market_data
+        self.symbol_limits = {}   # symbol -> {limit name: value}
+        self.account_limits = {}  # account -> {limit name: value}
+
+    def set_symbol_limits(self, symbol, **limits):
+        # max_order_qty, max_order_notional, max_position, max_open_orders and/or price_band of one symbol
+        self.symbol_limits.setdefault(symbol, {}).update(limits)
+
+    def set_account_limits(self, account, **limits):
+        # max_position and/or max_open_orders of one account
+        self.account_limits.setdefault(account, {}).update(limits)
+
+# End of RiskLimits
+
+
+class AccountExposure(object):
+    __slots__ = ("max_position", "max_open_orders", "open_orders", "positions", "open_buy_qty", "open_sell_qty")
+
+    def __init__(self, max_position, max_open_orders):
+        self.max_position = max_position
+        self.max_open_orders = max_open_orders
+        self.open_orders = 0
+        # per instrument id of the account
+        self.positions = array('d')
+        self.open_buy_qty = array('d')
+        self.open_sell_qty = array('d')
+
+    def grow(self, instrument_id):
+        grow_array(self.positions, instrument_id)
+        grow_array(self.open_buy_qty, instrument_id)
+        grow_array(self.open_sell_qty, instrument_id)
+
+# End of AccountExposure
+
+
+class RiskEngine(object):
+    # check() runs on the submitting thread before the order is sent and reserves its quantity,
+    # on_fill() and release() run from the order state engine on execution reports
+
+    def __init__(self, limits, books=None, registry=instruments):
+        # books is the OrderBookManager with the market data used as reference prices
+        self.limits = limits
+        self.books = books
+        self.registry = registry
+        self.lock = threading.Lock()
+        # limits per instrument id, filled from RiskLimits on first use of an instrument
+        self.max_order_qty = array('d')
+        self.max_order_notional = array('d')
+        self.max_position = array('d')
+        self.max_open_orders = array('d')
+        self.price_band = array('d')
+        # exposure per instrument id
+        self.positions = array('d')
+        self.open_buy_qty = array('d')
+        self.open_sell_qty = array('d')
+        self.open_orders = array('q')
+        self.accounts = {}  # account -> AccountExposure, orders without account are not checked against account limits
+        self.reserved = {}  # ClOrdID -> [instrument id, AccountExposure, is buy, quantity not filled yet]
+        self.checked_count = 0
+        self.rejected_count = 0
+        self.reject_counts = {} # reason -> count
+
+    def prepare_instrument(self, instrument_id):
+        # precomputes the limits of an instrument, called with the lock held
+        if instrument_id < len(self.open_orders):
+            return
+        limits = self.limits
+        count = instrument_id + 1
+        for name, values in (("max_order_qty", self.max_order_qty), ("max_order_notional", self.max_order_notional),
+                             ("max_position", self.max_position), ("max_open_orders", self.max_open_orders),
+                             ("price_band", self.price_band)):
+            start = len(values)
+            grow_array(values, instrument_id, UNLIMITED)
+            for i in range(start, count):
+                value = limits.symbol_limits.get(self.registry.get_symbol(i), {}).get(name, getattr(limits, name))
+                values[i] = value if value is not None else UNLIMITED
+        grow_array(self.positions, instrument_id)
+        grow_array(self.open_buy_qty, instrument_id)
+        grow_array(self.open_sell_qty, instrument_id)
+        grow_array(self.open_orders, instrument_id)
+
+    def get_account(self, account):
+        exposure = self.accounts.get(account)
+        if exposure is None:
+            limits = self.limits
+            account_limits = limits.account_limits.get(account, {})
+            max_position = account_limits.get("max_position", limits.account_max_position)
+            max_open_orders = account_limits.get("max_open_orders", limits.account_max_open_orders)
+            exposure = self.accounts[account] = AccountExposure(max_position if max_position is not None else UNLIMITED,
+                                                                max_open_orders if max_open_orders is not None else UNLIMITED)
+        return exposure
+
+    def get_reference_price(self, instrument_id):
+        # mid of the top of book, one side of it or the last trade, None without market data
+        if self.books is None:
+            return None
+        book = self.books.books.get(instrument_id)
+        if book is None:
+            return None
+        bid = book.bids.get_best_price()
+        ask = book.asks.get_best_price()
+        if bid is not None and ask is not None:
+            return (bid + ask) * 0.5
+        if bid is not None:
+            return bid
+        return ask if ask is not None else book.last_trade_price
+
+    def reject(self, reason, text):
+        self.rejected_count += 1
+        self.reject_counts[reason] = self.reject_counts.get(reason, 0) + 1
+        raise RiskLimitExceeded(text)
+
+    def get_instrument_id(self, request):
+        instrument_id = request.instrument_id
+        if instrument_id is None:
+            instrument_id = request.instrument_id = self.registry.get_id(request.symbol)
+        return instrument_id
+
+    def check_order(self, request, instrument_id, quantity, price, reference):
+        # limits of a single order, called with the lock held
+        if instrument_id >= len(self.open_orders):
+            self.prepare_instrument(instrument_id)
+        if not quantity or quantity <= 0:
+            self.reject("quantity", "Invalid quantity %s" % quantity)
+        if quantity > self.max_order_qty[instrument_id]:
+            self.reject("max_order_qty", "Quantity %s exceeds %s for %s" % (quantity, self.max_order_qty[instrument_id], request.symbol))
+        if reference is None and self.limits.require_market_data:
+            self.reject("market_data", "No market data for %s" % request.symbol)
+        if price is not None:
+            if price <= 0:
+                self.reject("price", "Invalid price %s" % price)
+            band = self.price_band[instrument_id]
+            if reference is not None and abs(price - reference) > band * reference:
+                self.reject("price_band", "Price %s is more than %.2f%% away from %s for %s" % (price, band * 100, reference, request.symbol))
+        notional_price = price if price is not None else reference
+        if notional_price is not None and quantity * notional_price > self.max_order_notional[instrument_id]:
+            self.reject("max_order_notional", "Notional %s exceeds %s for %s" % (quantity * notional_price, self.max_order_notional[instrument_id], request.symbol))
+
+    def check(self, request):
+        # raises RiskLimitExceeded if the OrderRequest breaks a limit, otherwise reserves it until release()
+        instrument_id = self.get_instrument_id(request)
+        quantity = request.quantity
+        price = request.price
+        is_buy = request.side == fix.Side_BUY
+        reference = self.get_reference_price(instrument_id)
+        with self.lock:
+            self.checked_count += 1
+            self.check_order(request, instrument_id, quantity, price, reference)
+            open_orders = self.open_orders
+            if open_orders[instrument_id] >= self.max_open_orders[instrument_id]:
+                self.reject("max_open_orders", "Open orders of %s exceed %s" % (request.symbol, self.max_open_orders[instrument_id]))
+            # worst case position: every open order of the side of the new one is filled
+            open_qty = self.open_buy_qty if is_buy else self.open_sell_qty
+            signed = quantity if is_buy else -quantity
+            position = self.positions[instrument_id] + signed + (open_qty[instrument_id] if is_buy else -open_qty[instrument_id])
+            if abs(position) > self.max_position[instrument_id]:
+                self.reject("max_position", "Position %s of %s would exceed %s" % (position, request.symbol, self.max_position[instrument_id]))
+
+            account = request.account
+            if account is not None:
+                account = self.accounts.get(account) or self.get_account(account)
+                if account.open_orders >= account.max_open_orders:
+                    self.reject("account_max_open_orders", "Open orders of account %s exceed %s" % (request.account, account.max_open_orders))
+                if instrument_id >= len(account.positions):
+                    account.grow(instrument_id)
+                account_open_qty = account.open_buy_qty if is_buy else account.open_sell_qty
+                position = account.positions[instrument_id] + signed + (account_open_qty[instrument_id] if is_buy else -account_open_qty[instrument_id])
+                if abs(position) > account.max_position:
+                    self.reject("account_max_position", "Position %s of account %s in %s would exceed %s" %
+                                (position, request.account, request.symbol, account.max_position))
+                account.open_orders += 1
+                account_open_qty[instrument_id] += quantity
+
+            open_orders[instrument_id] += 1
+            open_qty[instrument_id] += quantity
+            self.reserved[request.id] = [instrument_id, account, is_buy, quantity]
+
+    def check_replace(self, id, request, quantity=None, price=None):
+        # raises RiskLimitExceeded if replacing quantity and/or price of the order with ClOrdID id breaks a limit.
+        # Nothing is reserved here, on_replace() moves the reservation once the gateway accepts the replace
+        instrument_id = self.get_instrument_id(request)
+        quantity = quantity if quantity is not None else request.quantity
+        price = price if price is not None else request.price
+        is_buy = request.side == fix.Side_BUY
+        reference = self.get_reference_price(instrument_id)
+        with self.lock:
+            self.checked_count += 1
+            self.check_order(request, instrument_id, quantity, price, reference)
+            increase = quantity - request.quantity
+            reservation = self.reserved.get(id)
+            if increase <= 0 or reservation is None:
+                return
+            # worst case position with the open quantity of the order raised by increase
+            signed = increase if is_buy else -increase
+            open_qty = self.open_buy_qty if is_buy else self.open_sell_qty
+            position = self.positions[instrument_id] + signed + (open_qty[instrument_id] if is_buy else -open_qty[instrument_id])
+            if abs(position) > self.max_position[instrument_id]:
+                self.reject("max_position", "Position %s of %s would exceed %s" % (position, request.symbol, self.max_position[instrument_id]))
+            account = reservation[1]
+            if account is not None:
+                account_open_qty = account.open_buy_qty if is_buy else account.open_sell_qty
+                position = account.positions[instrument_id] + signed + (account_open_qty[instrument_id] if is_buy else -account_open_qty[instrument_id])
+                if abs(position) > account.max_position:
+                    self.reject("account_max_position", "Position %s of account %s in %s would exceed %s" %
+                                (position, request.account, request.symbol, account.max_position))
+
+    def on_replace(self, id, quantity_change):
+        # the gateway accepted a replace of the order with ClOrdID id that changed its quantity by quantity_change
+        with self.lock:
+            reservation = self.reserved.get(id)
+            if reservation is None:
+                return
+            instrument_id, account, is_buy, remaining = reservation
+            change = max(0.0, remaining + quantity_change) - remaining
+            reservation[3] = remaining + change
+            (self.open_buy_qty if is_buy else self.open_sell_qty)[instrument_id] += change
+            if account is not None:
+                (account.open_buy_qty if is_buy else account.open_sell_qty)[instrument_id] += change
+
+    def reserve(self, request, remaining):
+        # tracks the exposure of an order that is already open without checking it, e.g. one reloaded from the journal.
+        # remaining is its quantity not filled yet
+        instrument_id = self.get_instrument_id(request)
+        is_buy = request.side == fix.Side_BUY
+        remaining = max(0.0, remaining or 0.0)
+        with self.lock:
+            if request.id in self.reserved:
+                return
+            if instrument_id >= len(self.open_orders):
+                self.prepare_instrument(instrument_id)
+            account = None
+            if request.account is not None:
+                account = self.get_account(request.account)
+                if instrument_id >= len(account.positions):
+                    account.grow(instrument_id)
+                account.open_orders += 1
+                (account.open_buy_qty if is_buy else account.open_sell_qty)[instrument_id] += remaining
+            self.open_orders[instrument_id] += 1
+            (self.open_buy_qty if is_buy else self.open_sell_qty)[instrument_id] += remaining
+            self.reserved[request.id] = [instrument_id, account, is_buy, remaining]
+
+    def on_fill(self, id, quantity):
+        # quantity of the order with ClOrdID id was filled: moves it from the open quantity to the position
+        with self.lock:
+            reservation = self.reserved.get(id)
+            if reservation is None:
+                return
+            instrument_id, account, is_buy, remaining = reservation
+            open_quantity = min(quantity, remaining)
+            reservation[3] = remaining - open_quantity
+            signed = quantity if is_buy else -quantity
+            self.positions[instrument_id] += signed
+            if is_buy:
+                self.open_buy_qty[instrument_id] -= open_quantity
+            else:
+                self.open_sell_qty[instrument_id] -= open_quantity
+            if account is not None:
+                account.positions[instrument_id] += signed
+                if is_buy:
+                    account.open_buy_qty[instrument_id] -= open_quantity
+                else:
+                    account.open_sell_qty[instrument_id] -= open_quantity
+
+    def release(self, id):
+        # the order with ClOrdID id is completed or was never sent, its unfilled quantity is no longer open
+        with self.lock:
+            reservation = self.reserved.pop(id, None)
+            if reservation is None:
+                return
+            instrument_id, account, is_buy, remaining = reservation
+            self.open_orders[instrument_id] -= 1
+            if is_buy:
+                self.open_buy_qty[instrument_id] -= remaining
+            else:
+                self.open_sell_qty[instrument_id] -= remaining
+            if account is not None:
+                account.open_orders -= 1
+                if is_buy:
+                    account.open_buy_qty[instrument_id] -= remaining
+                else:
+                    account.open_sell_qty[instrument_id] -= remaining
+
+    def set_position(self, symbol, position, account=None):
+        # start of day position, positive for long. Without account it is the position of the symbol over all accounts
+        instrument_id = self.registry.get_id(symbol)
+        with self.lock:
+            self.prepare_instrument(instrument_id)
+            if account is None:
+                self.positions[instrument_id] = position
+            else:
+                exposure = self.get_account(account)
+                exposure.grow(instrument_id)
+                exposure.positions[instrument_id] = position
+
+    def get_position(self, symbol, account=None):
+        instrument_id = self.registry.find_id(symbol)
+        positions = self.positions if account is None else (self.accounts[account].positions if account in self.accounts else ())
+        return positions[instrument_id] if instrument_id is not None and instrument_id < len(positions) else 0.0
+
+    def get_open_count(self, symbol):
+        instrument_id = self.registry.find_id(symbol)
+        return self.open_orders[instrument_id] if instrument_id is not None and instrument_id < len(self.open_orders) else 0
+
+    def __str__(self):
+        return "RiskEngine: Checked=%s, Rejected=%s %s, OpenOrders=%s" % \
+               (self.checked_count, self.rejected_count, self.reject_counts, len(self.reserved))
+
+# End of RiskEngine
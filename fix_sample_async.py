@@ -0,0 +1,45 @@
+##############################################################################
+# This is minimalistic sample that illustrates how to trade from asyncio:
+# one task prints market data while orders are awaited without blocking threads
+##############################################################################
+import sys
+import asyncio
+import quickfix as fix
+
+from fix_session import MarketDataRequest
+from fix_session_async import AsyncFixSession
+
+
+async def print_market_data(session, symbol):
+    async with session.market_data(symbol) as updates:
+        async for update in updates:
+            print(update)
+
+
+async def main(config_file):
+    session = AsyncFixSession(config_file)
+    await session.start(timeout=30)
+
+    request = MarketDataRequest()
+    request.set_symbols(["BTCUSD"])
+    request.set_update_type(fix.MDUpdateType_INCREMENTAL_REFRESH)
+    await session.submit(request)
+    market_data = asyncio.ensure_future(print_market_data(session, "BTCUSD"))
+
+    # LIMIT BUY and MARKET SELL in parallel
+    orders = await asyncio.gather(session.submit_buy_order("AUTOCERT", "BTCUSD", 1.0, 40000.0, "GOLD", {8076: "FILL"}),
+                                  session.submit_sell_order("AUTOCERT", "BTCUSD", 1.0, None, "GOLD", {8076: "FILL"}))
+    for order in orders:
+        print(await session.wait_completed(order))
+
+    await asyncio.sleep(1)
+    await session.stop()
+    await market_data
+
+
+if __name__=='__main__':
+    if len(sys.argv) < 2:
+        print("Please specify config file parameter")
+        exit(1)
+
+    asyncio.run(main(sys.argv[1]))
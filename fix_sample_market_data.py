@@ -2,6 +2,7 @@
 # This is minimalistic sample that illustrates how to subscribe for market data
 ###############################################################################
 import sys
+import quickfix as fix
 
 from fix_session import FixSession
 from fix_session import MarketDataRequest
@@ -18,9 +19,11 @@ if __name__=='__main__':
 
     request = MarketDataRequest()
     request.set_symbols(["BTCUSD"])
+    request.set_update_type(fix.MDUpdateType_INCREMENTAL_REFRESH)
     session.submit(request)
 
     # wait for user to type something then stop session
     command = input()
+    print(session.books.get_book("BTCUSD"))
     session.stop()
 
@@ -1,7 +1,6 @@
 ##############################################################################
 # This is minimalistic sample that illustrates how to submit FIX orders
 ##############################################################################
-import time
 import sys
 from fix_session import FixSession
 
@@ -16,11 +15,13 @@ if __name__=='__main__':
     session.start()
 
     # LIMIT BUY
-    session.submit_buy_order("AUTOCERT", "BTCUSD", 1.0, 40000.0, "GOLD", {8076: "FILL"})
+    buy = session.submit_buy_order("AUTOCERT", "BTCUSD", 1.0, 40000.0, "GOLD", {8076: "FILL"})
 
     # MARKET SELL
-    session.submit_sell_order("AUTOCERT", "BTCUSD", 1.0, None, "GOLD", {8076: "FILL"})
+    sell = session.submit_sell_order("AUTOCERT", "BTCUSD", 1.0, None, "GOLD", {8076: "FILL"})
 
-    time.sleep(0.5) # wait for events
-    session.stop()
+    # wait for both orders to complete
+    for order in (buy, sell):
+        print(order.result(timeout=5).completed.result(timeout=5))
 
+    session.stop()
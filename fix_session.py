@@ -4,9 +4,23 @@
 #####################################################################################
 
 import time
+import queue
+import threading
 import quickfix as fix
 import configparser
-import quickfix44 as fixnn
+from array import array
+from concurrent.futures import Future
+from fix_order_book import OrderBookManager
+from fix_decoder import decode_execution_report
+from fix_decoder import format_execution_report
+from fix_decoder import print_message
+from fix_decoder import SOH
+from fix_factories import create_initiator
+from fix_factories import load_settings
+from fix_latency import LatencyRecorder, STAGE_BUILD, STAGE_SEND, STAGE_TO_APP, STAGE_ACK, STAGE_FILL
+from fix_throttle import OrderScheduler
+from fix_instruments import instruments
+from fix_instruments import grow_array
 
 
 class Application(fix.Application):
@@ -14,23 +28,93 @@ class Application(fix.Application):
     session_id = None
     session_pwd = None
     logged_out = False
+    order_engine = None
+    execution_report_listener = None
+    status_listener = None
+    market_data_handler = None
+    dispatcher = None
+    message_log = None
+    logon_count = 0
+    logon_sent_time = None
+    logon_latency = None
+    latency_recorder = None
+    metrics = None
+
+    def __init__(self):
+        super().__init__()
+        self.status_changed = threading.Event() # set on every logon and logout
+        self.sessions = {}  # session id string -> SessionID of logged in sessions
+        self.passwords = {} # session id string -> SenderPassword
+        self.to_app_time = threading.local() # toApp runs on the thread calling sendToTarget
+
+    def setSessionPassword(self, password, session_id=None):
+        # password of the given session, or of all sessions without their own password
+        if session_id is None:
+            self.session_pwd = password
+        else:
+            self.passwords[session_id.toString()] = password
+
+    def setOrderStateEngine(self, order_engine):
+        self.order_engine = order_engine
+
+    def setExecutionReportListener(self, execution_report_listener):
+        self.execution_report_listener = execution_report_listener
+
+    def setStatusListener(self, status_listener):
+        # status_listener(session_id, logged_in) is called on the QuickFIX thread after every logon and logout
+        self.status_listener = status_listener
+
+    def setMarketDataHandler(self, market_data_handler):
+        self.market_data_handler = market_data_handler
 
-    def setSessionPassword(self, password):
-        self.session_pwd = password
+    def setDispatcher(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def setMessageLog(self, message_log):
+        self.message_log = message_log
+
+    def setLatencyRecorder(self, latency_recorder):
+        self.latency_recorder = latency_recorder
+
+    def setMetrics(self, metrics):
+        self.metrics = metrics
 
     def onCreate(self, session_id):
+        if self.message_log is not None:
+            self.message_log.onEvent(session_id, "Created session")
         return
 
     def onLogon(self, session_id):
         print("Session %s successfully logged in" % session_id)
+        if self.message_log is not None:
+            self.message_log.onEvent(session_id, "Received logon")
+        if self.logon_sent_time is not None:
+            # time between sending Logon and receiving the gateway's Logon response
+            self.logon_latency = time.perf_counter() - self.logon_sent_time
+            print("Logon latency: %.3f ms, logon count: %s" % (self.logon_latency * 1000, self.logon_count + 1))
+        self.logon_count += 1
+        if self.metrics is not None:
+            self.metrics.on_logon(session_id)
+        self.sessions[session_id.toString()] = session_id
         self.session_id = session_id
         self.logged_out = False
+        self.status_changed.set()
+        if self.status_listener is not None:
+            self.status_listener(session_id, True)
         return
 
     def onLogout(self, session_id):
         print("Session %s logged out" % session_id)
+        if self.message_log is not None:
+            self.message_log.onEvent(session_id, "Disconnected")
+        if self.metrics is not None:
+            self.metrics.on_logout(session_id)
+        self.sessions.pop(session_id.toString(), None)
         self.session_id = None
         self.logged_out = True
+        self.status_changed.set()
+        if self.status_listener is not None:
+            self.status_listener(session_id, False)
         return
 
     def toAdmin(self, message, session_id):
@@ -39,86 +123,535 @@ class Application(fix.Application):
         msgType = fix.MsgType()
         message.getHeader().getField(msgType)
         if msgType.getValue() == fix.MsgType_Logon :
-            message.getHeader().setField(fix.Password(self.session_pwd))
+            message.getHeader().setField(fix.Password(self.passwords.get(session_id.toString(), self.session_pwd)))
+            self.logon_sent_time = time.perf_counter()
+        if self.metrics is not None:
+            self.metrics.messages_sent.inc(msgType.getValue())
+        if self.message_log is not None:
+            self.message_log.onOutgoing(session_id, message)
         return
 
     def fromAdmin(self, message, session_id):
         if self.debug:
             print("From Admin message: %s" % message)
+        if self.message_log is not None:
+            self.message_log.onIncoming(session_id, message)
+        if self.metrics is not None:
+            self.metrics.on_admin_received(message, session_id)
         return
 
     def toApp(self, message, session_id):
+        if self.latency_recorder is not None:
+            self.to_app_time.value = time.perf_counter_ns()
         if self.debug:
             print("To App message: ", end='')
             print_message(message)
+        if self.message_log is not None:
+            self.message_log.onOutgoing(session_id, message)
         return
 
     def fromApp(self, message, session_id):
-        print("Received message: ", end='')
-        print_message(message)
+        if self.message_log is not None:
+            self.message_log.onIncoming(session_id, message)
+        if self.dispatcher is not None:
+            # hand off to worker threads so that the QuickFIX network thread is never blocked by processing
+            self.dispatcher.dispatch(message)
+        else:
+            self.process_message(message)
         return
 
+    def process_message(self, message):
+        msg_type = fix.MsgType()
+        message.getHeader().getField(msg_type)
+        msg_type = msg_type.getValue()
+        if msg_type in (fix.MsgType_ExecutionReport, fix.MsgType_OrderCancelReject):
+            # decode once for both printing and order state tracking
+            event = decode_execution_report(message)
+            if self.metrics is not None:
+                self.metrics.on_order_event(event, message)
+            print("Received message: %s" % format_execution_report(event))
+            if self.order_engine is not None:
+                self.order_engine.on_execution_report(event)
+            if self.execution_report_listener is not None:
+                self.execution_report_listener(event)
+        else:
+            if self.metrics is not None:
+                self.metrics.on_app_received(msg_type, message)
+            print("Received message: ", end='')
+            print_message(message)
+            if self.market_data_handler is not None:
+                self.market_data_handler.on_message(message)
+
+
+class MessageDispatcher(object):
+    # Hands incoming messages from the QuickFIX callback thread to worker threads.
+    # Messages are routed by instrument id so that events of one symbol are processed in order by the same worker.
+    # Incremental refreshes carry Symbol in their entries and are routed by the Symbol of the first entry,
+    # so a refresh mixing symbols of different workers stays in order with the snapshots of its first symbol only.
+    POLICY_BLOCK = "block"        # wait for free space in the worker queue
+    POLICY_DROP = "drop"          # drop the message when the worker queue is full
+    POLICY_COALESCE = "coalesce"  # keep only the latest market data snapshot per symbol, block on other messages
+
+    def __init__(self, handler, worker_count=1, capacity=10000, overflow_policy=POLICY_BLOCK):
+        if overflow_policy not in (self.POLICY_BLOCK, self.POLICY_DROP, self.POLICY_COALESCE):
+            raise Exception("Unknown overflow policy: %s" % overflow_policy)
+        self.handler = handler
+        self.overflow_policy = overflow_policy
+        self.queues = [queue.Queue(capacity) for i in range(worker_count)]
+        self.workers = []
+        self.snapshots = {}  # symbol -> latest pending snapshot in coalesce mode
+        self.snapshot_lock = threading.Lock()
+        self.dispatched_count = 0
+        self.dropped_count = 0
+        self.coalesced_count = 0
+        # per worker statistics, each slot is only updated by its own worker thread
+        self.processed_counts = [0] * worker_count
+        self.total_handoff_latencies = [0.0] * worker_count
+        self.max_handoff_latencies = [0.0] * worker_count
+
+    def start(self):
+        for i in range(len(self.queues)):
+            worker = threading.Thread(target=self.run_worker, args=(i,), name="FixDispatcher-%s" % i, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def dispatch(self, message):
+        # QuickFIX reuses the message passed to fromApp so the worker gets a copy
+        message = fix.Message(message)
+        symbol = self.get_symbol(message)
+        worker_queue = self.queues[instruments.get_id(symbol) % len(self.queues)] if symbol is not None else self.queues[0]
+        self.dispatched_count += 1
+
+        if self.overflow_policy == self.POLICY_COALESCE and symbol is not None and \
+                message.getHeader().getField(35) == fix.MsgType_MarketDataSnapshotFullRefresh:
+            with self.snapshot_lock:
+                pending = symbol in self.snapshots
+                self.snapshots[symbol] = message
+            if pending:
+                self.coalesced_count += 1
+                return
+            item = (time.perf_counter(), symbol)
+        else:
+            item = (time.perf_counter(), message)
+
+        if self.overflow_policy == self.POLICY_DROP:
+            try:
+                worker_queue.put_nowait(item)
+            except queue.Full:
+                self.dropped_count += 1
+        else:
+            worker_queue.put(item)
+
+    def get_symbol(self, message):
+        if message.isSetField(55):
+            return message.getField(55)
+        if message.getHeader().getField(35) == fix.MsgType_MarketDataIncrementalRefresh:
+            # Symbol of the first NoMDEntries entry, the raw text is faster to search than the group through QuickFIX
+            text = message.toString()
+            start = text.find(SOH + "55=")
+            if start >= 0:
+                start += 4
+                return text[start:text.index(SOH, start)]
+        return None
+
+    def run_worker(self, index):
+        worker_queue = self.queues[index]
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                break
+
+            enqueue_time, message = item
+            latency = time.perf_counter() - enqueue_time
+            self.total_handoff_latencies[index] += latency
+            if latency > self.max_handoff_latencies[index]:
+                self.max_handoff_latencies[index] = latency
+
+            if isinstance(message, str):
+                with self.snapshot_lock:
+                    message = self.snapshots.pop(message)
+            try:
+                self.handler(message)
+            except Exception as e:
+                print("Error processing message: %s" % e)
+            self.processed_counts[index] += 1
+
+    def get_queue_depth(self):
+        return sum(worker_queue.qsize() for worker_queue in self.queues)
+
+    def get_processed_count(self):
+        return sum(self.processed_counts)
+
+    def get_average_handoff_latency(self):
+        processed_count = self.get_processed_count()
+        return sum(self.total_handoff_latencies) / processed_count if processed_count else 0.0
+
+    def get_max_handoff_latency(self):
+        return max(self.max_handoff_latencies)
+
+    def __str__(self):
+        return "MessageDispatcher: Workers=%s, Policy=%s, QueueDepth=%s, Dispatched=%s, Processed=%s, Dropped=%s, Coalesced=%s, AvgHandoffLatency=%.1fus, MaxHandoffLatency=%.1fus" % \
+               (len(self.queues), self.overflow_policy, self.get_queue_depth(), self.dispatched_count, self.get_processed_count(),
+                self.dropped_count, self.coalesced_count, self.get_average_handoff_latency() * 1000000, self.get_max_handoff_latency() * 1000000)
+
+# End of MessageDispatcher
+
 
 class FixSession(object) :
     initiator = None
     exec_id = 0
+    templates = None
+    trader_id = None
+    latency = None
+    throttle = None
+    capture = None
+    request_pool = None
+    journal = None
+    risk = None
+    metrics = None
+    metrics_server = None
+    verbose = True
 
     def __init__(self, config_file):
-        self.settings = fix.SessionSettings(config_file)
-        self.config = configparser.ConfigParser()
+        self.settings = load_settings(config_file)
+        self.config = configparser.ConfigParser(strict=False) # QuickFIX config may contain several SESSION sections
         self.config.read(config_file)
-
-        sender_pwd = None
-        if "SESSION" in self.config and "SenderPassword" in self.config["SESSION"]:
-            sender_pwd = self.config["SESSION"]["SenderPassword"]
+        # optional TraderID in DEFAULT section overrides SenderCompID sent in order bodies, empty value omits it
+        self.trader_id = self.config["DEFAULT"].get("TraderID")
 
         self.application = Application()
-        if sender_pwd:
-            self.application.setSessionPassword(sender_pwd)
-        else:
-            print("Warning: SESSION SenderPassword is not specified in config file: " + config_file)
+        self.orders = OrderStateEngine()
+        self.orders.set_amend_sender(self.send_amend)
+        self.application.setOrderStateEngine(self.orders)
+        self.books = OrderBookManager()
+        self.application.setMarketDataHandler(self.books)
+        for session_id in self.settings.getSessions():
+            session_settings = self.settings.get(session_id)
+            if session_settings.has("SenderPassword") and session_settings.getString("SenderPassword"):
+                self.application.setSessionPassword(session_settings.getString("SenderPassword"), session_id)
+            else:
+                print("Warning: SESSION %s SenderPassword is not specified in config file: %s" % (session_id, config_file))
+
+        self.initiator, self.store_factory, self.log_factory = create_initiator(self.application, self.settings, self.config)
+
+    def start(self, timeout=None):
+        # returns as soon as the session is logged in, result is the time in seconds it took to log in
+        start_time = time.perf_counter()
+        self.start_initiator()
 
-        store_factory = fix.FileStoreFactory(self.settings)
-        log_factory = fix.FileLogFactory(self.settings)
-        self.initiator = fix.SocketInitiator(self.application, store_factory, self.settings, log_factory)
+        # wait for the client to login
+        if not self.application.status_changed.wait(timeout):
+            self.initiator.stop()
+            raise Exception("Login timed out after %s seconds" % timeout)
 
-    def start(self):
+        if not self.application.session_id:
+            raise Exception("Login failed")
+
+        return time.perf_counter() - start_time
+
+    def start_initiator(self):
+        # starts connecting and returns without waiting for the logon, see get_login_status()
         if not self.initiator.isStopped():
             raise Exception("Session is already started")
 
         self.application.session_id = None
+        self.application.sessions.clear()
         self.application.logged_out = False
+        self.application.status_changed.clear()
+        if self.application.message_log is not None:
+            self.application.message_log.start()
         self.initiator.start()
 
-        # wait for the client to login
-        while not self.application.session_id and not self.application.logged_out:
-            time.sleep(0.1)
-
-        if not self.application.session_id:
-            raise Exception("Login failed")
+    def get_login_status(self):
+        # True once logged in, False if the login failed, None while logging in
+        if self.application.session_id:
+            return True
+        return False if self.application.logged_out else None
 
     def stop(self):
+        if self.throttle is not None:
+            self.throttle.stop()
+            self.throttle = None
         self.initiator.stop()
+        if self.application.message_log is not None:
+            self.application.message_log.stop()  # after the initiator, so that the logout is written too
+        if self.latency is not None:
+            self.latency.stop_export()
+        if self.capture is not None:
+            self.capture.close()
+            if self.application.market_data_handler is self.capture:
+                self.application.setMarketDataHandler(self.capture.handler)  # e.g. a subscription manager started before
+            self.capture = None  # a handler installed in front of the capture keeps it, closed captures pass messages on
+        if self.application.dispatcher is not None:
+            self.application.dispatcher.stop()
+            self.application.setDispatcher(None)
+        if self.journal is not None:
+            self.journal.close()
+            self.orders.set_journal(None)
+            self.journal = None
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+    def start_dispatcher(self, worker_count=1, capacity=10000, overflow_policy=MessageDispatcher.POLICY_BLOCK):
+        # process incoming application messages on worker threads instead of the QuickFIX network thread
+        if self.application.dispatcher is not None:
+            raise Exception("Dispatcher is already started")
+        dispatcher = MessageDispatcher(self.application.process_message, worker_count, capacity, overflow_policy)
+        dispatcher.start()
+        self.application.setDispatcher(dispatcher)
+        return dispatcher
+
+    def start_throttle(self, session_rate=None, session_burst=1, destination_rates=None, policy=OrderScheduler.POLICY_QUEUE, capacity=10000):
+        # pace outbound messages with token buckets per session (session_rate messages per second)
+        # and per destination (destination_rates is {destination: (rate, burst)})
+        if self.throttle is not None:
+            raise Exception("Throttle is already started")
+        throttle = OrderScheduler(session_rate, session_burst, destination_rates, policy, capacity)
+        throttle.start()
+        self.throttle = throttle
+        return throttle
+
+    def start_capture(self, directory, capacity=1 << 20):
+        # write every market data entry to the columnar capture in directory before it is passed to the current
+        # market data handler (the books, or a subscription manager in front of them)
+        if self.capture is not None:
+            raise Exception("Capture is already started")
+        from fix_capture import MarketDataCapture # optional features are imported on first use to keep the import of this module short
+        self.capture = MarketDataCapture(directory, self.application.market_data_handler, capacity)
+        self.application.setMarketDataHandler(self.capture)
+        return self.capture
+
+    def start_risk_checks(self, limits):
+        # check every order against RiskLimits before it is sent, orders over a limit raise fix_risk.RiskLimitExceeded
+        # from submit. Reference prices for the price band come from the order books of this session
+        if self.risk is not None:
+            raise Exception("Risk checks are already started")
+        from fix_risk import RiskEngine
+        self.risk = RiskEngine(limits, self.books)
+        self.reserve_open_orders()
+        self.orders.set_risk_engine(self.risk)
+        return self.risk
+
+    def reserve_open_orders(self):
+        # open orders the risk checks did not see, e.g. those reloaded from the journal, count against the limits too
+        for order in dict((order.id, order) for order in self.orders.get_open_orders()).values():
+            request = order.request
+            if request is not None and request.quantity is not None:
+                remaining = order.leaves_qty if order.leaves_qty is not None else request.quantity - order.cum_qty
+                self.risk.reserve(request, remaining)
+
+    def start_journal(self, path, capacity=4096):
+        # persist the state of open orders in path. Open orders of the previous run are reloaded from it and tracked again,
+        # reconcile them with reconcile_orders() once logged in. Call before submitting orders
+        if self.journal is not None:
+            raise Exception("Journal is already started")
+        from fix_journal import OrderJournal
+        journal = OrderJournal(path, capacity)
+        session_ids = dict((session_id.toString(), session_id) for session_id in self.settings.getSessions())
+        for record in journal.records:
+            request = OrderRequest()
+            request.set_id(record.id)
+            request.set_symbol(record.symbol)
+            request.set_side(record.side)
+            request.set_quantity(record.quantity)
+            request.set_price(record.price)
+            request.set_order_type(record.order_type)
+            request.set_time_in_force(record.time_in_force)
+            request.set_account(record.account)
+            request.set_destination(record.destination)
+            request.set_exchange(record.exchange)
+            order = OrderState(request)
+            order.session = record.session
+            order.session_id = session_ids.get(record.session)
+            order.status = record.status
+            order.cum_qty = record.cum_qty or 0.0
+            order.leaves_qty = record.leaves_qty
+            order.avg_price = record.avg_price
+            if record.cl_ord_id is not None and record.cl_ord_id != record.id:
+                order.cl_ord_id = record.cl_ord_id
+                order.chain.append(record.cl_ord_id)
+            order.journal_slot = record.slot
+            if order.status is not None and order.status != fix.OrdStatus_PENDING_NEW:
+                order.set_acked()
+            self.orders.restore(order)
+        self.orders.set_journal(journal)
+        self.journal = journal
+        if self.risk is not None:
+            self.reserve_open_orders()
+        print("Loaded %s" % journal)
+        return journal
+
+    def reconcile_orders(self, mass_status=False):
+        # asks the gateway for the status of every open order, one OrderStatusRequest per order or one OrderMassStatusRequest
+        # per logged in session. Returns a Future of OrderReconciliation resolved once all status reports arrived
+        from fix_journal import OrderReconciliation
+        orders = list(dict((order.id, order) for order in self.orders.get_open_orders()).values())
+        reconciliation = OrderReconciliation(orders, mass_status)
+        self.orders.set_reconciliation(reconciliation)
+        requests = []
+        if mass_status:
+            for session_id in list(self.application.sessions.values()):
+                request = OrderMassStatusRequest()
+                request.set_id(self.gen_exec_id())
+                reconciliation.request_ids.add(request.id)
+                requests.append((request, session_id))
+        else:
+            for order in orders:
+                request = OrderStatusRequest()
+                request.set_id(self.gen_exec_id())
+                request.set_order(order)
+                requests.append((request, order.session_id or self.get_session_id(request)))
+        if not requests:
+            reconciliation.complete()
+        for request, session_id in requests:
+            # status requests go to the session of the order and are not throttled
+            if self.verbose:
+                print("Sending %s" % request)
+            fix.Session.sendToTarget(request.get_fix_message(), session_id)
+            if self.metrics is not None:
+                self.metrics.messages_sent.inc(request.msg_type)
+        return reconciliation.future
+
+    def start_latency_tracking(self, export_path=None, export_interval=60.0, symbols=False, max_symbols=100):
+        # time every submitted order, export_path gets a JSON line snapshot of the last export_interval seconds.
+        # symbols also keeps histograms per symbol, for the first max_symbols symbols
+        if self.latency is not None:
+            raise Exception("Latency tracking is already started")
+        self.latency = LatencyRecorder(symbols, max_symbols)
+        self.application.setLatencyRecorder(self.latency)
+        self.orders.set_latency_recorder(self.latency)
+        if export_path is not None:
+            self.latency.start_export(export_path, export_interval)
+        return self.latency
+
+    def start_metrics(self, port=None, host="127.0.0.1"):
+        # count messages by MsgType, rejects by reason, logons and heartbeat gaps, queue depths and latencies are read on scrape.
+        # With a port the metrics are served at http://host:port/metrics in the Prometheus text format, port 0 picks a free port
+        if self.metrics is not None:
+            raise Exception("Metrics are already started")
+        from fix_metrics import SessionMetrics, MetricsServer
+        self.metrics = SessionMetrics(self)
+        self.application.setMetrics(self.metrics)
+        if port is not None:
+            self.metrics_server = MetricsServer(self.metrics, port, host)
+            self.metrics_server.start()
+            print("Serving metrics at %s" % self.metrics_server.get_url())
+        return self.metrics
+
+    def set_verbose(self, verbose):
+        # print every sent order, amend and status request
+        self.verbose = verbose
+
+    def set_use_templates(self, use_templates):
+        # in template mode NewOrderSingle messages are copied from a prototype prepared once
+        # per destination/account/symbol combination and only per-order fields are stamped
+        self.templates = {} if use_templates else None
+
+    def set_use_request_pool(self, use_request_pool, capacity=10000):
+        # submit_order takes OrderRequest objects from a freelist and completed orders return them,
+        # OrderState.request of completed orders is None in this mode
+        self.request_pool = OrderRequestPool(capacity) if use_request_pool else None
+        return self.request_pool
+
+    def get_order_message(self, request):
+        if self.templates is None or not isinstance(request, OrderRequest):
+            return request.get_fix_message()
+
+        key = request.get_template_key()
+        template = self.templates.get(key)
+        if template is None:
+            template = self.templates[key] = OrderTemplate(request)
+        return template.get_fix_message(request)
 
     def gen_exec_id(self):
         new_id = time.time_ns()
         self.exec_id = new_id if self.exec_id < new_id else self.exec_id + 1
         return repr(self.exec_id)
 
+    def get_session_id(self, request):
+        # session to send the request to
+        return self.application.session_id
+
     def submit(self, request):
+        # returns a future of OrderState for order requests, resolved on acknowledgement, fill or reject
+        latency = self.latency
+        start_time = time.perf_counter_ns() if latency is not None else None
+        session_id = self.get_session_id(request)
+        if session_id is None:
+            if isinstance(request, OrderRequest) and request.pool is not None:
+                request.pool.release(request)
+            raise Exception("No session is logged in")
         request.set_id(self.gen_exec_id())
-
-        print("Sending %s" % request)
-        fix.Session.sendToTarget(request.get_fix_message(), self.application.session_id)
+        if self.trader_id is not None and isinstance(request, OrderRequest):
+            request.set_trader_id(self.trader_id)
+
+        message = self.get_order_message(request)
+        if self.risk is not None and isinstance(request, OrderRequest):
+            try:
+                self.risk.check(request)
+            except:
+                if request.pool is not None:
+                    request.pool.release(request)
+                raise
+        order = self.orders.add(request, session_id, start_time) if isinstance(request, OrderRequest) else None
+        build_time = time.perf_counter_ns() if latency is not None else None
+
+        if self.verbose:
+            print("Sending %s" % request)
+        if self.throttle is None:
+            self.send_order(message, session_id, order, start_time, build_time, request.msg_type)
+        else:
+            try:
+                self.throttle.schedule(lambda: self.send_order(message, session_id, order, start_time, build_time, request.msg_type),
+                                       session_id.toString(), getattr(request, "destination", None))
+            except:
+                if order is not None:
+                    self.orders.remove(order.id)
+                raise
+
+        return order.acked if order is not None else None
+
+    def send_order(self, message, session_id, order=None, start_time=None, build_time=None, msg_type=fix.MsgType_NewOrderSingle):
+        latency = self.latency if start_time is not None else None
+        if latency is not None:
+            self.application.to_app_time.value = None
+            # a pooled request may be completed and reused before sendToTarget returns
+            request = order.request if order is not None else None
+            destination, symbol = (request.destination, request.symbol) if request is not None else (None, None)
+        try:
+            fix.Session.sendToTarget(message, session_id)
+        except Exception as e:
+            if order is not None:
+                self.orders.remove(order.id)
+                order.set_ack_exception(e)  # the future of a throttled order is already returned
+            raise
+        if self.metrics is not None:
+            self.metrics.messages_sent.inc(msg_type)
+
+        if latency is not None and request is not None:
+            send_time = time.perf_counter_ns()
+            to_app_time = self.application.to_app_time.value
+            latency.record(STAGE_BUILD, destination, symbol, build_time - start_time)
+            latency.record(STAGE_SEND, destination, symbol, send_time - start_time)
+            if to_app_time is not None:
+                latency.record(STAGE_TO_APP, destination, symbol, to_app_time - start_time)
 
     def submit_buy_order(self, destination, symbol, quantity, price=None, account=None, custom_fields=None):
-        self.submit_order(destination, fix.Side_BUY, symbol, quantity, price, account, custom_fields)
+        return self.submit_order(destination, fix.Side_BUY, symbol, quantity, price, account, custom_fields)
 
     def submit_sell_order(self, destination, symbol, quantity, price=None, account=None, custom_fields=None):
-        self.submit_order(destination, fix.Side_SELL, symbol, quantity, price, account, custom_fields)
+        return self.submit_order(destination, fix.Side_SELL, symbol, quantity, price, account, custom_fields)
 
     def submit_order(self, destination, side, symbol, quantity, price=None, account=None, custom_fields=None):
-        request = OrderRequest()
+        request = self.request_pool.acquire() if self.request_pool is not None else OrderRequest()
         request.set_symbol(symbol)
         request.set_destination(destination)
         request.set_side(side)
@@ -135,33 +668,591 @@ class FixSession(object) :
         if custom_fields:
             request.set_custom_fields(custom_fields)
 
-        self.submit(request)
+        return self.submit(request)
+
+    def cancel_order(self, id):
+        # id is the ClOrdID the order was submitted with, returns a future of OrderAmend resolved once
+        # the gateway cancels the order or rejects the cancel
+        return self.amend_order(id, OrderAmend(cancel=True))
+
+    def replace_order(self, id, quantity=None, price=None):
+        # id is the ClOrdID the order was submitted with, returns a future of OrderAmend resolved once
+        # the gateway replaces the order or rejects the replace.
+        # While a replace or cancel of the order is in flight, further replaces are coalesced into one
+        # pending replace with the latest quantity and price, which is sent when the in flight one is answered
+        if quantity is None and price is None:
+            raise Exception("Must specify quantity or price to replace")
+        return self.amend_order(id, OrderAmend(quantity, price))
+
+    def amend_order(self, id, amend):
+        order = self.orders.get(id)
+        if order is None:
+            raise Exception("Unknown or completed order: %s" % id)
+        if self.risk is not None and not amend.cancel and order.request is not None:
+            self.risk.check_replace(order.id, order.request, amend.quantity, amend.price)
+        if self.orders.queue_amend(order, amend):
+            try:
+                self.send_amend(order, amend)
+            except Exception as e:
+                self.orders.fail_amends(order, str(e))
+                raise
+        return amend.future
+
+    def send_amend(self, order, amend):
+        # called with the amend already registered as in flight, on the QuickFIX thread for coalesced amends.
+        # With a throttle, amends go through its priority lane ahead of new orders
+        if self.throttle is not None:
+            self.throttle.schedule(lambda: self.send_amend_now(order, amend), order.session, order.request.destination, priority=True)
+        else:
+            self.send_amend_now(order, amend)
+
+    def send_amend_now(self, order, amend):
+        amend.id = self.gen_exec_id()
+        amend.orig_id = order.cl_ord_id
+        self.orders.add_alias(order, amend.id)
+        if amend.cancel:
+            message = order.request.get_cancel_message(amend.id, amend.orig_id)
+        else:
+            message = order.request.get_replace_message(amend.id, amend.orig_id, amend.quantity, amend.price)
+        if self.verbose:
+            print("Sending %s" % amend)
+        try:
+            fix.Session.sendToTarget(message, order.session_id)
+        except Exception as e:
+            if self.throttle is not None:
+                self.orders.fail_amends(order, str(e))  # nobody else sees the error of a throttled amend
+            raise
+        if self.metrics is not None:
+            self.metrics.messages_sent.inc(fix.MsgType_OrderCancelRequest if amend.cancel else fix.MsgType_OrderCancelReplaceRequest)
+
+    def submit_orders(self, requests, list_size=0):
+        # build all messages in one pass, then send them back to back without per-order printing
+        # list_size > 0 packs orders into NewOrderList (35=E) messages of up to list_size orders each
+        start_time = time.perf_counter()
+        submit_time = time.perf_counter_ns() if self.latency is not None else None  # ack and fill are timed from the start of the batch
+        ids = []
+        futures = []
+        messages = []
+        try:
+            if list_size > 0:
+                batch = []
+                session_id = None
+                for request in requests:
+                    if not batch:
+                        session_id = self.get_session_id(request)
+                    request.set_id(self.gen_exec_id())
+                    if self.trader_id is not None:
+                        request.set_trader_id(self.trader_id)
+                    if self.risk is not None:
+                        self.risk.check(request)
+                    ids.append(request.id)
+                    futures.append(self.orders.add(request, session_id, submit_time).acked)
+                    batch.append(request)
+                    if len(batch) == list_size:
+                        messages.append((session_id, batch[0].destination, self.get_order_list_message(batch)))
+                        batch = []
+                if batch:
+                    messages.append((session_id, batch[0].destination, self.get_order_list_message(batch)))
+            else:
+                for request in requests:
+                    session_id = self.get_session_id(request)
+                    request.set_id(self.gen_exec_id())
+                    if self.trader_id is not None:
+                        request.set_trader_id(self.trader_id)
+                    if self.risk is not None:
+                        self.risk.check(request)
+                    ids.append(request.id)
+                    futures.append(self.orders.add(request, session_id, submit_time).acked)
+                    messages.append((session_id, request.destination, self.get_order_message(request)))
+        except:
+            # nothing of the batch is sent if one order fails the risk checks or cannot be built
+            for id in ids:
+                self.orders.remove(id)
+            raise
+
+        build_time = time.perf_counter()
+        throttle = self.throttle
+        for session_id, destination, message in messages:
+            if throttle is None:
+                fix.Session.sendToTarget(message, session_id)
+            else:
+                # with the queue policy this blocks only once the throttle queue is full
+                throttle.schedule(lambda message=message, session_id=session_id: fix.Session.sendToTarget(message, session_id),
+                                  session_id.toString(), destination)
+        send_time = time.perf_counter()
+        if self.metrics is not None:
+            self.metrics.messages_sent.inc(fix.MsgType_NewOrderList if list_size > 0 else fix.MsgType_NewOrderSingle, len(messages))
+
+        result = BatchResult(ids, futures, len(messages), build_time - start_time, send_time - build_time)
+        if self.verbose:
+            print("Sent %s" % result)
+        return result
+
+    def get_order_list_message(self, requests):
+        request = fix.Message()
+        request.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+        request.getHeader().setField(fix.MsgType(fix.MsgType_NewOrderList))
+
+        request.setField(fix.ListID(self.gen_exec_id()))
+        request.setField(fix.BidType(fix.BidType_NO_BIDDING_PROCESS))
+        request.setField(fix.TotNoOrders(len(requests)))
+
+        import quickfix44 as fixnn # group classes only, loaded with the first order list
+
+        seq_no = 1
+        for order in requests:
+            group = fixnn.NewOrderList().NoOrders()
+            group.setField(fix.ListSeqNo(seq_no))
+            order.set_fix_fields(group)
+            request.addGroup(group)
+            seq_no += 1
+
+        if requests[0].trader_id:
+            request.setField(fix.SenderCompID(requests[0].trader_id))
+        return request
 
 
 # End of FixSession
 
 
+class BatchResult(object):
+
+    def __init__(self, ids, futures, message_count, build_time, send_time):
+        self.ids = ids
+        self.futures = futures
+        self.message_count = message_count
+        self.build_time = build_time
+        self.send_time = send_time
+
+    def get_throughput(self):
+        # orders per second measured over the send loop
+        return len(self.ids) / self.send_time if self.send_time > 0 else float("inf")
+
+    def __str__(self):
+        return "BatchResult: Orders=%s, Messages=%s, BuildTime=%.6fs, SendTime=%.6fs, Throughput=%.0f orders/s" % \
+               (len(self.ids), self.message_count, self.build_time, self.send_time, self.get_throughput())
+
+# End of BatchResult
+
+
+class OrderState(object):
+    TERMINAL_STATUSES = (fix.OrdStatus_FILLED, fix.OrdStatus_CANCELED, fix.OrdStatus_REJECTED, fix.OrdStatus_EXPIRED)
+    __slots__ = ("id", "request", "session", "session_id", "status", "exec_type", "cum_qty", "leaves_qty", "avg_price",
+                 "last_qty", "last_price", "text", "cl_ord_id", "chain", "pending_amend", "queued_amend",
+                 "submit_time", "fill_time", "is_acked", "is_completed", "ack_exception", "acked_future", "completed_future",
+                 "journal_slot")
+    # Futures are created on first use and dropped once the order is completed, so a completed order and its futures
+    # do not form a reference cycle (future result -> OrderState -> future) that only the garbage collector can free
+    future_lock = threading.Lock()
+
+    def __init__(self, request):
+        self.id = request.id
+        self.request = request
+        self.session = None    # session id string
+        self.session_id = None # fix.SessionID
+        self.status = None
+        self.exec_type = None
+        self.cum_qty = 0.0
+        self.leaves_qty = request.quantity
+        self.avg_price = None
+        self.last_qty = None
+        self.last_price = None
+        self.text = None
+        self.cl_ord_id = request.id # ClOrdID of the last accepted replace, OrigClOrdID of the next cancel/replace
+        self.chain = [request.id]   # ClOrdIDs of the order and all its cancel/replace requests
+        self.pending_amend = None   # OrderAmend in flight
+        self.queued_amend = None    # OrderAmend waiting for the one in flight, later amends are coalesced into it
+        self.submit_time = None    # time.perf_counter_ns() at submit when latency tracking is on
+        self.fill_time = None      # time.perf_counter_ns() of the first fill when latency tracking is on
+        self.is_acked = False
+        self.is_completed = False
+        self.ack_exception = None
+        self.acked_future = None
+        self.completed_future = None
+        self.journal_slot = None   # slot of the order in the OrderJournal
+
+    @property
+    def acked(self):
+        # Future resolved with this OrderState on first ack, fill or reject
+        with self.future_lock:
+            future = self.acked_future
+            if future is None:
+                future = Future()
+                if self.ack_exception is not None:
+                    future.set_exception(self.ack_exception)
+                elif self.is_acked:
+                    future.set_result(self)
+                if not self.is_completed:
+                    self.acked_future = future
+            return future
+
+    @property
+    def completed(self):
+        # Future resolved with this OrderState once the order is filled, canceled, rejected or expired
+        with self.future_lock:
+            future = self.completed_future
+            if future is None:
+                future = Future()
+                if self.is_completed:
+                    future.set_result(self)
+                else:
+                    self.completed_future = future
+            return future
+
+    def set_acked(self):
+        with self.future_lock:
+            if self.is_acked or self.ack_exception is not None:
+                return
+            self.is_acked = True
+            future = self.acked_future
+        # callbacks run outside the lock, they may use the futures of the order
+        if future is not None:
+            future.set_result(self)
+
+    def set_ack_exception(self, exception):
+        with self.future_lock:
+            if self.is_acked or self.ack_exception is not None:
+                return
+            self.ack_exception = exception
+            future = self.acked_future
+        if future is not None:
+            future.set_exception(exception)
+
+    def set_completed(self):
+        with self.future_lock:
+            self.is_completed = True
+            future = self.completed_future
+            self.acked_future = self.completed_future = None
+        if future is not None:
+            future.set_result(self)
+
+    def is_done(self):
+        return self.status in self.TERMINAL_STATUSES
+
+    def __str__(self):
+        return "OrderState: ID=%s, Status=%s, ExecType=%s, CumQty=%s, LeavesQty=%s, AvgPrice=%s, Text=%s" % \
+               (self.id, self.status, self.exec_type, self.cum_qty, self.leaves_qty, self.avg_price, self.text)
+
+# End of OrderState
+
+
+class OrderStateEngine(object):
+    # tracks open orders by ClOrdID and resolves their futures from incoming ExecutionReports
+
+    latency_recorder = None
+    amend_sender = None
+    journal = None
+    reconciliation = None
+    risk = None
+    coalesced_count = 0
+    order_class = OrderState
+
+    def __init__(self):
+        self.orders = {}      # ClOrdID of the order or any of its cancel/replace requests -> OrderState
+        self.open_counts = {} # session id string -> number of open orders
+        # per instrument statistics indexed by instrument id
+        self.instrument_open_counts = array('q') # number of open orders
+        self.instrument_filled_qty = array('d')  # quantity filled since start
+        self.lock = threading.Lock()
+
+    def set_latency_recorder(self, latency_recorder):
+        # records ack and fill latencies of orders added with a submit_time
+        self.latency_recorder = latency_recorder
+
+    def set_journal(self, journal):
+        # OrderJournal persisting the state of open orders
+        self.journal = journal
+
+    def set_risk_engine(self, risk):
+        # RiskEngine releasing the exposure of completed orders and moving fills into positions
+        self.risk = risk
+
+    def set_reconciliation(self, reconciliation):
+        # OrderReconciliation getting every order status report
+        self.reconciliation = reconciliation
+
+    def add(self, request, session_id=None, submit_time=None):
+        order = self.order_class(request)
+        order.session = session_id.toString() if session_id is not None else None
+        order.session_id = session_id
+        order.submit_time = submit_time
+        if self.journal is not None:
+            try:
+                self.journal.add(order)  # first, so that an order the journal cannot hold is not tracked
+            except:
+                if self.risk is not None:
+                    self.risk.release(order.id)
+                raise
+        self.restore(order)
+        return order
+
+    def restore(self, order):
+        # tracks an OrderState, e.g. one rebuilt from the journal of a previous run
+        instrument_id = order.request.instrument_id
+        with self.lock:
+            self.orders[order.id] = order
+            if order.cl_ord_id != order.id:
+                self.orders[order.cl_ord_id] = order
+            self.open_counts[order.session] = self.open_counts.get(order.session, 0) + 1
+            if instrument_id is not None:
+                grow_array(self.instrument_open_counts, instrument_id)
+                self.instrument_open_counts[instrument_id] += 1
+
+    def get(self, id):
+        return self.orders.get(id)
+
+    def remove(self, id):
+        with self.lock:
+            order = self.orders.pop(id, None)
+            if order is not None:
+                for alias in order.chain:
+                    self.orders.pop(alias, None)
+                self.open_counts[order.session] -= 1
+                if order.request.instrument_id is not None:
+                    self.instrument_open_counts[order.request.instrument_id] -= 1
+        if order is not None and self.journal is not None:
+            self.journal.remove(order)
+        if order is not None and self.risk is not None:
+            self.risk.release(order.id)
+        if order is not None and order.request.pool is not None:
+            request = order.request
+            order.request = None
+            request.pool.release(request)
+        return order
+
+    def add_alias(self, order, id):
+        # ClOrdID of a cancel/replace request of the order, execution reports may refer to it
+        with self.lock:
+            if order.id in self.orders:
+                self.orders[id] = order
+            order.chain.append(id)
+
+    def set_amend_sender(self, amend_sender):
+        # amend_sender(order, amend) sends a queued amend once the one in flight is answered
+        self.amend_sender = amend_sender
+
+    def queue_amend(self, order, amend):
+        # returns True if the amend must be sent now, False if it was queued or coalesced
+        with self.lock:
+            if order.id not in self.orders:
+                raise Exception("Unknown or completed order: %s" % order.id)
+            if order.pending_amend is None:
+                order.pending_amend = amend
+                return True
+            queued = order.queued_amend
+            if queued is None:
+                order.queued_amend = amend
+            else:
+                # keep the latest quantity and price, a cancel supersedes replaces
+                queued.coalesce(amend)
+                amend.future = queued.future
+                self.coalesced_count += 1
+            return False
+
+    def finish_amend(self, order, rejected, text=None):
+        # answers the amend in flight and returns the queued amend to send next, if any
+        with self.lock:
+            amend = order.pending_amend
+            if amend is None:
+                return None
+            order.pending_amend = None
+            queued = order.queued_amend
+            order.queued_amend = None
+            if queued is not None and not order.is_done():
+                order.pending_amend = queued
+        amend.rejected = rejected
+        amend.text = text
+        amend.future.set_result(amend)
+        if queued is not None and order.is_done():
+            queued.rejected = True
+            queued.text = "Order is completed"
+            queued.future.set_result(queued)
+            return None
+        return queued
+
+    def get_open_count(self, session=None):
+        # session is a session id string
+        return self.open_counts.get(session, 0)
+
+    def get_total_open_count(self):
+        # open orders of all sessions
+        with self.lock:
+            return sum(self.open_counts.values())
+
+    def get_instrument_open_count(self, symbol):
+        instrument_id = instruments.find_id(symbol)
+        counts = self.instrument_open_counts
+        return counts[instrument_id] if instrument_id is not None and instrument_id < len(counts) else 0
+
+    def get_instrument_filled_qty(self, symbol):
+        instrument_id = instruments.find_id(symbol)
+        filled = self.instrument_filled_qty
+        return filled[instrument_id] if instrument_id is not None and instrument_id < len(filled) else 0.0
+
+    def get_open_orders(self):
+        with self.lock:
+            return list(self.orders.values())
+
+    def on_message(self, msg):
+        if msg.getHeader().getField(35) == fix.MsgType_ExecutionReport:
+            self.on_execution_report(decode_execution_report(msg))
+
+    def on_execution_report(self, event):
+        order = self.orders.get(event.cl_ord_id)
+        if order is None:
+            if event.exec_type == fix.ExecType_ORDER_STATUS and self.reconciliation is not None:
+                self.reconciliation.on_status(None, event)
+            return None
+
+        if event.msg_type == fix.MsgType_OrderCancelReject:
+            self.on_amend_done(order, event, True)
+            return order
+
+        exec_type = event.exec_type
+        order.exec_type = exec_type
+        order.status = event.order_status
+        if event.cum_qty is not None:
+            order.cum_qty = event.cum_qty
+        if event.leaves_qty is not None:
+            order.leaves_qty = event.leaves_qty
+        if event.avg_price is not None:
+            order.avg_price = event.avg_price
+        if event.last_qty is not None:
+            order.last_qty = event.last_qty
+        if event.last_price is not None:
+            order.last_price = event.last_price
+        instrument_id = order.request.instrument_id
+        if exec_type == fix.ExecType_TRADE and event.last_qty and instrument_id is not None:
+            with self.lock:
+                grow_array(self.instrument_filled_qty, instrument_id)
+                self.instrument_filled_qty[instrument_id] += event.last_qty
+        if exec_type == fix.ExecType_TRADE and event.last_qty and self.risk is not None:
+            self.risk.on_fill(order.id, event.last_qty)
+        if event.text is not None:
+            order.text = event.text
+
+        if order.submit_time is not None and self.latency_recorder is not None:
+            self.record_latency(order, exec_type)
+
+        if exec_type != fix.ExecType_PENDING_NEW:
+            order.set_acked()
+
+        if exec_type == fix.ExecType_REPLACED:
+            amend = order.pending_amend
+            if amend is not None and amend.id == event.cl_ord_id:
+                order.cl_ord_id = amend.id
+                if amend.quantity is not None and self.risk is not None:
+                    self.risk.on_replace(order.id, amend.quantity - order.request.quantity)
+                if amend.quantity is not None:
+                    order.request.quantity = amend.quantity
+                if amend.price is not None:
+                    order.request.price = amend.price
+            self.on_amend_done(order, event, False)
+
+        if order.is_done():
+            self.remove(order.id)
+            order.set_acked()
+            order.set_completed()
+            if order.pending_amend is not None:
+                self.on_amend_done(order, event, exec_type != fix.ExecType_CANCELED)
+        elif self.journal is not None:
+            self.journal.update(order)
+
+        if exec_type == fix.ExecType_ORDER_STATUS and self.reconciliation is not None:
+            self.reconciliation.on_status(order, event)
+
+        return order
+
+    def on_amend_done(self, order, event, rejected):
+        amend = order.pending_amend
+        if amend is None or (event.cl_ord_id != amend.id and not order.is_done()):
+            return
+        queued = self.finish_amend(order, rejected, event.text)
+        if queued is not None and self.amend_sender is not None:
+            try:
+                self.amend_sender(order, queued)
+            except Exception as e:
+                self.fail_amends(order, str(e))
+
+    def fail_amends(self, order, text):
+        # rejects the amend in flight and all amends queued behind it
+        while self.finish_amend(order, True, text) is not None:
+            pass
+
+    def record_latency(self, order, exec_type):
+        now = time.perf_counter_ns()
+        request = order.request
+        if exec_type != fix.ExecType_PENDING_NEW and not order.is_acked:
+            self.latency_recorder.record(STAGE_ACK, request.destination, request.symbol, now - order.submit_time)
+        if exec_type == fix.ExecType_TRADE and order.fill_time is None:
+            order.fill_time = now
+            self.latency_recorder.record(STAGE_FILL, request.destination, request.symbol, now - order.submit_time)
+
+# End of OrderStateEngine
+
+
+class OrderAmend(object):
+    # Cancel or cancel/replace request of an order, future is resolved with this OrderAmend once it is answered
+
+    def __init__(self, quantity=None, price=None, cancel=False):
+        self.id = None       # ClOrdID of the request, assigned when it is sent
+        self.orig_id = None  # OrigClOrdID
+        self.quantity = quantity
+        self.price = price
+        self.cancel = cancel
+        self.rejected = None
+        self.text = None
+        self.future = Future()
+
+    def coalesce(self, amend):
+        if amend.cancel:
+            self.cancel = True
+        if amend.quantity is not None:
+            self.quantity = amend.quantity
+        if amend.price is not None:
+            self.price = amend.price
+
+    def __str__(self):
+        if self.cancel:
+            return "OrderCancelRequest: ID=%s, OrigID=%s" % (self.id, self.orig_id)
+        return "OrderCancelReplaceRequest: ID=%s, OrigID=%s, Quantity=%s, Price=%s" % (self.id, self.orig_id, self.quantity, self.price)
+
+# End of OrderAmend
+
+
 class OrderRequest(object) :
-    id = None
-    symbol = None
-    side = fix.Side_BUY
-    quantity = None
-    price = None
-    order_type = fix.OrdType_MARKET
-    time_in_force = fix.TimeInForce_DAY
-    account = None
-    destination = None
-    exchange = None
-    custom_fields = {}
+    msg_type = fix.MsgType_NewOrderSingle
+    __slots__ = ("id", "symbol", "instrument_id", "side", "quantity", "price", "order_type", "time_in_force",
+                 "account", "destination", "exchange", "custom_fields", "trader_id", "pool")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.id = None
+        self.symbol = None
+        self.instrument_id = None
+        self.side = fix.Side_BUY
+        self.quantity = None
+        self.price = None
+        self.order_type = fix.OrdType_MARKET
+        self.time_in_force = fix.TimeInForce_DAY
+        self.account = None
+        self.destination = None
+        self.exchange = None
+        self.custom_fields = None # {tag: value}
+        self.trader_id = "TRADER"
+        self.pool = None          # OrderRequestPool the request returns to once the order is completed
 
     def set_id(self, id):
         self.id = id
 
     def set_symbol(self, symbol):
-        self.symbol = symbol
+        self.instrument_id = instruments.get_id(symbol)
+        self.symbol = instruments.symbols[self.instrument_id]
 
     def set_side(self, side):
-        self.side = fix.Side_BUY if side.upper() == "BUY" else fix.Side_SELL
+        self.side = fix.Side_BUY if side == fix.Side_BUY or side.upper() == "BUY" else fix.Side_SELL
 
     def set_quantity(self, quantity):
         self.quantity = quantity
@@ -187,11 +1278,64 @@ class OrderRequest(object) :
     def set_custom_fields(self, custom_fields):
         self.custom_fields = custom_fields
 
+    def set_trader_id(self, trader_id):
+        # sent as SenderCompID in the message body, empty value omits the tag
+        self.trader_id = trader_id
+
     def get_fix_message(self):
         request = fix.Message()
         request.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
         request.getHeader().setField(fix.MsgType(fix.MsgType_NewOrderSingle))
 
+        self.set_fix_fields(request)
+
+        if self.trader_id:
+            request.setField(fix.SenderCompID(self.trader_id))
+
+        return request
+
+    def get_replace_message(self, id, orig_id, quantity=None, price=None):
+        # OrderCancelReplaceRequest (35=G) repeating all fields of the order with the new quantity and price
+        request = fix.Message()
+        request.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+        request.getHeader().setField(fix.MsgType(fix.MsgType_OrderCancelReplaceRequest))
+
+        self.set_fix_fields(request)
+        request.setField(fix.ClOrdID(id))
+        request.setField(fix.OrigClOrdID(orig_id))
+        if quantity is not None:
+            request.setField(fix.OrderQty(quantity))
+        if price is not None:
+            request.setField(fix.Price(price))
+
+        if self.trader_id:
+            request.setField(fix.SenderCompID(self.trader_id))
+
+        return request
+
+    def get_cancel_message(self, id, orig_id):
+        request = fix.Message()
+        request.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+        request.getHeader().setField(fix.MsgType(fix.MsgType_OrderCancelRequest))
+
+        request.setField(fix.ClOrdID(id))
+        request.setField(fix.OrigClOrdID(orig_id))
+        request.setField(fix.Symbol(self.symbol))
+        request.setField(fix.Side(self.side))
+        request.setField(fix.OrderQty(self.quantity))
+        if self.account:
+            request.setField(fix.Account(self.account))
+        if self.destination is not None:
+            request.setField(fix.ExecBroker(self.destination))
+        request.setField(fix.TransactTime())
+
+        if self.trader_id:
+            request.setField(fix.SenderCompID(self.trader_id))
+
+        return request
+
+    def set_fix_fields(self, request):
+        # request is either a NewOrderSingle message or a NewOrderList NoOrders group
         assert self.id
         request.setField(fix.ClOrdID(self.id))
 
@@ -226,12 +1370,13 @@ class OrderRequest(object) :
 
         request.setField(fix.TransactTime())
 
-        for key in self.custom_fields:
-            request.setField(key, self.custom_fields[key])
+        if self.custom_fields:
+            for key in self.custom_fields:
+                request.setField(key, self.custom_fields[key])
 
-        request.setField(fix.SenderCompID("TRADER"))
-
-        return request
+    def get_template_key(self):
+        custom_fields = tuple(sorted(self.custom_fields.items())) if self.custom_fields else None
+        return (self.destination, self.account, self.symbol, self.side, self.order_type, self.time_in_force, self.exchange, custom_fields, self.trader_id)
 
     def __str__(self):
         side = "BUY" if self.side == fix.Side_BUY else "SELL"
@@ -242,15 +1387,127 @@ class OrderRequest(object) :
 # End of ObjectRequest
 
 
+class OrderRequestPool(object):
+    # Freelist of OrderRequest objects: FixSession.submit_order takes requests from the pool and
+    # OrderStateEngine returns them once their orders are completed, so an order burst does not
+    # allocate a request per order. Requests are freed by reference counting anyway, so the pool does not reduce
+    # garbage collections (fix_benchmark.py gc). OrderState.request of a completed pooled order is None.
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity  # most requests kept in the freelist
+        self.free = []
+        self.created_count = 0
+        self.reused_count = 0
+
+    def acquire(self):
+        try:
+            request = self.free.pop()
+            self.reused_count += 1
+        except IndexError:
+            request = OrderRequest()
+            self.created_count += 1
+        request.pool = self
+        return request
+
+    def release(self, request):
+        request.reset()
+        if len(self.free) < self.capacity:
+            self.free.append(request)
+
+    def __str__(self):
+        return "OrderRequestPool: Free=%s, Created=%s, Reused=%s" % (len(self.free), self.created_count, self.reused_count)
+
+# End of OrderRequestPool
+
+
+class OrderTemplate(object):
+    # NewOrderSingle prototype with all invariant fields of an OrderRequest template key
+
+    def __init__(self, request):
+        self.order_type = request.order_type
+        prototype = fix.Message()
+        prototype.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+        prototype.getHeader().setField(fix.MsgType(fix.MsgType_NewOrderSingle))
+
+        assert request.symbol
+        prototype.setField(fix.Symbol(request.symbol))
+
+        assert request.side
+        prototype.setField(fix.Side(request.side))
+
+        assert request.order_type
+        prototype.setField(fix.OrdType(request.order_type))
+
+        assert request.time_in_force
+        prototype.setField(fix.TimeInForce(request.time_in_force))
+
+        if request.account:
+            prototype.setField(fix.Account(request.account))
+
+        if request.destination is not None:
+            prototype.setField(fix.ExecBroker(request.destination))
+
+        if request.exchange is not None:
+            prototype.setField(fix.ExDestination(request.exchange))
+
+        if request.custom_fields:
+            for key in request.custom_fields:
+                prototype.setField(key, request.custom_fields[key])
+
+        if request.trader_id:
+            prototype.setField(fix.SenderCompID(request.trader_id))
+        self.prototype = prototype
+
+    def get_fix_message(self, request):
+        # only ClOrdID, OrderQty, Price and TransactTime are set per order
+        message = fix.Message(self.prototype)
+        message.setField(fix.ClOrdID(request.id))
+        message.setField(fix.OrderQty(request.quantity))
+        if request.price is not None:
+            message.setField(fix.Price(request.price))
+        elif self.order_type == fix.OrdType_LIMIT:
+            raise Exception("Must specify price for LIMIT order")
+        message.setField(fix.TransactTime())
+        return message
+
+# End of OrderTemplate
+
+
 class MarketDataRequest(object):
-    id = None
-    symbols = []
+    DEFAULT_ENTRY_TYPES = (fix.MDEntryType_BID, fix.MDEntryType_OFFER, fix.MDEntryType_TRADE)
+    msg_type = fix.MsgType_MarketDataRequest
+    __slots__ = ("id", "symbols", "update_type", "subscription_type", "depth", "entry_types")
+
+    def __init__(self):
+        self.id = None
+        self.symbols = []
+        self.update_type = fix.MDUpdateType_FULL_REFRESH
+        self.subscription_type = fix.SubscriptionRequestType_SNAPSHOT_AND_UPDATES
+        self.depth = 0 # full book
+        self.entry_types = self.DEFAULT_ENTRY_TYPES
 
     def set_id(self, id):
         self.id = id
 
     def set_symbols(self, symbols):
-        self.symbols = symbols
+        self.symbols = [instruments.intern(symbol) for symbol in symbols]
+
+    def set_update_type(self, update_type):
+        # fix.MDUpdateType_FULL_REFRESH or fix.MDUpdateType_INCREMENTAL_REFRESH
+        self.update_type = update_type
+
+    def set_subscription_type(self, subscription_type):
+        # fix.SubscriptionRequestType_SNAPSHOT_AND_UPDATES, or fix.SubscriptionRequestType_DISABLE_PREVIOUS_SNAPSHOT
+        # with the id of the request to unsubscribe
+        self.subscription_type = subscription_type
+
+    def set_depth(self, depth):
+        # number of price levels per side, 0 for the full book, 1 for top of book
+        self.depth = depth
+
+    def set_entry_types(self, entry_types):
+        # fix.MDEntryType_BID, fix.MDEntryType_OFFER and/or fix.MDEntryType_TRADE
+        self.entry_types = tuple(entry_types)
 
     def get_fix_message(self):
         request = fix.Message()
@@ -258,16 +1515,16 @@ class MarketDataRequest(object):
         request.getHeader().setField(fix.MsgType(fix.MsgType_MarketDataRequest))
 
         request.setField(fix.MDReqID(self.id))
-        request.setField(fix.SubscriptionRequestType(fix.SubscriptionRequestType_SNAPSHOT_PLUS_UPDATES))
+        request.setField(fix.SubscriptionRequestType(self.subscription_type))
         request.setField(fix.SecurityType(fix.SecurityType_FOREIGN_EXCHANGE_CONTRACT))
-        request.setField(fix.MarketDepth(0)) # full book
-        request.setField(fix.MDUpdateType(fix.MDUpdateType_FULL_REFRESH)) # fix.MDUpdateType_INCREMENTAL_REFRESH
+        request.setField(fix.MarketDepth(self.depth))
+        request.setField(fix.MDUpdateType(self.update_type))
 
+        import quickfix44 as fixnn
         group = fixnn.MarketDataRequest().NoMDEntryTypes()
-        group.setField(fix.MDEntryType(fix.MDEntryType_BID))
-        group.setField(fix.MDEntryType(fix.MDEntryType_OFFER))
-        group.setField(fix.MDEntryType(fix.MDEntryType_TRADE))
-        request.addGroup(group)
+        for entry_type in self.entry_types:
+            group.setField(fix.MDEntryType(entry_type))
+            request.addGroup(group)
 
         request.setField(fix.NoRelatedSym(len(self.symbols)))
         group = fixnn.MarketDataRequest().NoRelatedSym()
@@ -278,114 +1535,70 @@ class MarketDataRequest(object):
         return request
 
     def __str__(self):
-        return "MarketDataRequest: ID=%s, Symbols=%s" % (self.id, self.symbols)
+        update_type = "INCREMENTAL" if self.update_type == fix.MDUpdateType_INCREMENTAL_REFRESH else "FULL"
+        if self.subscription_type == fix.SubscriptionRequestType_DISABLE_PREVIOUS_SNAPSHOT:
+            return "MarketDataRequest: ID=%s, Symbols=%s, Unsubscribe" % (self.id, self.symbols)
+        return "MarketDataRequest: ID=%s, Symbols=%s, UpdateType=%s, Depth=%s, EntryTypes=%s" % \
+               (self.id, self.symbols, update_type, self.depth, "".join(self.entry_types))
 
 # End of MarketDataRequest
 
 
-def print_message(msg):
-    msg_str = ''
-    msg_type = get_field_value(fix.MsgType(), msg.getHeader())
-    if msg_type == fix.MsgType_News:
-        msg_str = "MessageType=News, Sender="
-        msg_str += get_field_value(fix.SenderCompID(), msg.getHeader())
-        msg_str += ", HeadLine="
-        msg_str += get_field_value(fix.Headline(), msg)
-        msg_str += ", Text="
-        msg_str += get_field_value(fix.Text(), msg)
-    elif msg_type == fix.MsgType_MarketDataRequestReject:
-        print("REJECTED")
-    elif msg_type == fix.MsgType_MarketDataSnapshotFullRefresh:
-        print("SNAPSHOT")
-        print(get_field_value(fix.Symbol(), msg))
-        print(msg)
-        
-    else:
-        msg_str = "OrderID="
-        msg_str += get_field_value(fix.ClOrdID(), msg)
-        msg_str += ", MessageType="
-        msg_str += get_message_type(msg)
-        msg_str += ", OrderStatus=" #39
-        msg_str += get_order_status(msg)
-        msg_str += ", Sender="
-        msg_str += get_field_value(fix.SenderCompID(), msg.getHeader())
-        msg_str += ", Target="
-        msg_str += get_field_value(fix.TargetCompID(), msg.getHeader())
-        msg_str += ", OrderType=" #40 1-Market, 2-Limit
-        msg_str += get_order_type(msg)
-        msg_str += ", Side=" #54 1-Buy,2-Sell
-        msg_str += 'BUY' if get_field_value(fix.Side(), msg) == fix.Side_BUY else 'SELL'
-        msg_str += ", Quantity=" #38
-        msg_str += str(get_field_value(fix.OrderQty(), msg))
-        msg_str += ", Price="
-        msg_str += str(get_field_value(fix.Price(), msg))
-        msg_str += ", Symbol="
-        msg_str += get_field_value(fix.Symbol(), msg)
-        msg_str += ", ExecutionType=" #150
-        msg_str += get_exec_type(msg)
-        if msg.isSetField(fix.Text().getField()):
-            msg_str += ", Text="
-            msg_str += get_field_value(fix.Text(), msg)
-        msg_str += ", ExecutedQuantity=" #14
-        msg_str += str(get_field_value(fix.CumQty(), msg))
-
-    print(msg_str)
-
-
-def get_field_value(fobj, msg):
-    if msg.isSetField(fobj.getField()):
-        msg.getField(fobj)
-        return fobj.getValue()
-    else:
-        return "None"
-
-
-def get_message_type(msg) :
-    msg_type = get_field_value(fix.MsgType(), msg.getHeader())
-    if msg_type == fix.MsgType_ExecutionReport:
-        return "ExecutionReport"
-    elif msg_type == fix.MsgType_News:
-        return "News"
-    elif msg_type == fix.MsgType_NewOrderSingle:
-        return "NewOrderSingle"
-    else:
-        return msg_type
-
-
-def get_order_type(msg):
-    ord_type = get_field_value(fix.OrdType(), msg)
-    if ord_type == fix.OrdType_LIMIT:
-        return "LIMIT"
-    elif ord_type == fix.OrdType_MARKET:
-        return "MARKET"
-    else:
-        return ord_type
-
-
-def get_exec_type(msg):
-    rpt = get_field_value(fix.ExecType(), msg)
-    if rpt == fix.ExecType_NEW:
-        return "NEW"
-    elif rpt == fix.ExecType_REJECTED:
-        return "REJECTED"
-    elif rpt == fix.ExecType_TRADE:
-        return "FILLED"
-    elif rpt == fix.ExecType_CANCELED:
-        return "CANCELED"
-    else:
-        return rpt
-
-
-def get_order_status(msg):
-    status = get_field_value(fix.OrdStatus(), msg)
-    if status == fix.OrdStatus_NEW:
-        return "NEW"
-    elif status == fix.OrdStatus_FILLED:
-        return "FILLED"
-    elif status == fix.OrdStatus_REJECTED:
-        return "REJECTED"
-    elif status == fix.OrdStatus_CANCELED:
-        return "CANCELED"
-    else:
-        return status
+class OrderStatusRequest(object):
+    msg_type = fix.MsgType_OrderStatusRequest
+    __slots__ = ("id", "cl_ord_id", "symbol", "side")
+
+    def __init__(self):
+        self.id = None  # OrdStatusReqID
+        self.cl_ord_id = None
+        self.symbol = None
+        self.side = None
+
+    def set_id(self, id):
+        self.id = id
+
+    def set_order(self, order):
+        # order is an OrderState, the request refers to its last accepted ClOrdID
+        self.cl_ord_id = order.cl_ord_id
+        self.symbol = order.request.symbol
+        self.side = order.request.side
+
+    def get_fix_message(self):
+        request = fix.Message()
+        request.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+        request.getHeader().setField(fix.MsgType(fix.MsgType_OrderStatusRequest))
+        request.setField(fix.OrdStatusReqID(self.id))
+        request.setField(fix.ClOrdID(self.cl_ord_id))
+        request.setField(fix.Symbol(self.symbol))
+        request.setField(fix.Side(self.side))
+        return request
+
+    def __str__(self):
+        return "OrderStatusRequest: ID=%s, ClOrdID=%s, Symbol=%s" % (self.id, self.cl_ord_id, self.symbol)
+
+# End of OrderStatusRequest
+
+
+class OrderMassStatusRequest(object):
+    msg_type = fix.MsgType_OrderMassStatusRequest
+    __slots__ = ("id", "mass_status_type")
+
+    def __init__(self):
+        self.id = None  # MassStatusReqID
+        self.mass_status_type = fix.MassStatusReqType_STATUS_FOR_ALL_ORDERS
+
+    def set_id(self, id):
+        self.id = id
+
+    def get_fix_message(self):
+        request = fix.Message()
+        request.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+        request.getHeader().setField(fix.MsgType(fix.MsgType_OrderMassStatusRequest))
+        request.setField(fix.MassStatusReqID(self.id))
+        request.setField(fix.MassStatusReqType(self.mass_status_type))
+        return request
+
+    def __str__(self):
+        return "OrderMassStatusRequest: ID=%s, Type=%s" % (self.id, self.mass_status_type)
 
+# End of OrderMassStatusRequest
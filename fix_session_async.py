@@ -0,0 +1,204 @@
+#####################################################################################
+# asyncio facade over FixSession: QuickFIX callbacks run on QuickFIX threads and are
+# handed to the event loop with loop.call_soon_threadsafe, so strategies await logons,
+# acks and fills and iterate execution reports and market data without blocking threads.
+#####################################################################################
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fix_session import FixSession
+from fix_throttle import OrderScheduler
+from fix_order_book import BookSnapshot
+
+
+class AsyncSubscription(object):
+    # Async iterator over items pushed from the event loop thread, ends once closed.
+    # With conflate only the latest undelivered item is kept, so slow consumers skip stale market data
+
+    def __init__(self, subscribers, key, conflate=False):
+        self.subscribers = subscribers  # {key: [AsyncSubscription]} the subscription is registered in
+        self.key = key
+        self.items = deque(maxlen=1 if conflate else None)
+        self.waiter = None
+        self.closed = False
+        subscribers.setdefault(key, []).append(self)
+
+    def push(self, item):
+        self.items.append(item)
+        self.wake_up()
+
+    def wake_up(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            subscriptions = self.subscribers.get(self.key)
+            if subscriptions is not None and self in subscriptions:
+                subscriptions.remove(self)
+                if not subscriptions:
+                    del self.subscribers[self.key]
+            self.wake_up()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.items:
+            if self.closed:
+                raise StopAsyncIteration
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        return self.items.popleft()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# End of AsyncSubscription
+
+
+class AsyncFixSession(object):
+    # Wraps a FixSession (or FixSessionPool) that is not started yet, all methods must be called from one event loop
+
+    def __init__(self, session):
+        if not isinstance(session, FixSession):
+            session = FixSession(session) # config file name
+        self.session = session
+        self.loop = None
+        self.status_changed = None
+        self.execution_report_subscribers = {}  # symbol or None for all symbols -> [AsyncSubscription]
+        self.market_data_subscribers = {}       # symbol -> [AsyncSubscription]
+        self.submit_executor = None  # one thread, so orders waiting for the throttle queue are still sent in order
+        # listeners set before still get their callbacks
+        self.execution_report_listener = session.application.execution_report_listener
+        self.book_listener = session.books.listener
+        session.application.setExecutionReportListener(self.on_execution_report)
+        session.application.setStatusListener(self.on_status_changed)
+        session.books.listener = self.on_book_updated
+
+    async def start(self, timeout=None):
+        # returns as soon as the session is logged in, result is the time in seconds it took to log in
+        self.loop = asyncio.get_running_loop()
+        self.status_changed = asyncio.Event()
+        start_time = self.loop.time()
+        self.session.start_initiator()
+        try:
+            while True:
+                status = self.session.get_login_status()
+                if status:
+                    return self.loop.time() - start_time
+                if status is False:
+                    raise Exception("Login failed")
+                remaining = timeout - (self.loop.time() - start_time) if timeout is not None else None
+                try:
+                    await asyncio.wait_for(self.status_changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    raise Exception("Login timed out after %s seconds" % timeout)
+                self.status_changed.clear()
+        except:
+            await self.loop.run_in_executor(None, self.session.initiator.stop)
+            raise
+
+    async def stop(self):
+        # QuickFIX joins its threads on stop, so it runs in the default executor. Open iterators end
+        await self.loop.run_in_executor(None, self.session.stop)
+        if self.submit_executor is not None:
+            self.submit_executor.shutdown(wait=False)
+            self.submit_executor = None
+        for subscribers in (self.execution_report_subscribers, self.market_data_subscribers):
+            for subscriptions in list(subscribers.values()):
+                for subscription in list(subscriptions):
+                    subscription.close()
+
+    async def call_submit(self, submit, *args):
+        # A throttle with POLICY_QUEUE blocks submit while its queue is full, so then it runs on the submit thread
+        throttle = self.session.throttle
+        if throttle is None or throttle.policy != OrderScheduler.POLICY_QUEUE:
+            return submit(*args)
+        if self.submit_executor is None:
+            self.submit_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AsyncFixSubmit")
+        return await self.loop.run_in_executor(self.submit_executor, submit, *args)
+
+    async def submit(self, request):
+        # OrderState of order requests once acknowledged, filled or rejected, None for other requests
+        future = await self.call_submit(self.session.submit, request)
+        return await asyncio.wrap_future(future) if future is not None else None
+
+    async def submit_buy_order(self, destination, symbol, quantity, price=None, account=None, custom_fields=None):
+        return await asyncio.wrap_future(await self.call_submit(self.session.submit_buy_order, destination, symbol, quantity, price,
+                                                                account, custom_fields))
+
+    async def submit_sell_order(self, destination, symbol, quantity, price=None, account=None, custom_fields=None):
+        return await asyncio.wrap_future(await self.call_submit(self.session.submit_sell_order, destination, symbol, quantity, price,
+                                                                account, custom_fields))
+
+    async def submit_order(self, destination, side, symbol, quantity, price=None, account=None, custom_fields=None):
+        return await asyncio.wrap_future(await self.call_submit(self.session.submit_order, destination, side, symbol, quantity, price,
+                                                                account, custom_fields))
+
+    async def cancel_order(self, id):
+        # OrderAmend once the cancel is answered
+        return await asyncio.wrap_future(self.session.cancel_order(id))
+
+    async def replace_order(self, id, quantity=None, price=None):
+        # OrderAmend once the replace (or the replace it was coalesced into) is answered
+        return await asyncio.wrap_future(self.session.replace_order(id, quantity, price))
+
+    async def wait_completed(self, order):
+        # order is an OrderState, returns it once the order is filled, canceled, rejected or expired
+        return await asyncio.wrap_future(order.completed)
+
+    def execution_reports(self, symbol=None):
+        # async iterator over ExecutionReportEvent of all orders or of one symbol, use with "async with" or close() it
+        return AsyncSubscription(self.execution_report_subscribers, symbol)
+
+    def market_data(self, symbol, conflate=True):
+        # async iterator over top of book BookSnapshot of one symbol. Subscribe with submit(MarketDataRequest) to get updates
+        return AsyncSubscription(self.market_data_subscribers, symbol, conflate)
+
+    def call_soon(self, callback, *args):
+        # from QuickFIX threads, updates after the loop is closed are dropped
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(callback, *args)
+            except RuntimeError:
+                pass
+
+    def on_status_changed(self, session_id, logged_in):
+        if self.status_changed is not None:
+            self.call_soon(self.status_changed.set)
+
+    def on_execution_report(self, event):
+        if self.execution_report_listener is not None:
+            self.execution_report_listener(event)
+        if self.execution_report_subscribers:
+            self.call_soon(self.dispatch_execution_report, event)
+
+    def dispatch_execution_report(self, event):
+        subscribers = self.execution_report_subscribers
+        for subscription in subscribers.get(None, ()):
+            subscription.push(event)
+        if event.symbol is not None:
+            for subscription in subscribers.get(event.symbol, ()):
+                subscription.push(event)
+
+    def on_book_updated(self, book):
+        if self.book_listener is not None:
+            self.book_listener(book)
+        if book.symbol in self.market_data_subscribers:
+            self.call_soon(self.dispatch_market_data, BookSnapshot(book))
+
+    def dispatch_market_data(self, update):
+        for subscription in self.market_data_subscribers.get(update.symbol, ()):
+            subscription.push(update)
+
+# End of AsyncFixSession
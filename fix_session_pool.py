@@ -0,0 +1,68 @@
+#####################################################################################
+# Pool of FIX sessions started from one config file with several [SESSION] sections.
+# Order flow is spread across the sessions to stay under per-session gateway throttles,
+# execution reports of all sessions come back through one listener.
+#####################################################################################
+
+import time
+import zlib
+from fix_session import FixSession
+
+
+class FixSessionPool(FixSession):
+    ROUTING_ROUND_ROBIN = "round-robin"
+    ROUTING_SYMBOL_HASH = "symbol-hash"                  # all orders of one symbol go to the same session
+    ROUTING_LEAST_OUTSTANDING = "least-outstanding"      # session with the fewest open orders
+
+    def __init__(self, config_file, routing=ROUTING_ROUND_ROBIN, listener=None):
+        # listener is called with an ExecutionReportEvent for every execution report of every session
+        if routing not in (self.ROUTING_ROUND_ROBIN, self.ROUTING_SYMBOL_HASH, self.ROUTING_LEAST_OUTSTANDING):
+            raise Exception("Unknown routing: %s" % routing)
+        super().__init__(config_file)
+        self.routing = routing
+        self.next_session = 0
+        self.session_names = sorted(session_id.toString() for session_id in self.settings.getSessions())
+        if listener is not None:
+            self.application.setExecutionReportListener(listener)
+
+    def start(self, timeout=None):
+        # returns as soon as all sessions are logged in, result is the time in seconds it took to log in
+        start_time = time.perf_counter()
+        self.start_initiator()
+
+        # wait for all sessions to login
+        while len(self.application.sessions) < len(self.session_names):
+            if self.application.logged_out:
+                self.initiator.stop()
+                raise Exception("Login failed")
+            remaining = timeout - (time.perf_counter() - start_time) if timeout is not None else None
+            if remaining is not None and remaining <= 0 or not self.application.status_changed.wait(remaining):
+                self.initiator.stop()
+                raise Exception("Login timed out after %s seconds, logged in sessions: %s" % (timeout, sorted(self.application.sessions)))
+            self.application.status_changed.clear()
+
+        return time.perf_counter() - start_time
+
+    def get_login_status(self):
+        # True once all sessions are logged in, False if a login failed, None while logging in
+        if len(self.application.sessions) == len(self.session_names):
+            return True
+        return False if self.application.logged_out else None
+
+    def get_session_id(self, request):
+        sessions = self.application.sessions
+        available = [name for name in self.session_names if name in sessions]
+        if not available:
+            raise Exception("No session is logged in")
+
+        symbol = getattr(request, "symbol", None)
+        if self.routing == self.ROUTING_SYMBOL_HASH and symbol is not None:
+            name = available[zlib.crc32(symbol.encode()) % len(available)]
+        elif self.routing == self.ROUTING_LEAST_OUTSTANDING:
+            name = min(available, key=self.orders.get_open_count)
+        else:
+            name = available[self.next_session % len(available)]
+            self.next_session += 1
+        return sessions[name]
+
+# End of FixSessionPool
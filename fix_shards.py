@@ -0,0 +1,586 @@
+#####################################################################################
+# Sharded client: one gateway process owns the FixSession (and its QuickFIX SocketInitiator),
+# strategy worker processes submit orders and receive execution reports and top of book
+# updates through single producer, single consumer rings of fixed-size records in
+# multiprocessing.shared_memory. Strategy logic runs outside the GIL of the gateway process
+# and nothing is pickled on the hot path, only the strategy and the ring names at worker start.
+#####################################################################################
+
+import time
+import struct
+import threading
+from collections import deque
+from multiprocessing import get_context
+from multiprocessing import shared_memory
+from fix_decoder import SOH
+from fix_decoder import SIDE_BUY
+
+COUNTER = struct.Struct("<Q")
+LAYOUT = struct.Struct("<II")  # record size, capacity
+HEAD_OFFSET = 0       # records written, only written by the producer
+TAIL_OFFSET = 64      # records read, only written by the consumer, on its own cache line
+STATE_OFFSET = 128    # state byte of the processes using the ring
+LAYOUT_OFFSET = 192
+DATA_OFFSET = 256
+
+# worker states, kept in the state byte of the event ring of the worker
+STATE_STARTING = 0
+STATE_READY = 1       # the worker attached its rings and waits for the gateway
+STATE_RUNNING = 2     # the gateway started all workers
+STATE_STOPPING = 3    # the gateway asks the worker to finish, see ShardWorker.is_stopping()
+
+ACTION_NEW = b'N'
+ACTION_CANCEL = b'C'
+ACTION_REPLACE = b'R'
+ACTION_SUBSCRIBE = b'S'
+ACTION_UNSUBSCRIBE = b'U'
+
+# worker -> gateway: action, order reference of the worker, side, symbol, account, destination,
+# custom fields (tag=value separated by SOH), quantity, price. NaN is None
+ORDER = struct.Struct("<1sQ1s32s32s32s64sdd")
+ORDER_FIELD_SIZES = (("Side", 1), ("Symbol", 32), ("Account", 32), ("Destination", 32), ("Custom fields", 64))
+
+KIND_EXECUTION = b'E'
+KIND_BOOK = b'M'
+# gateway -> worker, kind first. Execution report or cancel reject: kind, order reference, MsgType, ExecType, OrdStatus, symbol,
+# OrderID, ExecID, quantity, price, last qty, last price, cum qty, leaves qty, avg price, text
+EXECUTION = struct.Struct("<1sQ1s1s1s32s32s32sddddddd64s")
+# top of book: kind, symbol, bid, bid size, ask, ask size, last trade price, last trade size, update time
+BOOK = struct.Struct("<1s32sddddddd")
+EVENT_SIZE = max(EXECUTION.size, BOOK.size)
+
+TERMINAL_STATUSES = ('2', '4', '8', 'C')  # FILLED, CANCELED, REJECTED, EXPIRED as OrderState.TERMINAL_STATUSES
+SIDES = {SIDE_BUY: SIDE_BUY, '2': '2', "BUY": SIDE_BUY, "SELL": '2'}  # side argument -> FIX Side
+NAN = float("nan")
+
+
+def to_bytes(value):
+    return value.encode() if value is not None else b""
+
+
+def to_field(value, size, name):
+    # value encoded for a fixed-width struct field, longer values are not cut but rejected
+    value = to_bytes(value)
+    if len(value) > size:
+        raise ValueError("%s %s is longer than %s bytes" % (name, value.decode(errors="replace"), size))
+    return value
+
+
+def to_str(value):
+    value = value.rstrip(b"\0")
+    return value.decode() if value else None
+
+
+def to_float(value):
+    return value if value == value else None  # NaN is None
+
+
+def nan_if_none(value):
+    return NAN if value is None else value
+
+
+def wait_idle(idle_count):
+    # back-off of polling loops: gives up the CPU for the first idle polls, then sleeps up to 1 ms
+    if idle_count < 50:
+        time.sleep(0)
+    else:
+        time.sleep(min(idle_count - 49, 20) * 0.00005)
+
+
+class RecordRing(object):
+    # Single producer, single consumer ring of fixed-size records in shared memory. The producer only writes the head
+    # (after the record) and the consumer only the tail, each side caches the counter of the other one and reads it
+    # again only when the ring looks full or empty. Not thread safe, one thread per side
+
+    def __init__(self, record_size=0, capacity=4096, name=None):
+        # creates a ring of capacity records (rounded up to a power of two), or attaches to the ring called name
+        if name is None:
+            capacity = 1 << (max(capacity, 2) - 1).bit_length()
+            self.memory = shared_memory.SharedMemory(create=True, size=DATA_OFFSET + record_size * capacity)
+            LAYOUT.pack_into(self.memory.buf, LAYOUT_OFFSET, record_size, capacity)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            record_size, capacity = LAYOUT.unpack_from(self.memory.buf, LAYOUT_OFFSET)
+        self.created = name is None  # the creator unlinks the ring on close
+        self.name = self.memory.name
+        self.buffer = self.memory.buf
+        self.record_size = record_size
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.head = COUNTER.unpack_from(self.buffer, HEAD_OFFSET)[0]
+        self.tail = COUNTER.unpack_from(self.buffer, TAIL_OFFSET)[0]
+        self.head_cache = self.head  # consumer copy of the head
+        self.tail_cache = self.tail  # producer copy of the tail
+
+    def put(self, record, *values):
+        # producer: writes values packed with the struct record, False if the ring is full
+        head = self.head
+        if head - self.tail_cache >= self.capacity:
+            self.tail_cache = COUNTER.unpack_from(self.buffer, TAIL_OFFSET)[0]
+            if head - self.tail_cache >= self.capacity:
+                return False
+        record.pack_into(self.buffer, DATA_OFFSET + (head & self.mask) * self.record_size, *values)
+        self.head = head + 1
+        COUNTER.pack_into(self.buffer, HEAD_OFFSET, self.head)
+        return True
+
+    def read(self, max_count=256):
+        # consumer: offsets in buffer of up to max_count records, they are not overwritten before release()
+        tail = self.tail
+        available = self.head_cache - tail
+        if available <= 0:
+            self.head_cache = COUNTER.unpack_from(self.buffer, HEAD_OFFSET)[0]
+            available = self.head_cache - tail
+        mask = self.mask
+        record_size = self.record_size
+        return [DATA_OFFSET + ((tail + i) & mask) * record_size for i in range(min(available, max_count))]
+
+    def release(self, count):
+        # consumer: the first count records returned by read() are processed
+        self.tail += count
+        COUNTER.pack_into(self.buffer, TAIL_OFFSET, self.tail)
+
+    def get_size(self):
+        return COUNTER.unpack_from(self.buffer, HEAD_OFFSET)[0] - COUNTER.unpack_from(self.buffer, TAIL_OFFSET)[0]
+
+    def get_state(self):
+        return self.buffer[STATE_OFFSET]
+
+    def set_state(self, state):
+        self.buffer[STATE_OFFSET] = state
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        if self.created:
+            self.memory.unlink()
+
+    def __str__(self):
+        return "RecordRing: Name=%s, Capacity=%s, RecordSize=%s, Size=%s" % (self.name, self.capacity, self.record_size, self.get_size())
+
+# End of RecordRing
+
+
+class ShardExecution(object):
+    # execution report (MsgType 8) or cancel reject (MsgType 9) of an order of the worker. Orders the gateway
+    # could not send get an ExecType REJECTED report with MsgType None and the error in text,
+    # cancels and replaces it could not send a MsgType 9 report
+    __slots__ = ("ref", "msg_type", "exec_type", "order_status", "symbol", "order_id", "exec_id", "quantity", "price",
+                 "last_qty", "last_price", "cum_qty", "leaves_qty", "avg_price", "text")
+
+    def __init__(self, values):
+        (kind, self.ref, msg_type, exec_type, order_status, symbol, order_id, exec_id, quantity, price,
+         last_qty, last_price, cum_qty, leaves_qty, avg_price, text) = values
+        self.msg_type = to_str(msg_type)
+        self.exec_type = to_str(exec_type)
+        self.order_status = to_str(order_status)
+        self.symbol = to_str(symbol)
+        self.order_id = to_str(order_id)
+        self.exec_id = to_str(exec_id)
+        self.quantity = to_float(quantity)
+        self.price = to_float(price)
+        self.last_qty = to_float(last_qty)
+        self.last_price = to_float(last_price)
+        self.cum_qty = to_float(cum_qty)
+        self.leaves_qty = to_float(leaves_qty)
+        self.avg_price = to_float(avg_price)
+        self.text = to_str(text)
+
+    def is_done(self):
+        return self.msg_type != '9' and self.order_status in TERMINAL_STATUSES
+
+    def __str__(self):
+        return "ShardExecution: Ref=%s, MsgType=%s, ExecType=%s, OrdStatus=%s, Symbol=%s, CumQty=%s, LeavesQty=%s, AvgPrice=%s, Text=%s" % \
+               (self.ref, self.msg_type, self.exec_type, self.order_status, self.symbol, self.cum_qty, self.leaves_qty, self.avg_price, self.text)
+
+# End of ShardExecution
+
+
+class ShardBook(object):
+    # top of book of a subscribed symbol after a market data message
+    __slots__ = ("symbol", "bid", "bid_size", "ask", "ask_size", "last_trade_price", "last_trade_size", "update_time")
+
+    def __init__(self, values):
+        kind, symbol, bid, bid_size, ask, ask_size, last_trade_price, last_trade_size, self.update_time = values
+        self.symbol = to_str(symbol)
+        self.bid = to_float(bid)
+        self.bid_size = to_float(bid_size)
+        self.ask = to_float(ask)
+        self.ask_size = to_float(ask_size)
+        self.last_trade_price = to_float(last_trade_price)
+        self.last_trade_size = to_float(last_trade_size)
+
+    def __str__(self):
+        return "ShardBook: Symbol=%s, Bid=%s, BidSize=%s, Ask=%s, AskSize=%s, LastTrade=%s@%s" % \
+               (self.symbol, self.bid, self.bid_size, self.ask, self.ask_size, self.last_trade_size, self.last_trade_price)
+
+# End of ShardBook
+
+
+class ShardWorker(object):
+    # Strategy side of a worker process. Orders are referenced by the integer returned from submit_order,
+    # execution reports and top of book updates come back from poll(). Not thread safe
+
+    def __init__(self, index, order_ring_name, event_ring_name, timeout=60.0):
+        self.index = index
+        self.orders = RecordRing(name=order_ring_name)
+        self.events = RecordRing(name=event_ring_name)
+        self.next_ref = 0
+        self.pending = deque()  # events read while waiting for space in the order ring
+        self.events.set_state(STATE_READY)
+        deadline = time.perf_counter() + timeout
+        idle_count = 0
+        while self.events.get_state() == STATE_READY:
+            if time.perf_counter() > deadline:
+                raise Exception("Gateway did not start worker %s within %s seconds" % (index, timeout))
+            wait_idle(idle_count)
+            idle_count += 1
+
+    def submit_buy_order(self, destination, symbol, quantity, price=None, account=None, custom_fields=None):
+        return self.submit_order(destination, SIDE_BUY, symbol, quantity, price, account, custom_fields)
+
+    def submit_sell_order(self, destination, symbol, quantity, price=None, account=None, custom_fields=None):
+        return self.submit_order(destination, '2', symbol, quantity, price, account, custom_fields)
+
+    def submit_order(self, destination, side, symbol, quantity, price=None, account=None, custom_fields=None):
+        # returns the order reference of ShardExecution.ref, a LIMIT order with a price, a MARKET order without.
+        # side is "BUY", "SELL" or the FIX Side value '1' or '2'
+        fix_side = SIDES.get(side.upper() if isinstance(side, str) else side)
+        if fix_side is None:
+            raise ValueError("Invalid side %s" % side)
+        custom = SOH.join("%s=%s" % (tag, value) for tag, value in custom_fields.items()) if custom_fields else None
+        self.send(ACTION_NEW, self.next_ref + 1, fix_side, symbol, account, destination, custom, quantity, price)
+        self.next_ref += 1
+        return self.next_ref
+
+    def cancel_order(self, ref):
+        self.send(ACTION_CANCEL, ref)
+
+    def replace_order(self, ref, quantity=None, price=None):
+        if quantity is None and price is None:
+            raise Exception("Must specify quantity or price to replace")
+        self.send(ACTION_REPLACE, ref, quantity=quantity, price=price)
+
+    def subscribe_market_data(self, symbols):
+        # top of book updates of symbols, the gateway subscribes a symbol with the venue for its first subscriber
+        # and unsubscribes it after the last one, see ShardedGateway
+        for symbol in symbols:
+            self.send(ACTION_SUBSCRIBE, 0, symbol=symbol)
+
+    def unsubscribe_market_data(self, symbols):
+        for symbol in symbols:
+            self.send(ACTION_UNSUBSCRIBE, 0, symbol=symbol)
+
+    def send(self, action, ref, side=None, symbol=None, account=None, destination=None, custom=None, quantity=None, price=None):
+        # raises ValueError before anything is sent if a text field does not fit its slot of the record
+        texts = tuple(to_field(value, size, name) for value, (name, size) in zip((side, symbol, account, destination, custom), ORDER_FIELD_SIZES))
+        values = (action, ref) + texts + (nan_if_none(quantity), nan_if_none(price))
+        idle_count = 0
+        while not self.orders.put(ORDER, *values):
+            # the gateway is behind: keep draining its events meanwhile, it may be waiting for space in the event ring
+            self.pending.extend(self.read_events(self.events.capacity))
+            wait_idle(idle_count)
+            idle_count += 1
+
+    def poll(self, timeout=None, max_count=256):
+        # ShardExecution and ShardBook events received since the last poll in order, waits up to timeout
+        # seconds (None forever, 0 not at all) for the first one. Returns no events once the gateway is stopping
+        if self.pending:
+            events = list(self.pending)
+            self.pending.clear()
+            return events
+        deadline = time.perf_counter() + timeout if timeout else None
+        idle_count = 0
+        while True:
+            events = self.read_events(max_count)
+            if events or timeout == 0 or self.is_stopping():
+                return events
+            if deadline is not None and time.perf_counter() > deadline:
+                return events
+            wait_idle(idle_count)
+            idle_count += 1
+
+    def read_events(self, max_count):
+        ring = self.events
+        offsets = ring.read(max_count)
+        if not offsets:
+            return []
+        buffer = ring.buffer
+        execution = KIND_EXECUTION[0]
+        events = [ShardExecution(EXECUTION.unpack_from(buffer, offset)) if buffer[offset] == execution else
+                  ShardBook(BOOK.unpack_from(buffer, offset)) for offset in offsets]
+        ring.release(len(offsets))
+        return events
+
+    def is_stopping(self):
+        return self.events.get_state() == STATE_STOPPING
+
+    def close(self):
+        self.orders.close()
+        self.events.close()
+
+    def __str__(self):
+        return "ShardWorker: Index=%s, Orders=%s, PendingEvents=%s" % (self.index, self.next_ref, len(self.pending) + self.events.get_size())
+
+# End of ShardWorker
+
+
+def run_worker(strategy, index, order_ring_name, event_ring_name, args):
+    # entry point of worker processes
+    worker = ShardWorker(index, order_ring_name, event_ring_name)
+    try:
+        strategy(worker, *args)
+    finally:
+        worker.close()
+
+
+class ShardOrder(object):
+    __slots__ = ("worker", "ref", "ids")
+
+    def __init__(self, worker, ref, id):
+        self.worker = worker  # index of the worker that submitted the order
+        self.ref = ref        # order reference in that worker
+        self.ids = [id]       # ClOrdID of the order, then of its cancels and replaces
+
+# End of ShardOrder
+
+
+class ShardedGateway(object):
+    # Gateway side: runs worker_count processes of strategy(worker, *args) with a ShardWorker each and submits their orders
+    # through session, a logged in FixSession (or FixSessionPool) of this process, so its risk checks, throttle and journal apply.
+    # Execution reports go to the worker that submitted the order, top of book updates of session.books to the workers subscribed
+    # to the symbol. Workers are spawned, not forked, so strategy must be a module level function and the main module of this
+    # process is imported again by every worker: keep its start up code under if __name__ == '__main__'
+
+    def __init__(self, session, strategy, worker_count, args=(), capacity=4096, subscriptions=None):
+        # capacity is the number of records of every ring, a worker with a full order ring waits for the gateway,
+        # the gateway waits for a worker with a full event ring for execution reports but drops top of book updates.
+        # subscriptions is the MarketDataSubscriptionManager of session, one is created on the first worker subscription if None.
+        # Symbols it already has are left alone, the others are subscribed for the first worker and unsubscribed after the last
+        self.session = session
+        self.subscriptions = subscriptions
+        self.subscribed = set()       # symbols subscribed with the venue for the workers
+        self.strategy = strategy
+        self.args = args
+        self.lock = threading.Lock()  # held while an order is submitted, so that its reports wait until its owner is known
+        self.owners = {}              # ClOrdID -> ShardOrder of open orders
+        self.worker_orders = {}       # (worker index, order reference) -> ShardOrder of open orders
+        self.subscribers = {}         # symbol -> tuple of indexes of the workers with top of book updates
+        self.order_rings = [RecordRing(ORDER.size, capacity) for i in range(worker_count)]
+        self.event_rings = [RecordRing(EVENT_SIZE, capacity) for i in range(worker_count)]
+        self.event_locks = [threading.Lock() for i in range(worker_count)] # reports and book updates come from several threads
+        self.processes = []
+        self.submitted_count = 0
+        self.rejected_count = 0       # orders, cancels and replaces that could not be sent
+        self.event_count = 0
+        self.dropped_count = 0        # events dropped on full event rings
+        self.unknown_count = 0        # execution reports of orders not submitted by workers
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="ShardedGateway", daemon=True)
+        self.report_listener = session.application.execution_report_listener # still gets every report
+        self.book_listener = session.books.listener
+        session.application.setExecutionReportListener(self.on_execution_report)
+        session.books.listener = self.on_book_updated
+
+    def start(self, timeout=60.0):
+        # starts the workers and returns once all of them run strategy, result is the time in seconds it took
+        start_time = time.perf_counter()
+        context = get_context("spawn")  # forking a process with QuickFIX threads is not safe
+        for index in range(len(self.order_rings)):
+            process = context.Process(target=run_worker, name="ShardWorker-%s" % index, daemon=True,
+                                      args=(self.strategy, index, self.order_rings[index].name, self.event_rings[index].name, self.args))
+            process.start()
+            self.processes.append(process)
+        idle_count = 0
+        while any(ring.get_state() != STATE_READY for ring in self.event_rings):
+            if time.perf_counter() - start_time > timeout or not all(process.is_alive() for process in self.processes):
+                self.stop(0)
+                raise Exception("Workers failed to start within %s seconds" % timeout)
+            wait_idle(idle_count)
+            idle_count += 1
+        self.thread.start()
+        for ring in self.event_rings:
+            ring.set_state(STATE_RUNNING)
+        return time.perf_counter() - start_time
+
+    def join(self, timeout=None):
+        # waits for the strategies to return, result is the list of worker exit codes (None for workers still running)
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        for process in self.processes:
+            process.join(max(0, deadline - time.perf_counter()) if deadline is not None else None)
+        return [process.exitcode for process in self.processes]
+
+    def stop(self, timeout=10.0):
+        # asks the workers to finish (ShardWorker.is_stopping), still forwards their orders for timeout seconds,
+        # then terminates the remaining workers and releases the rings
+        for ring in self.event_rings:
+            ring.set_state(STATE_STOPPING)
+        self.join(timeout)
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.session.application.setExecutionReportListener(self.report_listener)
+        self.session.books.listener = self.book_listener
+        if self.subscribed:
+            self.subscriptions.unsubscribe(list(self.subscribed))
+            self.subscribed.clear()
+        for ring in self.order_rings + self.event_rings:
+            ring.close()
+
+    def run(self):
+        # forwards the orders of all workers, one batch per worker and round
+        rings = list(enumerate(self.order_rings))
+        idle_count = 0
+        while not self.stopped.is_set():
+            count = 0
+            for worker, ring in rings:
+                offsets = ring.read()
+                if offsets:
+                    buffer = ring.buffer
+                    for offset in offsets:
+                        self.on_order(worker, ORDER.unpack_from(buffer, offset))
+                    ring.release(len(offsets))
+                    count += len(offsets)
+            if count:
+                idle_count = 0
+            else:
+                wait_idle(idle_count)
+                idle_count += 1
+
+    def on_order(self, worker, values):
+        action, ref, side, symbol, account, destination, custom, quantity, price = values
+        try:
+            if action == ACTION_NEW:
+                self.submit(worker, ref, to_str(side), to_str(symbol), to_str(account), to_str(destination), to_str(custom),
+                            quantity, to_float(price))
+            elif action == ACTION_CANCEL:
+                self.session.cancel_order(self.get_order_id(worker, ref))
+            elif action == ACTION_REPLACE:
+                self.session.replace_order(self.get_order_id(worker, ref), to_float(quantity), to_float(price))
+            elif action == ACTION_SUBSCRIBE:
+                self.subscribe(worker, to_str(symbol))
+            elif action == ACTION_UNSUBSCRIBE:
+                self.unsubscribe(worker, to_str(symbol))
+        except Exception as e:
+            # the worker learns about orders that were not sent from a reject in its event ring
+            self.rejected_count += 1
+            if action == ACTION_NEW:
+                self.send_event(worker, EXECUTION, (KIND_EXECUTION, ref, b"", b"8", b"8", symbol, b"", b"", quantity, price,
+                                                    NAN, NAN, 0.0, 0.0, NAN, to_bytes(str(e) or repr(e))))
+            elif action in (ACTION_CANCEL, ACTION_REPLACE):
+                self.send_event(worker, EXECUTION, (KIND_EXECUTION, ref, b"9", b"", b"", b"", b"", b"", quantity, price,
+                                                    NAN, NAN, NAN, NAN, NAN, to_bytes(str(e) or repr(e))))
+
+    def submit(self, worker, ref, side, symbol, account, destination, custom, quantity, price):
+        from fix_session import OrderRequest
+        request = OrderRequest()
+        request.set_symbol(symbol)
+        request.set_destination(destination)
+        request.set_side(side)
+        request.set_quantity(quantity)
+        if price is not None:
+            request.set_price(price)
+            request.set_order_type('2')  # LIMIT
+        else:
+            request.set_order_type('1')  # MARKET
+        if account:
+            request.set_account(account)
+        if custom:
+            request.set_custom_fields(dict((int(tag), value) for tag, value in (field.split('=', 1) for field in custom.split(SOH))))
+        with self.lock:
+            self.session.submit(request)
+            order = ShardOrder(worker, ref, request.id)
+            self.owners[request.id] = order
+            self.worker_orders[(worker, ref)] = order
+        self.submitted_count += 1
+
+    def subscribe(self, worker, symbol):
+        workers = self.subscribers.get(symbol, ())
+        if worker in workers:
+            return
+        if not workers:
+            if self.subscriptions is None:
+                from fix_subscriptions import MarketDataSubscriptionManager
+                self.subscriptions = MarketDataSubscriptionManager(self.session)
+            if symbol not in self.subscriptions.subscriptions:
+                self.subscriptions.subscribe([symbol])
+                self.subscribed.add(symbol)
+        self.subscribers[symbol] = tuple(sorted(workers + (worker,)))
+
+    def unsubscribe(self, worker, symbol):
+        workers = tuple(index for index in self.subscribers.get(symbol, ()) if index != worker)
+        self.subscribers[symbol] = workers
+        if not workers and symbol in self.subscribed:
+            self.subscribed.discard(symbol)
+            self.subscriptions.unsubscribe([symbol])
+
+    def get_order_id(self, worker, ref):
+        # ClOrdID the order of the worker was submitted with
+        order = self.worker_orders.get((worker, ref))
+        if order is None:
+            raise Exception("Unknown or completed order: %s" % ref)
+        return order.ids[0]
+
+    def on_execution_report(self, event):
+        if self.report_listener is not None:
+            self.report_listener(event)
+        with self.lock:
+            order = self.owners.get(event.cl_ord_id)
+            if order is None:
+                # first report of a cancel or replace, it refers to the previous ClOrdID of the order
+                order = self.owners.get(event.orig_cl_ord_id)
+                if order is None:
+                    self.unknown_count += 1
+                    return
+                if event.cl_ord_id is not None:
+                    order.ids.append(event.cl_ord_id)
+                    self.owners[event.cl_ord_id] = order
+            if event.msg_type == '8' and event.order_status in TERMINAL_STATUSES:
+                for id in order.ids:
+                    self.owners.pop(id, None)
+                self.worker_orders.pop((order.worker, order.ref), None)
+        self.send_event(order.worker, EXECUTION, (KIND_EXECUTION, order.ref, to_bytes(event.msg_type), to_bytes(event.exec_type),
+                                                  to_bytes(event.order_status), to_bytes(event.symbol), to_bytes(event.order_id),
+                                                  to_bytes(event.exec_id), nan_if_none(event.quantity), nan_if_none(event.price),
+                                                  nan_if_none(event.last_qty), nan_if_none(event.last_price), nan_if_none(event.cum_qty),
+                                                  nan_if_none(event.leaves_qty), nan_if_none(event.avg_price), to_bytes(event.text)))
+
+    def on_book_updated(self, book):
+        # called with the books locked after every market data message
+        if self.book_listener is not None:
+            self.book_listener(book)
+        workers = self.subscribers.get(book.symbol)
+        if workers:
+            bid, bid_size, ask, ask_size = book.get_top_of_book()
+            values = (KIND_BOOK, to_bytes(book.symbol), nan_if_none(bid), nan_if_none(bid_size), nan_if_none(ask), nan_if_none(ask_size),
+                      nan_if_none(book.last_trade_price), nan_if_none(book.last_trade_size), book.update_time)
+            for worker in workers:
+                self.send_event(worker, BOOK, values, drop=True)
+
+    def send_event(self, worker, record, values, drop=False):
+        # waits for space in the event ring of the worker unless drop is set, events of stopped or dead workers are dropped
+        ring = self.event_rings[worker]
+        with self.event_locks[worker]:
+            idle_count = 0
+            while not ring.put(record, *values):
+                if drop or self.stopped.is_set() or not self.processes[worker].is_alive():
+                    self.dropped_count += 1
+                    return False
+                wait_idle(idle_count)
+                idle_count += 1
+            self.event_count += 1
+        return True
+
+    def get_open_count(self):
+        return len(self.worker_orders)
+
+    def __str__(self):
+        return "ShardedGateway: Workers=%s, Submitted=%s, Rejected=%s, Events=%s, Dropped=%s, Unknown=%s, OpenOrders=%s" % \
+               (len(self.order_rings), self.submitted_count, self.rejected_count, self.event_count, self.dropped_count,
+                self.unknown_count, self.get_open_count())
+
+# End of ShardedGateway
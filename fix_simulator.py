@@ -0,0 +1,430 @@
+#####################################################################################
+# Local stand-in for Deltix FIX Gateway to run and benchmark FIX clients offline.
+# Checks the Logon password, acknowledges NewOrderSingle and NewOrderList orders and fills
+# them when tag 8076 is "FILL" (rejects them when it is "REJECT"), handles cancel,
+# cancel/replace, order status and order mass status requests and publishes synthetic
+# market data at a configurable rate.
+# Usage: python3 fix_simulator.py fix-simulator.cfg [-r MARKET_DATA_RATE]
+#####################################################################################
+
+import sys
+import random
+import argparse
+import threading
+import quickfix as fix
+import quickfix44 as fixnn
+from fix_factories import load_settings
+
+SIMULATOR_INSTRUCTION_TAG = 8076
+
+
+class SimulatedOrder(object):
+    __slots__ = ("id", "order_id", "symbol", "side", "order_type", "quantity", "price", "cum_qty", "avg_price", "status")
+
+    def __init__(self, id, order_id, symbol, side, order_type, quantity, price):
+        self.id = id
+        self.order_id = order_id
+        self.symbol = symbol
+        self.side = side
+        self.order_type = order_type
+        self.quantity = quantity
+        self.price = price
+        self.cum_qty = 0.0
+        self.avg_price = 0.0
+        self.status = fix.OrdStatus_NEW
+
+# End of SimulatedOrder
+
+
+class SimulatedBook(object):
+    # Synthetic book around a random walk mid price
+
+    def __init__(self, symbol, depth, rnd):
+        self.symbol = symbol
+        self.depth = depth
+        self.rnd = rnd
+        self.mid = 100.0 + rnd.randint(0, 9900)
+        self.tick = 0.01 * max(1, int(self.mid / 100))
+        self.bids = {}
+        self.asks = {}
+        self.move()
+
+    def move(self):
+        # returns [(entry type, price, size)] of changed levels, size 0 for deleted levels
+        self.mid += self.rnd.choice((-1, 0, 1)) * self.tick
+        bids = dict((round(self.mid - (i + 1) * self.tick, 8), float(self.rnd.randint(1, 10))) for i in range(self.depth))
+        asks = dict((round(self.mid + (i + 1) * self.tick, 8), float(self.rnd.randint(1, 10))) for i in range(self.depth))
+        changes = []
+        for entry_type, old, new in ((fix.MDEntryType_BID, self.bids, bids), (fix.MDEntryType_OFFER, self.asks, asks)):
+            for price in old:
+                if price not in new:
+                    changes.append((entry_type, price, 0.0))
+            for price, size in new.items():
+                if old.get(price) != size:
+                    changes.append((entry_type, price, size))
+        self.bids = bids
+        self.asks = asks
+        return changes
+
+    def get_entries(self, depth=0):
+        # depth 0 returns all levels
+        bids = sorted(self.bids.items(), reverse=True)
+        asks = sorted(self.asks.items())
+        if depth > 0:
+            bids = bids[:depth]
+            asks = asks[:depth]
+        return [(fix.MDEntryType_BID, price, size) for price, size in bids] + \
+               [(fix.MDEntryType_OFFER, price, size) for price, size in asks]
+
+# End of SimulatedBook
+
+
+class SimulatorApplication(fix.Application):
+
+    def __init__(self, settings, market_data_rate=10.0, market_data_depth=10):
+        super().__init__()
+        self.market_data_rate = market_data_rate
+        self.market_data_depth = market_data_depth
+        self.passwords = {}
+        for session_id in settings.getSessions():
+            session_settings = settings.get(session_id)
+            if session_settings.has("ClientPassword"):
+                self.passwords[session_id.toString()] = session_settings.getString("ClientPassword")
+
+        self.lock = threading.Lock()
+        self.orders = {}         # (session id string, ClOrdID) -> SimulatedOrder
+        self.done_orders = {}    # (session id string, ClOrdID) -> filled, canceled or rejected SimulatedOrder, for status requests
+        self.subscriptions = {}  # (session id string, MDReqID) -> (SessionID, [SimulatedBook], incremental, depth, entry types)
+        self.books = {}
+        self.rnd = random.Random(1)
+        self.exec_id = 0
+        self.order_count = 0
+        self.stopped = threading.Event()
+        self.publisher = threading.Thread(target=self.run_publisher, name="MarketDataPublisher", daemon=True)
+        self.publisher.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.publisher.join()
+
+    def onCreate(self, session_id):
+        return
+
+    def onLogon(self, session_id):
+        print("Simulator session %s logged in" % session_id)
+        return
+
+    def onLogout(self, session_id):
+        print("Simulator session %s logged out" % session_id)
+        key = session_id.toString()
+        with self.lock:
+            for subscription in [subscription for subscription in self.subscriptions if subscription[0] == key]:
+                del self.subscriptions[subscription]
+        return
+
+    def toAdmin(self, message, session_id):
+        return
+
+    def fromAdmin(self, message, session_id):
+        if message.getHeader().getField(35) == fix.MsgType_Logon:
+            expected = self.passwords.get(session_id.toString())
+            # clients may put Password into the header (see Application.toAdmin), parsing moves it to the body
+            password = message.getField(554) if message.isSetField(554) else None
+            if password is None and message.getHeader().isSetField(554):
+                password = message.getHeader().getField(554)
+            if expected is not None and password != expected:
+                raise fix.RejectLogon("Invalid password")
+        return
+
+    def toApp(self, message, session_id):
+        return
+
+    def fromApp(self, message, session_id):
+        msg_type = message.getHeader().getField(35)
+        if msg_type == fix.MsgType_NewOrderSingle:
+            self.on_new_order(message, session_id)
+        elif msg_type == fix.MsgType_NewOrderList:
+            group = fixnn.NewOrderList.NoOrders()
+            for i in range(1, int(message.getField(73)) + 1):
+                message.getGroup(i, group)
+                self.on_new_order(group, session_id)
+        elif msg_type == fix.MsgType_OrderCancelRequest:
+            self.on_cancel(message, session_id)
+        elif msg_type == fix.MsgType_OrderCancelReplaceRequest:
+            self.on_replace(message, session_id)
+        elif msg_type == fix.MsgType_MarketDataRequest:
+            self.on_market_data_request(message, session_id)
+        elif msg_type == fix.MsgType_OrderStatusRequest:
+            self.on_order_status_request(message, session_id)
+        elif msg_type == fix.MsgType_OrderMassStatusRequest:
+            self.on_mass_status_request(message, session_id)
+        return
+
+    def gen_exec_id(self):
+        with self.lock:
+            self.exec_id += 1
+            return repr(self.exec_id)
+
+    def on_new_order(self, fields, session_id):
+        id = fields.getField(11)
+        order = SimulatedOrder(id, "SIM" + id, fields.getField(55), fields.getField(54), fields.getField(40),
+                               float(fields.getField(38)), float(fields.getField(44)) if fields.isSetField(44) else None)
+        self.order_count += 1
+        instruction = fields.getField(SIMULATOR_INSTRUCTION_TAG) if fields.isSetField(SIMULATOR_INSTRUCTION_TAG) else None
+        if instruction == "REJECT" or order.quantity <= 0:
+            order.status = fix.OrdStatus_REJECTED
+            with self.lock:
+                self.done_orders[(session_id.toString(), id)] = order
+            self.send_execution_report(order, fix.ExecType_REJECTED, session_id, text="Rejected by simulator")
+            return
+
+        self.send_execution_report(order, fix.ExecType_NEW, session_id)
+        if instruction == "FILL":
+            price = order.price if order.price is not None else self.get_book(order.symbol).mid
+            order.cum_qty = order.quantity
+            order.avg_price = price
+            order.status = fix.OrdStatus_FILLED
+            with self.lock:
+                self.done_orders[(session_id.toString(), id)] = order
+            self.send_execution_report(order, fix.ExecType_TRADE, session_id, order.quantity, price)
+        else:
+            with self.lock:
+                self.orders[(session_id.toString(), id)] = order
+
+    def on_cancel(self, message, session_id):
+        key = (session_id.toString(), message.getField(41))
+        with self.lock:
+            order = self.orders.pop(key, None)
+            if order is not None:
+                self.done_orders[key] = order
+        if order is None:
+            self.send_cancel_reject(message, session_id, fix.CxlRejResponseTo_ORDER_CANCEL_REQUEST)
+            return
+        order.id = message.getField(11)
+        order.status = fix.OrdStatus_CANCELED
+        self.send_execution_report(order, fix.ExecType_CANCELED, session_id, orig_id=message.getField(41))
+
+    def on_replace(self, message, session_id):
+        key = session_id.toString()
+        with self.lock:
+            order = self.orders.pop((key, message.getField(41)), None)
+            if order is not None:
+                order.id = message.getField(11)
+                self.orders[(key, order.id)] = order
+        if order is None:
+            self.send_cancel_reject(message, session_id, fix.CxlRejResponseTo_ORDER_CANCEL_REPLACE_REQUEST)
+            return
+        if message.isSetField(38):
+            order.quantity = float(message.getField(38))
+        if message.isSetField(44):
+            order.price = float(message.getField(44))
+        self.send_execution_report(order, fix.ExecType_REPLACED, session_id, orig_id=message.getField(41))
+
+    def on_order_status_request(self, message, session_id):
+        # status of an open or completed order, orders unknown to the simulator are reported as rejected
+        id = message.getField(11)
+        key = (session_id.toString(), id)
+        with self.lock:
+            order = self.orders.get(key) or self.done_orders.get(key)
+        text = None
+        if order is None:
+            order = SimulatedOrder(id, "NONE", message.getField(55), message.getField(54), fix.OrdType_LIMIT, 0.0, None)
+            order.status = fix.OrdStatus_REJECTED
+            text = "Unknown order"
+        fields = [(790, message.getField(790))] if message.isSetField(790) else []
+        self.send_execution_report(order, fix.ExecType_ORDER_STATUS, session_id, text=text, cl_ord_id=id, fields=fields)
+
+    def on_mass_status_request(self, message, session_id):
+        # status of every open order of the session, the last report has LastRptRequested=Y
+        request_id = message.getField(584)
+        session = session_id.toString()
+        with self.lock:
+            orders = list(dict((id(order), order) for (key, _), order in self.orders.items() if key == session).values())
+        if not orders:
+            order = SimulatedOrder(None, "NONE", "[N/A]", fix.Side_BUY, fix.OrdType_LIMIT, 0.0, None)
+            order.status = fix.OrdStatus_REJECTED
+            self.send_execution_report(order, fix.ExecType_ORDER_STATUS, session_id, text="No orders",
+                                       fields=[(584, request_id), (911, "0"), (912, "Y")])
+            return
+        for i, order in enumerate(orders):
+            self.send_execution_report(order, fix.ExecType_ORDER_STATUS, session_id,
+                                       fields=[(584, request_id), (911, str(len(orders))), (912, "Y" if i == len(orders) - 1 else "N")])
+
+    def send_execution_report(self, order, exec_type, session_id, last_qty=0.0, last_price=0.0, text=None, orig_id=None,
+                              cl_ord_id=None, fields=()):
+        # fields is [(tag, value)] of additional fields
+        report = fix.Message()
+        report.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+        report.getHeader().setField(fix.MsgType(fix.MsgType_ExecutionReport))
+        report.setField(fix.OrderID(order.order_id))
+        cl_ord_id = cl_ord_id or order.id
+        if cl_ord_id is not None:
+            report.setField(fix.ClOrdID(cl_ord_id))
+        if orig_id is not None:
+            report.setField(fix.OrigClOrdID(orig_id))
+        report.setField(fix.ExecID(self.gen_exec_id()))
+        report.setField(fix.ExecType(exec_type))
+        report.setField(fix.OrdStatus(order.status))
+        report.setField(fix.Symbol(order.symbol))
+        report.setField(fix.Side(order.side))
+        report.setField(fix.OrdType(order.order_type))
+        report.setField(fix.OrderQty(order.quantity))
+        if order.price is not None:
+            report.setField(fix.Price(order.price))
+        report.setField(fix.LastQty(last_qty))
+        report.setField(fix.LastPx(last_price))
+        report.setField(fix.CumQty(order.cum_qty))
+        report.setField(fix.LeavesQty(0.0 if order.status in (fix.OrdStatus_FILLED, fix.OrdStatus_CANCELED, fix.OrdStatus_REJECTED) else order.quantity - order.cum_qty))
+        report.setField(fix.AvgPx(order.avg_price))
+        if text is not None:
+            report.setField(fix.Text(text))
+        for tag, value in fields:
+            report.setField(tag, value)
+        report.setField(fix.TransactTime())
+        fix.Session.sendToTarget(report, session_id)
+
+    def send_cancel_reject(self, message, session_id, response_to):
+        reject = fix.Message()
+        reject.getHeader().setField(fix.BeginString(fix.BeginString_FIX44))
+        reject.getHeader().setField(fix.MsgType(fix.MsgType_OrderCancelReject))
+        reject.setField(fix.OrderID("NONE"))
+        reject.setField(fix.ClOrdID(message.getField(11)))
+        reject.setField(fix.OrigClOrdID(message.getField(41)))
+        reject.setField(fix.OrdStatus(fix.OrdStatus_REJECTED))
+        reject.setField(fix.CxlRejResponseTo(response_to))
+        reject.setField(fix.CxlRejReason(fix.CxlRejReason_UNKNOWN_ORDER))
+        reject.setField(fix.Text("Unknown order"))
+        fix.Session.sendToTarget(reject, session_id)
+
+    def get_book(self, symbol):
+        with self.lock:
+            book = self.books.get(symbol)
+            if book is None:
+                book = self.books[symbol] = SimulatedBook(symbol, self.market_data_depth, self.rnd)
+            return book
+
+    def on_market_data_request(self, message, session_id):
+        request_id = message.getField(262)
+        key = (session_id.toString(), request_id)
+        if message.getField(263) == fix.SubscriptionRequestType_DISABLE_PREVIOUS_SNAPSHOT:
+            with self.lock:
+                self.subscriptions.pop(key, None)
+            return
+
+        books = []
+        group = fixnn.MarketDataRequest.NoRelatedSym()
+        for i in range(1, int(message.getField(146)) + 1):
+            message.getGroup(i, group)
+            books.append(self.get_book(group.getField(55)))
+        # MarketDepth limits snapshots only, incremental refreshes cover all simulated levels
+        depth = int(message.getField(264)) if message.isSetField(264) else 0
+        entry_types = set()
+        group = fixnn.MarketDataRequest.NoMDEntryTypes()
+        for i in range(1, int(message.getField(267)) + 1 if message.isSetField(267) else 1):
+            message.getGroup(i, group)
+            entry_types.add(group.getField(269))
+        for book in books:
+            self.send_snapshot(book, request_id, session_id, depth, entry_types)
+
+        if message.getField(263) == fix.SubscriptionRequestType_SNAPSHOT_AND_UPDATES:
+            incremental = message.isSetField(265) and message.getField(265) == str(fix.MDUpdateType_INCREMENTAL_REFRESH)
+            copy = fix.SessionID()
+            copy.fromString(session_id.toString())
+            with self.lock:
+                self.subscriptions[key] = (copy, books, incremental, depth, entry_types)
+
+    def send_snapshot(self, book, request_id, session_id, depth=0, entry_types=None):
+        # entry_types is a set of MDEntryType values to send, None or empty for all
+        with self.lock:
+            entries = book.get_entries(depth)
+        snapshot = fixnn.MarketDataSnapshotFullRefresh()
+        snapshot.setField(fix.MDReqID(request_id))
+        snapshot.setField(fix.Symbol(book.symbol))
+        group = fixnn.MarketDataSnapshotFullRefresh.NoMDEntries()
+        for entry_type, price, size in entries:
+            if entry_types and entry_type not in entry_types:
+                continue
+            group.setField(fix.MDEntryType(entry_type))
+            group.setField(fix.MDEntryPx(price))
+            group.setField(fix.MDEntrySize(size))
+            snapshot.addGroup(group)
+        fix.Session.sendToTarget(snapshot, session_id)
+
+    def send_increment(self, book, changes, request_id, session_id, entry_types=None):
+        changes = [change for change in changes if not entry_types or change[0] in entry_types]
+        if not changes:
+            return
+        increment = fixnn.MarketDataIncrementalRefresh()
+        increment.setField(fix.MDReqID(request_id))
+        group = fixnn.MarketDataIncrementalRefresh.NoMDEntries()
+        for entry_type, price, size in changes:
+            group.setField(fix.MDUpdateAction(fix.MDUpdateAction_DELETE if size == 0 else fix.MDUpdateAction_CHANGE))
+            group.setField(fix.MDEntryType(entry_type))
+            group.setField(fix.Symbol(book.symbol))
+            group.setField(fix.MDEntryPx(price))
+            group.setField(fix.MDEntrySize(size))
+            increment.addGroup(group)
+        fix.Session.sendToTarget(increment, session_id)
+
+    def run_publisher(self):
+        interval = 1.0 / self.market_data_rate if self.market_data_rate > 0 else None
+        while interval is not None and not self.stopped.wait(interval):
+            with self.lock:
+                subscriptions = list(self.subscriptions.items())
+                changes = dict((book.symbol, book.move()) for book in self.books.values())
+            for (key, request_id), (session_id, subscribed, incremental, depth, entry_types) in subscriptions:
+                for book in subscribed:
+                    try:
+                        if incremental:
+                            self.send_increment(book, changes[book.symbol], request_id, session_id, entry_types)
+                        else:
+                            self.send_snapshot(book, request_id, session_id, depth, entry_types)
+                    except fix.SessionNotFound:
+                        break
+
+# End of SimulatorApplication
+
+
+class FixSimulator(object):
+
+    def __init__(self, config_file, market_data_rate=10.0, market_data_depth=10):
+        self.settings = load_settings(config_file)
+        self.application = SimulatorApplication(self.settings, market_data_rate, market_data_depth)
+        self.store_factory = fix.MemoryStoreFactory()
+        if self.settings.get().has("FileLogPath"):
+            self.log_factory = fix.FileLogFactory(self.settings)
+            self.acceptor = fix.SocketAcceptor(self.application, self.store_factory, self.settings, self.log_factory)
+        else:
+            self.log_factory = None
+            self.acceptor = fix.SocketAcceptor(self.application, self.store_factory, self.settings)
+
+    def start(self):
+        self.acceptor.start()
+
+    def stop(self):
+        self.acceptor.stop()
+        self.application.stop()
+
+# End of FixSimulator
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='FIX Gateway simulator')
+    parser.add_argument('config_file', type=str, help='Name of acceptor configuration file')
+    parser.add_argument("-r", "--market_data_rate", type=float, default=10.0, help="Market data updates per second per subscription")
+    parser.add_argument("-d", "--market_data_depth", type=int, default=10, help="Number of price levels per book side")
+    args = parser.parse_args()
+
+    try:
+        simulator = FixSimulator(args.config_file, args.market_data_rate, args.market_data_depth)
+        simulator.start()
+        print("Simulator started, press Ctrl+C to stop")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        simulator.stop()
+        print("Orders received: %s" % simulator.application.order_count)
+    except (fix.ConfigError, fix.RuntimeError) as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,159 @@
+#####################################################################################
+# Market data subscriptions of a FixSession managed per symbol: every symbol gets its own
+# MarketDataRequest (MDReqID), so symbols are subscribed and unsubscribed (SubscriptionRequestType 2)
+# one by one, each with its own depth and entry types.
+#####################################################################################
+
+import threading
+import quickfix as fix
+from fix_session import MarketDataRequest
+from fix_order_book import BookConflator
+
+UNSUBSCRIBE_WINDOW = 10000 # market data messages after an unsubscribe that may still carry its MDReqID
+
+
+class MarketDataSubscription(object):
+    __slots__ = ("symbol", "depth", "entry_types", "update_type", "request_id")
+
+    def __init__(self, symbol, depth, entry_types, update_type):
+        self.symbol = symbol
+        self.depth = depth
+        self.entry_types = tuple(entry_types)
+        self.update_type = update_type
+        self.request_id = None  # MDReqID of the subscribe request, needed to unsubscribe
+
+    def get_key(self):
+        return self.depth, self.entry_types, self.update_type
+
+    def get_request(self, subscription_type=fix.SubscriptionRequestType_SNAPSHOT_AND_UPDATES):
+        request = MarketDataRequest()
+        request.set_symbols([self.symbol])
+        request.set_depth(self.depth)
+        request.set_entry_types(self.entry_types)
+        request.set_update_type(self.update_type)
+        request.set_subscription_type(subscription_type)
+        return request
+
+    def __str__(self):
+        return "MarketDataSubscription: Symbol=%s, Depth=%s, EntryTypes=%s, RequestID=%s" % \
+               (self.symbol, self.depth, "".join(self.entry_types), self.request_id)
+
+# End of MarketDataSubscription
+
+
+class MarketDataSubscriptionManager(object):
+    # Installs itself as market data handler of the session in front of the previous one (the order books),
+    # so that updates of unsubscribed requests still in flight do not bring cleared books back
+
+    def __init__(self, session, update_type=fix.MDUpdateType_INCREMENTAL_REFRESH, unsubscribe_window=UNSUBSCRIBE_WINDOW):
+        self.session = session
+        self.update_type = update_type
+        self.subscriptions = {}      # symbol -> MarketDataSubscription
+        self.depths = {}             # symbol -> depth of its subscription, for conflation
+        # MDReqID of unsubscribed requests -> message count after which updates of the request are no longer expected,
+        # in the order of the unsubscribes. Gateways do not acknowledge unsubscribes, so ids are forgotten after a window
+        self.unsubscribed_ids = {}
+        self.unsubscribe_window = unsubscribe_window
+        self.message_count = 0  # market data messages received while there are unsubscribed ids
+        self.next_expiry = 0
+        self.conflator = None
+        self.lock = threading.Lock()
+        self.handler = session.application.market_data_handler
+        session.application.setMarketDataHandler(self)
+
+    def on_message(self, msg):
+        if self.unsubscribed_ids:
+            self.message_count += 1
+            if self.message_count >= self.next_expiry:
+                self.expire_unsubscribed_ids()
+            if msg.isSetField(262) and msg.getField(262) in self.unsubscribed_ids:
+                return
+        self.handler.on_message(msg)
+
+    def expire_unsubscribed_ids(self):
+        with self.lock:
+            unsubscribed_ids = self.unsubscribed_ids
+            while unsubscribed_ids:
+                request_id, expiry = next(iter(unsubscribed_ids.items()))
+                if expiry > self.message_count:
+                    self.next_expiry = expiry
+                    break
+                del unsubscribed_ids[request_id]
+
+    def subscribe(self, symbols, depth=0, entry_types=MarketDataRequest.DEFAULT_ENTRY_TYPES):
+        # subscribes symbols that are not subscribed yet, symbols subscribed with another depth or
+        # other entry types are unsubscribed and subscribed again. depth 0 is the full book
+        with self.lock:
+            for symbol in symbols:
+                subscription = MarketDataSubscription(symbol, depth, entry_types, self.update_type)
+                current = self.subscriptions.get(symbol)
+                if current is not None:
+                    if current.get_key() == subscription.get_key():
+                        continue
+                    self.send_unsubscribe(current)
+                request = subscription.get_request()
+                self.session.submit(request)
+                subscription.request_id = request.id
+                self.subscriptions[symbol] = subscription
+                self.depths[symbol] = depth
+
+    def unsubscribe(self, symbols):
+        # the books of unsubscribed symbols are cleared, they would not be updated anymore
+        with self.lock:
+            for symbol in symbols:
+                subscription = self.subscriptions.pop(symbol, None)
+                if subscription is not None:
+                    self.depths.pop(symbol, None)
+                    self.send_unsubscribe(subscription)
+
+    def unsubscribe_all(self):
+        self.unsubscribe(list(self.subscriptions))
+
+    def send_unsubscribe(self, subscription):
+        # SubscriptionRequestType 2 repeats the MDReqID of the subscribe request, so it is sent
+        # directly instead of through FixSession.submit which assigns a new id
+        request = subscription.get_request(fix.SubscriptionRequestType_DISABLE_PREVIOUS_SNAPSHOT)
+        request.set_id(subscription.request_id)
+        if not self.unsubscribed_ids:
+            self.next_expiry = self.message_count + self.unsubscribe_window
+        self.unsubscribed_ids[subscription.request_id] = self.message_count + self.unsubscribe_window
+        print("Sending %s" % request)
+        fix.Session.sendToTarget(request.get_fix_message(), self.session.get_session_id(request))
+        if self.session.metrics is not None:
+            self.session.metrics.messages_sent.inc(request.msg_type)
+        self.session.books.clear_book(subscription.symbol)
+
+    def resubscribe(self):
+        # subscribes everything again with new request ids, e.g. after a reconnect (gateways drop subscriptions on logout)
+        with self.lock:
+            self.unsubscribed_ids.clear() # request ids are not reused after a reconnect
+            for subscription in self.subscriptions.values():
+                request = subscription.get_request()
+                self.session.submit(request)
+                subscription.request_id = request.id
+
+    def get_subscription(self, symbol):
+        return self.subscriptions.get(symbol)
+
+    def get_symbols(self):
+        return sorted(self.subscriptions)
+
+    def start_conflation(self, listener, interval=0.1, depth=1):
+        # listener([BookSnapshot]) gets the latest state of the books updated in the last interval seconds
+        # instead of every update, see fix_order_book.BookConflator. Snapshots of subscribed symbols have
+        # the depth of their subscription (0 is the full book), other symbols get depth levels
+        if self.conflator is not None:
+            raise Exception("Conflation is already started")
+        self.conflator = BookConflator(self.session.books, listener, interval, depth, self.depths)
+        self.conflator.start()
+        return self.conflator
+
+    def stop_conflation(self):
+        if self.conflator is not None:
+            self.conflator.stop()
+            self.conflator = None
+
+    def __str__(self):
+        return "MarketDataSubscriptionManager: Symbols=%s" % self.get_symbols()
+
+# End of MarketDataSubscriptionManager
@@ -0,0 +1,196 @@
+#####################################################################################
+# Client side rate control of outbound messages: token buckets per session and per
+# destination, so that orders over the gateway throttle limits wait (or are rejected)
+# on the client instead of being rejected by the gateway.
+#####################################################################################
+
+import time
+import threading
+from collections import deque
+
+SPIN_THRESHOLD = 0.002 # waits shorter than this spin on time.sleep(0) instead of sleeping, sleep overshoots by 50-100us
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+def sleep_precise(delay):
+    # sleeps for delay seconds with sub-millisecond precision, the GIL is released while spinning
+    deadline = time.perf_counter() + delay
+    if delay > SPIN_THRESHOLD:
+        time.sleep(delay - SPIN_THRESHOLD)
+    while time.perf_counter() < deadline:
+        time.sleep(0)
+
+
+class TokenBucket(object):
+    # rate tokens per second with up to burst tokens saved up, not thread safe
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise Exception("Rate must be positive: %s" % rate)
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1))
+        self.tokens = self.burst
+        self.updated = time.perf_counter()
+
+    def get_delay(self, now, count=1):
+        # seconds until count tokens are available, 0 if they are available now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= count else (count - self.tokens) / self.rate
+
+    def take(self, count=1):
+        self.tokens -= count
+
+    def try_acquire(self, count=1):
+        if self.get_delay(time.perf_counter(), count) > 0:
+            return False
+        self.take(count)
+        return True
+
+    def acquire(self, count=1):
+        # blocks until count tokens are available
+        while True:
+            delay = self.get_delay(time.perf_counter(), count)
+            if delay <= 0:
+                self.take(count)
+                return
+            sleep_precise(delay)
+
+# End of TokenBucket
+
+
+class OrderScheduler(object):
+    # Sends messages immediately while the session and destination buckets have tokens, otherwise paces
+    # them from a background thread. Cancels and replaces go through a priority lane ahead of new orders.
+    POLICY_QUEUE = "queue"    # wait in a bounded queue, schedule() blocks while the queue is full
+    POLICY_REJECT = "reject"  # schedule() raises RateLimitExceeded, priority lane messages are always queued
+
+    def __init__(self, session_rate=None, session_burst=1, destination_rates=None, policy=POLICY_QUEUE, capacity=10000):
+        # session_rate is messages per second per session, destination_rates is {destination: (rate, burst)}
+        if policy not in (self.POLICY_QUEUE, self.POLICY_REJECT):
+            raise Exception("Unknown throttle policy: %s" % policy)
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.destination_rates = destination_rates or {}
+        self.policy = policy
+        self.capacity = capacity
+        self.session_buckets = {}
+        self.destination_buckets = {}
+        self.queue = deque()          # (send, buckets)
+        self.priority_queue = deque() # (send, buckets)
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.sent_count = 0
+        self.queued_count = 0
+        self.rejected_count = 0
+        self.max_queue_depth = 0
+        self.thread = threading.Thread(target=self.run, name="OrderScheduler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        # queued messages are still sent before the pacing thread exits
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def get_buckets(self, session, destination):
+        buckets = []
+        if self.session_rate:
+            bucket = self.session_buckets.get(session)
+            if bucket is None:
+                bucket = self.session_buckets[session] = TokenBucket(self.session_rate, self.session_burst)
+            buckets.append(bucket)
+        if destination in self.destination_rates:
+            bucket = self.destination_buckets.get(destination)
+            if bucket is None:
+                bucket = self.destination_buckets[destination] = TokenBucket(*self.destination_rates[destination])
+            buckets.append(bucket)
+        return buckets
+
+    def get_delay(self, buckets):
+        now = time.perf_counter()
+        delay = 0.0
+        for bucket in buckets:
+            delay = max(delay, bucket.get_delay(now))
+        return delay
+
+    def schedule(self, send, session=None, destination=None, priority=False):
+        # send() is called right away on this thread when under the limits, otherwise later on the pacing thread
+        with self.condition:
+            if self.stopped:
+                raise Exception("Scheduler is stopped")
+            buckets = self.get_buckets(session, destination)
+            # nothing may overtake queued messages of the same or higher priority
+            send_now = not self.priority_queue and (priority or not self.queue) and self.get_delay(buckets) == 0
+            if send_now:
+                for bucket in buckets:
+                    bucket.take()
+                self.sent_count += 1
+            elif priority:
+                self.priority_queue.append((send, buckets))
+            elif self.policy == self.POLICY_REJECT:
+                self.rejected_count += 1
+                raise RateLimitExceeded("Rate limit exceeded for session %s, destination %s, retry in %.6f s" %
+                                        (session, destination, self.get_delay(buckets)))
+            else:
+                while len(self.queue) >= self.capacity and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    raise Exception("Scheduler is stopped")
+                self.queue.append((send, buckets))
+
+            if not send_now:
+                self.queued_count += 1
+                self.max_queue_depth = max(self.max_queue_depth, len(self.queue) + len(self.priority_queue))
+                self.condition.notify_all()
+
+        if send_now:
+            send()
+
+    def run(self):
+        while True:
+            send = None
+            delay = 0.0
+            with self.condition:
+                while not self.priority_queue and not self.queue:
+                    if self.stopped:
+                        return
+                    self.condition.wait()
+
+                lane = self.priority_queue if self.priority_queue else self.queue
+                head, buckets = lane[0]
+                delay = self.get_delay(buckets)
+                if delay == 0:
+                    lane.popleft()
+                    for bucket in buckets:
+                        bucket.take()
+                    self.sent_count += 1
+                    send = head
+                    self.condition.notify_all()
+                elif delay > SPIN_THRESHOLD:
+                    # wakes up early if a priority message arrives
+                    self.condition.wait(delay - SPIN_THRESHOLD)
+                    continue
+
+            if send is not None:
+                try:
+                    send()
+                except Exception as e:
+                    print("Failed to send scheduled message: %s" % e)
+            else:
+                sleep_precise(delay)
+
+    def get_queue_depth(self):
+        return len(self.queue) + len(self.priority_queue)
+
+    def __str__(self):
+        return "OrderScheduler: Sent=%s, Queued=%s, Rejected=%s, QueueDepth=%s, MaxQueueDepth=%s" % \
+               (self.sent_count, self.queued_count, self.rejected_count, self.get_queue_depth(), self.max_queue_depth)
+
+# End of OrderScheduler